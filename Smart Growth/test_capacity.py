@@ -0,0 +1,84 @@
+import sys
+import os
+import pytest
+import allure
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.capacity import search
+
+
+def synthetic(limit, throughput_per_level=10.0, saturate_at=None):
+    """
+    合成的 measure: 负载不超过 limit 时满足 SLO；吞吐随负载线性增长，到 saturate_at 后不再增长
+    """
+    measured = []
+
+    def measure(level):
+        measured.append(level)
+        effective = min(level, saturate_at) if saturate_at is not None else level
+        return {
+            "level": level,
+            "turns": 100,
+            "errors": 0,
+            "throughput": effective * throughput_per_level,
+            "error_rate": 0.0,
+            "p50_ms": 100.0,
+            "p99_ms": 500.0 if level <= limit else 5000.0,
+        }
+    return measure, measured
+
+
+SLO = {"p99_ms": 1000, "error_rate": 0.01}
+
+
+@allure.feature("容量探测")
+@allure.story("搜索")
+class TestCapacitySearch:
+
+    def test_binary_finds_limit(self):
+        measure, measured = synthetic(limit=13)
+        result = search(measure, 1, 50, strategy="binary", slo=SLO)
+        assert result["max_sustainable"] == 13
+        assert len(measured) <= 10
+
+    @pytest.mark.parametrize("resolution", [0.5, 0.1, 0])
+    def test_binary_terminates_with_sub_integer_resolution(self, resolution):
+        measure, measured = synthetic(limit=7)
+        result = search(measure, 1, 20, strategy="binary", slo=SLO, resolution=resolution)
+        assert result["max_sustainable"] == 7
+        assert len(measured) == len(set(measured)), "同一负载被重复测量"
+
+    def test_binary_float_bounds(self):
+        measure, _ = synthetic(limit=2.3)
+        result = search(measure, 0.5, 8.0, strategy="binary", slo=SLO, resolution=0.1)
+        assert 2.2 <= result["max_sustainable"] <= 2.3
+
+    def test_binary_start_fails(self):
+        measure, measured = synthetic(limit=0)
+        result = search(measure, 1, 20, strategy="binary", slo=SLO)
+        assert result["max_sustainable"] is None
+        assert measured == [1]
+
+    def test_binary_max_passes(self):
+        measure, measured = synthetic(limit=100)
+        result = search(measure, 1, 20, strategy="binary", slo=SLO)
+        assert result["max_sustainable"] == 20
+        assert measured == [1, 20]
+
+    def test_step_stops_at_slo(self):
+        measure, measured = synthetic(limit=4)
+        result = search(measure, 1, 10, step=1, strategy="step", slo=SLO)
+        assert result["max_sustainable"] == 4
+        assert measured == [1, 2, 3, 4, 5]
+
+    def test_step_stops_at_plateau(self):
+        measure, _ = synthetic(limit=100, saturate_at=3)
+        result = search(measure, 1, 10, step=1, strategy="step", slo=SLO)
+        assert result["max_sustainable"] == 3
+        assert "拐点" in result["stop_reason"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
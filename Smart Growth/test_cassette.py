@@ -0,0 +1,67 @@
+import sys
+import os
+import pytest
+import allure
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.tool import get_token
+from common import cassette
+from common import http_client
+from common import product_catalog
+from common.mock_server import MockServer
+
+
+@pytest.fixture
+def mock_server(tmp_path, monkeypatch):
+    """启动 mock 服务；录制文件和商品目录缓存都写到临时目录"""
+    monkeypatch.setattr(cassette, "CASSETTE_DIR", str(tmp_path / "cassettes"))
+    monkeypatch.setattr(product_catalog, "CACHE_DIR", str(tmp_path / "cache"))
+    os.makedirs(product_catalog.CACHE_DIR)
+    server = MockServer(config={"seed": 1}, port=0)
+    http_client.set_base_url(server.start())
+    product_catalog.clear()
+    yield server
+    server.stop()
+    http_client.set_base_url(None)
+    product_catalog.clear()
+
+
+def catalog_files():
+    return [name for name in os.listdir(product_catalog.CACHE_DIR) if name.endswith(".json")]
+
+
+@allure.feature("接口录制")
+@allure.story("商品目录")
+class TestCassetteCatalog:
+
+    def test_record_clear_cache_replay(self, mock_server, monkeypatch):
+        token = get_token()
+        # 按线上地址处理，商品目录会写入磁盘缓存
+        monkeypatch.setattr(http_client, "is_loopback", lambda url=None: False)
+
+        # 磁盘上已有目录缓存时，录制也必须包含商品列表请求
+        expected = product_catalog.get_catalog(token).items
+        assert catalog_files()
+        product_catalog.clear()
+
+        with cassette.use("catalog", mode="record") as tape:
+            recorded = product_catalog.get_catalog(token)
+        assert recorded.items == expected
+        assert len(tape) > 0
+
+        # 清空缓存并停掉 mock 服务，回放只能依赖录制文件
+        product_catalog.clear()
+        for name in catalog_files():
+            os.unlink(os.path.join(product_catalog.CACHE_DIR, name))
+        mock_server.stop()
+
+        with cassette.use("catalog", mode="replay"):
+            replayed = product_catalog.get_catalog(token)
+        assert replayed.items == expected
+        assert not catalog_files()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
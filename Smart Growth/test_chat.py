@@ -1,25 +1,18 @@
 import sys
 import os
-import yaml
 import json
 import time
 import pytest
 import allure
 from api.chat import chat
-from common.tool import get_token
+from common import metrics
+from common import depth_analysis
+from common import cassette
+from common import pacing
+from common.conversation import payload_sizes, pacing_context
 
 
-def load_yaml_config():
-    """加载聊天测试专用的 yaml 配置"""
-    filepath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "chat_data.yaml")
-    with open(filepath, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
-
-
-CONFIG = load_yaml_config()
 ALLURE_RESULTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reports", "allure-results")
-TOKEN = get_token()
-WAIT_AFTER_REPLY = 10
 
 
 def generate_username():
@@ -48,16 +41,27 @@ def safe_print(text):
 class TestChatSession:
     """聊天测试类"""
 
+    @pytest.fixture(autouse=True)
+    def use_cassette(self):
+        """CASSETTE_MODE=record 时录制聊天 / 商品接口，replay 时直接回放"""
+        with cassette.use("chat"):
+            yield
+
     @allure.feature("普通聊天")
     @allure.story("多轮对话")
-    def test_multi_round_chat(self):
+    def test_multi_round_chat(self, token, chat_config):
         """普通多轮对话测试"""
+        # 指标是进程级的，先清空，报告里只包含本用例的请求
+        metrics.reset()
         username = generate_username()
-        questions = CONFIG.get('test_questions', ['你好'])
+        # 轮次之间的等待策略，见 yaml 中的 pacing 配置
+        pacer = pacing.from_config(chat_config.get('pacing'), seconds=10)
+        questions = chat_config.get('test_questions', ['你好'])
 
         allure.attach(username, name="用户名", attachment_type=allure.attachment_type.TEXT)
 
         messages_history = []
+        depth_recorder = depth_analysis.DepthRecorder()
 
         for i, txt in enumerate(questions, 1):
             with allure.step(f"第 {i} 轮对话: {txt[:30]}"):
@@ -71,7 +75,10 @@ class TestChatSession:
                 }
                 messages_history.append(user_msg)
 
-                response = chat(txt, TOKEN, username, full_messages=messages_history)
+                sent = time.perf_counter()
+                response = chat(txt, token, username, full_messages=messages_history)
+                latency = time.perf_counter() - sent
+                depth_recorder.record(i, *payload_sizes(response), latency)
                 result = response.json()
 
                 assert result['code'] == 200
@@ -95,17 +102,23 @@ class TestChatSession:
                         messages_history.append(assistant_msg)
 
             if i < len(questions):
-                time.sleep(WAIT_AFTER_REPLY)
+                pacer.wait(pacing_context(username, token, chat_config.get('shop_id', "585"), i, full_reply))
+
+        metrics.attach_to_allure()
+        depth_analysis.report(depth_recorder, "chat")
 
 
 if __name__ == "__main__":
-    pytest.main([__file__, "-v", "-s", f"--alluredir={ALLURE_RESULTS_DIR}", "--clean-alluredir"])
+    # 结果跨次累计（报告历史增量累计），按 data/clean_cache.yaml 的保留策略清理较早的执行批次
+    pytest.main([__file__, "-v", "-s", f"--alluredir={ALLURE_RESULTS_DIR}"])
+    from common import clean_cache
+    retention = clean_cache.load_config()["allure_results"]
+    clean_cache.prune_results(ALLURE_RESULTS_DIR, retention.get("keep_runs"), retention.get("max_age_days"))
 
     allure_report_dir = os.path.join(os.path.dirname(ALLURE_RESULTS_DIR), "allure-report")
-    os.system(f'allure generate "{ALLURE_RESULTS_DIR}" -o "{allure_report_dir}" --clean')
+    from common import report_builder
+    report_builder.build(ALLURE_RESULTS_DIR, allure_report_dir)
 
-    from common.email_sender import send_test_report
-    send_test_report(
-        report_dir=allure_report_dir,
-        recipients=["zhaowenlong@zhijianai.cn"]
-    )
+    # 报告进入投递队列，由后台 worker 打包发送（失败自动重试），当前进程不等待
+    from common import report_queue
+    report_queue.enqueue(allure_report_dir, recipients=["zhaowenlong@zhijianai.cn"])
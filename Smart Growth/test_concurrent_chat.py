@@ -2,8 +2,6 @@ import sys
 import os
 import json
 import time
-import random
-import yaml
 import pytest
 import allure
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -11,44 +9,53 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 # 添加项目根目录到 Python 路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from api.chat import chat
-from api.product import get_product_by_index
-from common.tool import get_token
+from common import metrics
+from common import depth_analysis
+from common import pacing
+from common import account_pool
+from common.conversation import run_single_conversation, chain
+from common.result_sink import ResultSink
 
 
-def load_yaml_config():
-    """读取并发对话测试配置"""
-    filepath = os.path.join(
-        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-        "data",
-        "concurrent_chat.yaml"
-    )
-    with open(filepath, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
-
-
-# 加载配置
-_config = load_yaml_config()
-CONCURRENT_COUNT = _config['concurrent_config']['concurrent_count']
-WAIT_BETWEEN_QUESTIONS = _config['concurrent_config']['wait_between_questions']
-QUESTIONS = _config['conversations'][0]['questions']
-SHOP_ID = _config['product_config']['shop_id']
-PRODUCT_INDEX = _config['product_config']['product_index']
-
-
-def generate_username():
-    """生成 tb_时间戳 格式的用户名"""
-    return f"tb_{int(time.time() * 1000)}_{random.randint(1000, 9999)}"
-
+@pytest.fixture(scope="module")
+def settings(concurrent_config):
+    """
+    并发对话测试参数，由 conftest 中的 concurrent_config 按需读取，收集用例时不解析配置
 
-def extract_reply(result):
-    """从响应中提取 AI 回复内容"""
-    replies = [
-        action['payload']['content']
-        for action in result['data']['ai_actions']
-        if action.get('actionType') == 'sendMessage'
-    ]
-    return '\n\n'.join(replies)
+    返回:
+        dict: {"count", "questions", "shop_id", "engine", "processes", "open_loop", "capacity", "adaptive", "pacer"}
+    """
+    concurrent = concurrent_config['concurrent_config']
+    return {
+        "count": concurrent['concurrent_count'],
+        "questions": concurrent_config['conversations'][0]['questions'],
+        "shop_id": concurrent_config['product_config']['shop_id'],
+        # 执行引擎: thread（每个对话一个线程）/ asyncio（单事件循环驱动全部对话）
+        "engine": concurrent.get('engine', 'thread'),
+        # worker 进程数，大于 1（或为 0，即全部 CPU 核）时使用多进程驱动
+        "processes": concurrent.get('processes', 1),
+        "open_loop": concurrent_config.get('open_loop_config') or {},
+        "capacity": concurrent_config.get('capacity_config') or {},
+        "adaptive": concurrent_config.get('adaptive_config') or {},
+        # 轮次之间的等待策略，mode 为 fixed 时等待 wait_between_questions 秒
+        "pacer": pacing.from_config(concurrent_config.get('pacing'), seconds=concurrent['wait_between_questions']),
+    }
+
+
+def conversation_tokens(token):
+    """启用账号池（data/accounts.yaml）时返回账号池，对话分散到多个账号；否则返回 token"""
+    pool = account_pool.from_config()
+    if pool is not None:
+        print(f"[账号池] {len(pool.accounts)} 个账号，分配方式: {pool.strategy}")
+        return pool
+    return token
+
+
+def report_accounts(tokens):
+    """使用账号池时打印各账号的延迟 / 错误统计并附加到 Allure"""
+    if isinstance(tokens, account_pool.AccountPool):
+        print(account_pool.format_table(tokens.summary()))
+        account_pool.attach_to_allure(tokens)
 
 
 def safe_print(text):
@@ -59,139 +66,43 @@ def safe_print(text):
         print(text.encode('utf-8', errors='replace').decode('utf-8', errors='replace'))
 
 
-def run_single_conversation(conversation_id, token, product, questions):
-    """
-    运行单个对话
-
-    参数:
-        conversation_id: 对话ID
-        token: 登录 token
-        product: 商品信息
-        questions: 问题列表
-
-    返回:
-        dict: 对话结果
-    """
-    username = generate_username()
-    messages_history = []
-    results = []
-
-    start_time = time.time()
-
-    try:
-        for i, question in enumerate(questions, 1):
-            # 构建用户消息
-            now = int(time.time())
-            user_msg = {
-                "role": "user",
-                "content": question,
-                "created_at": now
-            }
-            messages_history.append(user_msg)
-
-            # 调用聊天接口
-            response = chat(
-                question,
-                token,
-                username,
-                inquiry_product=product,
-                full_messages=messages_history,
-                shop_id="585"
-            )
-            result = response.json()
-
-            # 验证响应
-            if result.get('code') != 200:
-                return {
-                    "conversation_id": conversation_id,
-                    "success": False,
-                    "error": f"接口返回异常: {result.get('message')}",
-                    "duration": time.time() - start_time
-                }
-
-            if result.get('message') != 'success':
-                return {
-                    "conversation_id": conversation_id,
-                    "success": False,
-                    "error": f"接口返回 message 异常: {result.get('message')}",
-                    "duration": time.time() - start_time
-                }
-
-            if len(result.get('data', {}).get('ai_actions', [])) == 0:
-                return {
-                    "conversation_id": conversation_id,
-                    "success": False,
-                    "error": "AI 没有返回任何回复",
-                    "duration": time.time() - start_time
-                }
-
-            # 提取 AI 回复
-            full_reply = extract_reply(result)
-            if len(full_reply) == 0:
-                return {
-                    "conversation_id": conversation_id,
-                    "success": False,
-                    "error": "AI 回复内容为空",
-                    "duration": time.time() - start_time
-                }
-
-            # 将 AI 的每条回复都添加到历史中
-            now = int(time.time())
-            for action in result['data']['ai_actions']:
-                if action.get('actionType') == 'sendMessage':
-                    assistant_msg = {
-                        "role": "assistant",
-                        "content": action.get('payload', {}).get('content', ''),
-                        "created_at": now
-                    }
-                    messages_history.append(assistant_msg)
-
-            results.append({
-                "question": question,
-                "reply": full_reply[:100] + "..." if len(full_reply) > 100 else full_reply
-            })
-
-            # 等待 AI 回复落库
-            if i < len(questions):
-                time.sleep(WAIT_BETWEEN_QUESTIONS)
-
-        duration = time.time() - start_time
-        return {
-            "conversation_id": conversation_id,
-            "success": True,
-            "results": results,
-            "duration": duration,
-            "total_messages": len(messages_history)
-        }
-
-    except Exception as e:
-        return {
-            "conversation_id": conversation_id,
-            "success": False,
-            "error": str(e),
-            "duration": time.time() - start_time
-        }
+def print_conversation_result(result):
+    """打印单个对话的执行结果"""
+    conversation_id = result['conversation_id']
+    if result['success']:
+        print(f"\n[对话 {conversation_id}] 成功! 耗时: {result['duration']:.2f}s, 消息数: {result['total_messages']}")
+        for j, r in enumerate(result['results'], 1):
+            print(f"  [{j}] Q: {r['question'][:30]}... -> A: {r['reply'][:50]}...")
+    else:
+        print(f"\n[对话 {conversation_id}] 失败! 错误: {result['error']}")
 
 
 @allure.feature("并发对话测试")
 @allure.story("多并发对话稳定性测试")
-def test_concurrent_conversations():
+def test_concurrent_conversations(settings, token, concurrent_product, http):
     """
     测试场景：同时运行多个对话，测试 AI 的稳定性
     并发数：从配置文件读取
     """
-    allure.dynamic.title(f"并发对话稳定性测试 - {CONCURRENT_COUNT}个对话同时运行")
+    count, engine, processes = settings['count'], settings['engine'], settings['processes']
+    questions, shop_id, pacer = settings['questions'], settings['shop_id'], settings['pacer']
+    allure.dynamic.title(f"并发对话稳定性测试 - {count}个对话同时运行")
 
     print(f"\n{'='*80}")
     print(f"并发对话测试开始")
-    print(f"并发数: {CONCURRENT_COUNT}")
-    print(f"每轮问题数: {len(QUESTIONS)}")
+    print(f"并发数: {count}")
+    print(f"执行引擎: {engine}")
+    print(f"进程数: {processes or os.cpu_count()}")
+    print(f"轮次间等待: {pacer.mode}")
+    print(f"每轮问题数: {len(questions)}")
     print(f"{'='*80}")
 
-    # 获取 token 和商品
-    token = get_token()
-    product = get_product_by_index(token, shop_id=SHOP_ID, index=PRODUCT_INDEX)
-    assert product is not None, "获取商品失败"
+    # 连接池大小与并发数保持一致，保证每个 worker 都能复用自己的长连接
+    http.configure(pool_size=count)
+    http.reset_stats()
+    metrics.reset()
+
+    product = concurrent_product
 
     allure.attach(
         json.dumps(product, ensure_ascii=False, indent=2),
@@ -200,60 +111,262 @@ def test_concurrent_conversations():
     )
 
     print(f"\n[测试商品] {product['title']}")
+    tokens = conversation_tokens(token)
 
-    # 并发运行对话
-    all_results = []
+    # 并发运行对话，每轮 / 每个对话的结果流式写入 reports/requests.jsonl，内存中只保留汇总
+    sink = ResultSink()
+    depth_recorder = depth_analysis.DepthRecorder()
+    on_turn = chain(depth_recorder, sink.on_turn)
+    on_result = chain(print_conversation_result, sink.on_result)
     start_time = time.time()
 
-    with ThreadPoolExecutor(max_workers=CONCURRENT_COUNT) as executor:
-        # 提交所有任务
-        futures = {
-            executor.submit(
-                run_single_conversation,
-                i,
-                token,
-                product,
-                QUESTIONS
-            ): i
-            for i in range(CONCURRENT_COUNT)
-        }
-
-        # 收集结果
-        for future in as_completed(futures):
-            result = future.result()
-            all_results.append(result)
-
-            conversation_id = result['conversation_id']
-            if result['success']:
-                print(f"\n[对话 {conversation_id}] 成功! 耗时: {result['duration']:.2f}s, 消息数: {result['total_messages']}")
-                for j, r in enumerate(result['results'], 1):
-                    print(f"  [{j}] Q: {r['question'][:30]}... -> A: {r['reply'][:50]}...")
-            else:
-                print(f"\n[对话 {conversation_id}] 失败! 错误: {result['error']}")
+    if processes != 1:
+        from common.process_driver import run_processes
+        run_processes(
+            count,
+            product,
+            questions,
+            wait_between_questions=pacer,
+            shop_id=shop_id,
+            processes=processes or None,
+            engine=engine,
+            on_result=on_result,
+            on_turn=on_turn,
+            keep_results=False,
+            pool=tokens if tokens is not token else None
+        )
+    elif engine == 'asyncio':
+        from common.async_conversation import run_conversations
+        run_conversations(
+            count,
+            tokens,
+            product,
+            questions,
+            wait_between_questions=pacer,
+            shop_id=shop_id,
+            on_result=on_result,
+            on_turn=on_turn,
+            keep_results=False
+        )
+    else:
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            # 提交所有任务
+            futures = {
+                executor.submit(
+                    run_single_conversation,
+                    i,
+                    tokens,
+                    product,
+                    questions,
+                    pacer,
+                    shop_id,
+                    on_turn
+                ): i
+                for i in range(count)
+            }
+
+            # 收集结果
+            for future in as_completed(futures):
+                on_result(future.result())
 
     total_duration = time.time() - start_time
+    sink.close()
 
     # 统计结果
-    success_count = sum(1 for r in all_results if r['success'])
-    fail_count = sum(1 for r in all_results if not r['success'])
+    summary = sink.summary()
+    success_count = summary['success']
+    fail_count = summary['failed']
 
     print(f"\n{'='*80}")
     print(f"测试完成!")
     print(f"总耗时: {total_duration:.2f}s")
-    print(f"成功: {success_count}/{CONCURRENT_COUNT}")
-    print(f"失败: {fail_count}/{CONCURRENT_COUNT}")
+    print(f"成功: {success_count}/{count}")
+    print(f"失败: {fail_count}/{count}")
     print(f"{'='*80}")
 
-    # 附加结果到 Allure
+    # 连接复用统计
+    pool_stats = http.get_stats()
+    print(f"请求数: {pool_stats['requests']}, 新建连接: {pool_stats['new_connections']}, "
+          f"复用率: {pool_stats['reuse_rate'] * 100:.1f}%")
+    allure.attach(
+        json.dumps(pool_stats, ensure_ascii=False, indent=2),
+        name="连接池统计",
+        attachment_type=allure.attachment_type.JSON
+    )
+
+    # 每次接口调用的延迟分布
+    metrics_summary = metrics.summary()
+    print(metrics.format_table(metrics_summary))
+    metrics.attach_to_allure(summary_data=metrics_summary)
+    report_accounts(tokens)
+
+    # 延迟随对话深度的变化
+    depth_analysis.report(depth_recorder, "concurrent_chat")
+
+    # 附加结果汇总到 Allure，逐条结果见 reports/requests.jsonl
     allure.attach(
-        json.dumps(all_results, ensure_ascii=False, indent=2),
-        name="所有对话结果",
+        json.dumps(summary, ensure_ascii=False, indent=2),
+        name="对话结果汇总",
         attachment_type=allure.attachment_type.JSON
     )
 
     # 断言所有对话都成功
     assert fail_count == 0, f"有 {fail_count} 个对话失败"
-    assert success_count == CONCURRENT_COUNT, f"只有 {success_count}/{CONCURRENT_COUNT} 个对话成功"
+    assert success_count == count, f"只有 {success_count}/{count} 个对话成功"
+
+
+@allure.feature("并发对话测试")
+@allure.story("开环压测")
+def test_open_loop_conversations(settings, request):
+    """
+    测试场景：按目标速率持续发起新对话（开环），统计修正 coordinated omission 后的延迟
+    到达方式、速率、持续时间：从配置文件读取
+    """
+    open_loop = settings['open_loop']
+    if not open_loop.get('enabled'):
+        pytest.skip("未启用开环压测（open_loop_config.enabled）")
+    questions, shop_id, pacer = settings['questions'], settings['shop_id'], settings['pacer']
+
+    from common.open_loop import run_open_loop, format_report
+
+    rate = open_loop.get('rate', 1)
+    duration = open_loop.get('duration', 60)
+    arrival = open_loop.get('arrival', 'poisson')
+    allure.dynamic.title(f"开环压测 - {arrival} 到达, {rate} 个对话/秒, 持续 {duration}s")
+
+    metrics.reset()
+    # 用例未启用时直接跳过，不登录也不获取商品
+    token = request.getfixturevalue('token')
+    product = request.getfixturevalue('concurrent_product')
+
+    sink = ResultSink()
+    tokens = conversation_tokens(token)
+    report = run_open_loop(
+        tokens,
+        product,
+        questions,
+        rate=rate,
+        duration=duration,
+        arrival=arrival,
+        wait_between_questions=pacer,
+        shop_id=shop_id,
+        max_in_flight=open_loop.get('max_in_flight', 0),
+        seed=open_loop.get('seed'),
+        on_result=chain(print_conversation_result, sink.on_result),
+        on_turn=sink.on_turn,
+        keep_results=False
+    )
+    sink.close()
+
+    table = format_report(report)
+    print(f"\n{'='*80}\n{table}\n{'='*80}")
+    allure.attach(table, name="延迟百分位", attachment_type=allure.attachment_type.TEXT)
+    allure.attach(
+        json.dumps({k: v for k, v in report.items() if k not in ('results', 'histograms')},
+                   ensure_ascii=False, indent=2),
+        name="开环压测报告",
+        attachment_type=allure.attachment_type.JSON
+    )
+    metrics.attach_to_allure()
+    report_accounts(tokens)
+
+    assert report['failed'] == 0, f"有 {report['failed']}/{report['conversations']} 个对话失败"
+
+
+@allure.feature("并发对话测试")
+@allure.story("容量探测")
+def test_capacity_search(settings, request):
+    """
+    测试场景：逐级提高并发数（或到达速率），每一级在稳定窗口内统计吞吐、p99、错误率，
+    找出满足 SLO 的最大负载
+    搜索方式、范围、SLO：从配置文件读取
+    """
+    capacity = settings['capacity']
+    if not capacity.get('enabled'):
+        pytest.skip("未启用容量探测（capacity_config.enabled）")
+    questions, shop_id, pacer = settings['questions'], settings['shop_id'], settings['pacer']
+
+    from common.capacity import run_capacity_search, format_curve, attach_to_allure
+
+    allure.dynamic.title(f"容量探测 - {capacity.get('mode', 'concurrency')} / {capacity.get('search', 'step')}")
+
+    metrics.reset()
+    # 用例未启用时直接跳过，不登录也不获取商品
+    token = request.getfixturevalue('token')
+    product = request.getfixturevalue('concurrent_product')
+
+    tokens = conversation_tokens(token)
+    result = run_capacity_search(tokens, product, questions, capacity,
+                                 wait_between_questions=pacer, shop_id=shop_id)
+
+    print(f"\n{'='*80}\n{format_curve(result)}\n{'='*80}")
+    attach_to_allure(result)
+    metrics.attach_to_allure()
+    report_accounts(tokens)
+
+    assert result['max_sustainable'] is not None, f"起始负载即不满足 SLO: {result['stop_reason']}"
+
+
+@allure.feature("并发对话测试")
+@allure.story("自适应并发稳定性测试")
+def test_adaptive_conversations(settings, request):
+    """
+    测试场景：长时间持续发起对话，进行中的对话数按 AIMD 自适应调整，使服务端保持在容量附近
+    持续时间、上限范围、拥塞判断：从配置文件读取
+    """
+    adaptive = settings['adaptive']
+    if not adaptive.get('enabled'):
+        pytest.skip("未启用自适应并发（adaptive_config.enabled）")
+    questions, shop_id, pacer = settings['questions'], settings['shop_id'], settings['pacer']
+
+    from common import aimd
+
+    duration = adaptive.get('duration', 1800)
+    engine = adaptive.get('engine', 'thread')
+    allure.dynamic.title(f"自适应并发稳定性测试 - 持续 {duration}s")
+
+    metrics.reset()
+    # 用例未启用时直接跳过，不登录也不获取商品
+    token = request.getfixturevalue('token')
+    product = request.getfixturevalue('concurrent_product')
+
+    # 上限变化与每轮延迟写入同一个 reports/requests.jsonl
+    sink = ResultSink()
+    limiter = aimd.from_config(adaptive, on_change=sink.on_limit)
+    tokens = conversation_tokens(token)
+    report = aimd.run_adaptive(
+        limiter,
+        duration,
+        tokens,
+        product,
+        questions,
+        wait_between_questions=pacer,
+        shop_id=shop_id,
+        engine=engine,
+        on_result=chain(print_conversation_result, sink.on_result),
+        on_turn=sink.on_turn
+    )
+    sink.close()
+
+    print(f"\n{'='*80}")
+    print(f"对话数: {report['conversations']}, 成功: {report['success']}, 失败: {report['failed']}")
+    print(f"并发上限: {report['limit']}")
+    print(f"{'='*80}")
+    print(metrics.format_table(metrics.summary()))
+
+    aimd.attach_to_allure(limiter)
+    metrics.attach_to_allure()
+    report_accounts(tokens)
+    allure.attach(
+        json.dumps(sink.summary(), ensure_ascii=False, indent=2),
+        name="对话结果汇总",
+        attachment_type=allure.attachment_type.JSON
+    )
+
+    assert report['conversations'] > 0, "没有完成任何对话"
+    failure_rate = report['failed'] / report['conversations']
+    assert failure_rate <= adaptive.get('max_failure_rate', 0.05), \
+        f"对话失败比例 {failure_rate:.2%}（{report['failed']}/{report['conversations']}）"
 
 
 if __name__ == "__main__":
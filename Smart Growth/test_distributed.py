@@ -0,0 +1,104 @@
+import sys
+import os
+import json
+import time
+import socket
+import threading
+import subprocess
+import pytest
+import allure
+
+# 添加项目根目录到 Python 路径
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from common import http_client
+from common import metrics
+from common.distributed import Coordinator, format_report, _Channel
+from common.mock_server import MockServer
+
+AGENTS = 3
+SCENARIO = {
+    "count": 9,
+    "questions": ["效果怎么样？", "如何使用？", "保质期多久？"],
+    "shop_id": "585",
+    "product": {"id": "1", "title": "测试商品", "url": "https://item.taobao.com/item.htm?id=1"},
+    "engine": "thread",
+    "processes": 1,
+    "wait_between_questions": 0,
+    "pacing": None,
+}
+
+
+@allure.feature("压测框架")
+@allure.story("分布式压测")
+def test_distributed_localhost():
+    """
+    测试场景：本机启动 mock 服务、协调者和多个 agent 进程（通过 TCP 通信），
+    校验配额切分、结果回传和直方图合并
+    """
+    metrics.reset()
+    with MockServer(config={"seed": 1}, port=0) as server:
+        scenario = dict(SCENARIO, base_url=server.url)
+        with Coordinator("127.0.0.1", 0, expected_agents=AGENTS) as coordinator:
+            agents = [
+                subprocess.Popen(
+                    [sys.executable, "-m", "common.distributed", "agent",
+                     "--coordinator", f"127.0.0.1:{coordinator.port}", "--id", f"agent-{i}"],
+                    cwd=ROOT_DIR,
+                )
+                for i in range(AGENTS)
+            ]
+            try:
+                coordinator.wait_for_agents(timeout=60)
+                results = []
+                report = coordinator.run(scenario, on_result=results.append, lead_time=1.0)
+            finally:
+                coordinator.close()
+                for process in agents:
+                    process.wait(timeout=30)
+
+    print(format_report(report))
+    allure.attach(json.dumps(report, ensure_ascii=False, indent=2), name="分布式压测报告",
+                  attachment_type=allure.attachment_type.JSON)
+
+    assert report['success'] == SCENARIO['count'], f"成功 {report['success']}/{SCENARIO['count']}"
+    assert sorted(r['conversation_id'] for r in results) == list(range(SCENARIO['count']))
+    assert all(agent['count'] == SCENARIO['count'] // AGENTS for agent in report['agents'].values())
+    assert report['metrics']['latency_ms']['chat']['count'] == SCENARIO['count'] * len(SCENARIO['questions'])
+
+
+def hung_agent(port, agent_id):
+    """注册并响应时钟同步，收到任务后既不执行也不断开连接，直到协调者通知退出"""
+    channel = _Channel(socket.create_connection(("127.0.0.1", port)))
+    channel.send({"type": "register", "agent_id": agent_id, "weight": 1})
+    while True:
+        message = channel.recv()
+        if message is None or message["type"] == "stop":
+            break
+        if message["type"] == "ping":
+            channel.send({"type": "pong", "time": time.time()})
+    channel.close()
+
+
+@allure.feature("压测框架")
+@allure.story("分布式压测")
+def test_coordinator_gives_up_on_hung_agent():
+    """测试场景：agent 卡住但连接未断开，协调者在超时后把它标记为失败并返回"""
+    scenario = dict(SCENARIO, base_url="http://127.0.0.1:9")
+    with Coordinator("127.0.0.1", 0, expected_agents=1) as coordinator:
+        agent = threading.Thread(target=hung_agent, args=(coordinator.port, "hung"), daemon=True)
+        agent.start()
+        coordinator.wait_for_agents(timeout=10)
+        start = time.monotonic()
+        report = coordinator.run(scenario, lead_time=0.1, timeout=0.5)
+        elapsed = time.monotonic() - start
+    agent.join(timeout=5)
+
+    assert elapsed < 5
+    assert report['conversations'] == 0
+    assert "仍未结束" in report['agents']['hung']['error']
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "-s"])
@@ -0,0 +1,96 @@
+import sys
+import os
+import json
+import time
+import pytest
+import allure
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.product import get_product_by_index
+from common.tool import get_token
+from common import http_client
+from common import metrics
+from common import product_catalog
+from common.conversation import run_single_conversation
+from common.mock_server import MockServer
+
+# mock 服务延迟为 0，测到的延迟即压测框架自身（客户端 + 本地回环）的开销
+CONVERSATIONS = 20
+QUESTIONS = ["效果怎么样？", "如何使用？", "保质期多久？", "都有什么规格？", "有什么注意事项？"]
+# 宽松的回归阈值，单核 CI 机器上也应满足
+MAX_P50_MS = 200
+MAX_P99_MS = 1000
+
+
+@pytest.fixture
+def mock_server():
+    """启动零延迟的 mock 服务，并将接口地址切换过去"""
+    server = MockServer(config={"seed": 1}, port=0)
+    http_client.set_base_url(server.start())
+    http_client.configure(pool_size=CONVERSATIONS)
+    product_catalog.clear()
+    metrics.reset()
+    yield server
+    server.stop()
+    http_client.set_base_url(None)
+    http_client.close()
+    product_catalog.clear()
+
+
+def _report(name, server, elapsed):
+    """打印并附加本次的吞吐和框架开销，返回聊天接口的延迟统计"""
+    summary = metrics.summary()
+    chat_ms = summary['latency_ms']['chat']
+    turns = CONVERSATIONS * len(QUESTIONS)
+    print(f"\n[{name}] {turns} 次请求, 耗时 {elapsed:.2f}s, 吞吐 {turns / elapsed:.0f} req/s")
+    print(metrics.format_table(summary))
+    allure.attach(
+        json.dumps({"elapsed": elapsed, "throughput": turns / elapsed, "metrics": summary,
+                    "server": server.stats()}, ensure_ascii=False, indent=2),
+        name=f"框架开销 - {name}",
+        attachment_type=allure.attachment_type.JSON
+    )
+    return chat_ms
+
+
+@allure.feature("压测框架")
+@allure.story("框架开销基准")
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+def test_harness_overhead(mock_server, engine):
+    """
+    测试场景：对零延迟的本地 mock 服务跑完整的并发对话，
+    校验结果正确，并限制框架自身引入的延迟
+    """
+    if engine == "asyncio":
+        pytest.importorskip("aiohttp")
+    allure.dynamic.title(f"框架开销基准 - {engine}")
+
+    token = get_token()
+    product = get_product_by_index(token, index=0)
+    assert product is not None, "获取商品失败"
+
+    start = time.perf_counter()
+    if engine == "asyncio":
+        from common.async_conversation import run_conversations
+        results = run_conversations(CONVERSATIONS, token, product, QUESTIONS)
+    else:
+        with ThreadPoolExecutor(max_workers=CONVERSATIONS) as executor:
+            results = list(executor.map(
+                lambda i: run_single_conversation(i, token, product, QUESTIONS), range(CONVERSATIONS)
+            ))
+    elapsed = time.perf_counter() - start
+
+    failed = [r for r in results if not r['success']]
+    assert not failed, f"有 {len(failed)} 个对话失败: {failed[0]['error']}"
+    assert mock_server.stats()['chat']['requests'] == CONVERSATIONS * len(QUESTIONS)
+
+    chat_ms = _report(engine, mock_server, elapsed)
+    assert chat_ms['p50'] < MAX_P50_MS, f"框架开销 p50 {chat_ms['p50']}ms 超过 {MAX_P50_MS}ms"
+    assert chat_ms['p99'] < MAX_P99_MS, f"框架开销 p99 {chat_ms['p99']}ms 超过 {MAX_P99_MS}ms"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "-s"])
@@ -0,0 +1,62 @@
+import sys
+import os
+import json
+import time
+import uuid
+import pytest
+import allure
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import report_builder
+
+
+def write_result(results_dir, name, status, start_ms, duration_ms=1000):
+    """写一个最小的 allure result.json"""
+    result_uuid = str(uuid.uuid4())
+    data = {"uuid": result_uuid, "historyId": name, "name": name, "fullName": f"Smart Growth.{name}",
+            "status": status, "start": start_ms, "stop": start_ms + duration_ms}
+    with open(os.path.join(results_dir, f"{result_uuid}-result.json"), "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+@allure.feature("测试报告")
+@allure.story("保留多次执行")
+class TestReportBuilder:
+
+    def test_summary_counts_only_latest_run(self, tmp_path):
+        results_dir, report_dir = tmp_path / "results", tmp_path / "report"
+        results_dir.mkdir()
+        now_ms = int(time.time() * 1000)
+        write_result(results_dir, "test_product", "failed", now_ms - 24 * 3600 * 1000)
+        write_result(results_dir, "test_chat", "passed", now_ms)
+
+        summary = report_builder.build(str(results_dir), str(report_dir))
+
+        assert summary["statistic"]["total"] == 1
+        assert summary["statistic"]["passed"] == 1
+        assert summary["statistic"]["failed"] == 0
+        assert summary["time"]["duration"] == 1000
+        # 较早的执行仍然进入历史
+        with open(report_dir / "history" / "history.json", "r", encoding="utf-8") as f:
+            history = json.load(f)
+        assert set(history) == {"test_product", "test_chat"}
+
+    def test_same_run_retry_keeps_last(self, tmp_path):
+        results_dir, report_dir = tmp_path / "results", tmp_path / "report"
+        results_dir.mkdir()
+        now_ms = int(time.time() * 1000)
+        write_result(results_dir, "test_chat", "failed", now_ms - 5000)
+        write_result(results_dir, "test_chat", "passed", now_ms)
+
+        summary = report_builder.build(str(results_dir), str(report_dir))
+
+        assert summary["statistic"]["total"] == 1
+        assert summary["statistic"]["passed"] == 1
+        with open(report_dir / "history" / "retry-trend.json", "r", encoding="utf-8") as f:
+            assert json.load(f)[0]["data"]["retry"] == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,96 @@
+import sys
+import os
+import json
+import functools
+import pytest
+import allure
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import email_sender
+from common import report_queue
+from common.mock_smtp import MockSMTPServer
+
+RECIPIENTS = ["a@example.com", "b@example.com", "c@example.com"]
+
+
+@pytest.fixture
+def report_dir(tmp_path, monkeypatch):
+    """最小的报告目录；压缩缓存写到临时目录"""
+    monkeypatch.setattr(email_sender, "_zip_report",
+                        functools.partial(email_sender._zip_report, cache_dir=str(tmp_path / "zip-cache")))
+    path = tmp_path / "allure-report"
+    (path / "widgets").mkdir(parents=True)
+    (path / "widgets" / "summary.json").write_text(json.dumps({
+        "statistic": {"passed": 1, "failed": 0, "broken": 0, "skipped": 0, "unknown": 0, "total": 1},
+        "time": {"duration": 1000},
+    }), encoding="utf-8")
+    (path / "index.html").write_text("<html></html>", encoding="utf-8")
+    return str(path)
+
+
+def make_config(tmp_path, port, **overrides):
+    """连接本地 mock SMTP、重试不等待的投递配置"""
+    config = dict(report_queue.DEFAULT_CONFIG, smtp_server="127.0.0.1", smtp_port=port, ssl=False, timeout=5,
+                  max_attempts=3, backoff={"initial": 0, "factor": 2, "max": 0},
+                  spool_dir=str(tmp_path / "outbox"))
+    config.update(overrides)
+    return config
+
+
+def deliver(tmp_path, report_dir, recipients=RECIPIENTS, **server_options):
+    """启动 mock SMTP，入队并在当前进程中运行 worker，返回 (server, config)"""
+    server = MockSMTPServer(port=0, save_dir=str(tmp_path / "mail"), **server_options)
+    with server:
+        config = make_config(tmp_path, server.port, max_recipients_per_message=2)
+        assert report_queue.enqueue(report_dir, recipients, config, start=False)
+        assert report_queue.run_worker(config)
+    return server, config
+
+
+@allure.feature("报告投递")
+@allure.story("重试")
+class TestReportQueue:
+
+    def test_delivers_in_batches(self, tmp_path, report_dir):
+        server, config = deliver(tmp_path, report_dir)
+        assert [m["to"] for m in server.messages] == [["<a@example.com>", "<b@example.com>"], ["<c@example.com>"]]
+        assert server.connections == 1
+        assert report_queue.pending(config) == [] and report_queue.failed(config) == []
+        assert os.listdir(os.path.join(config["spool_dir"], "reports")) == []
+
+    def test_retries_temporary_failure(self, tmp_path, report_dir):
+        server, config = deliver(tmp_path, report_dir, fail_first=1)
+        # 第 1 批返回 451 后整个任务重试，第 2 次投递两批都成功
+        assert len(server.messages) == 2
+        assert report_queue.pending(config) == [] and report_queue.failed(config) == []
+
+    def test_reconnects_after_disconnect(self, tmp_path, report_dir):
+        server, config = deliver(tmp_path, report_dir, disconnect_first=1)
+        assert len(server.messages) == 2
+        assert server.connections == 2
+        assert report_queue.failed(config) == []
+
+    def test_refused_recipient_kept_on_job(self, tmp_path, report_dir):
+        server, config = deliver(tmp_path, report_dir, refuse={"b@example.com"})
+        assert sorted(r for m in server.messages for r in m["to"]) == ["<a@example.com>", "<c@example.com>"]
+        assert report_queue.pending(config) == []
+        [job] = report_queue.failed(config)
+        assert job["delivered"] == ["a@example.com", "c@example.com"]
+        assert list(job["refused"]) == ["b@example.com"]
+        assert job["refused"]["b@example.com"][0] == 550
+        # 快照保留，可以重新投递
+        assert os.path.isdir(job["report_dir"])
+
+    def test_retry_failed_sends_only_refused(self, tmp_path, report_dir):
+        server, config = deliver(tmp_path, report_dir, refuse={"b@example.com"})
+        with MockSMTPServer(port=server.port, save_dir=str(tmp_path / "mail-retry")) as retry_server:
+            assert report_queue.retry_failed(config, start=False) == 1
+            assert report_queue.run_worker(config)
+        assert [m["to"] for m in retry_server.messages] == [["<b@example.com>"]]
+        assert report_queue.pending(config) == [] and report_queue.failed(config) == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
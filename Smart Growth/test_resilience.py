@@ -0,0 +1,158 @@
+import sys
+import os
+import pytest
+import allure
+import requests
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.resilience import Policy, RetryBudget, CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+
+
+class FakeResponse:
+    """只带状态码和响应头的响应"""
+
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def make_policy(max_attempts=3, idempotent=None, breaker=None, budget=None):
+    """退避为 0 的策略，重试不等待"""
+    config = {
+        "connect_timeout": 1,
+        "read_timeout": 1,
+        "idempotent": idempotent,
+        "retry": {"max_attempts": max_attempts, "base": 0, "cap": 0, "retry_on_status": [503]},
+        "breaker": breaker,
+    }
+    return Policy("test", config, budget or RetryBudget(ratio=1, min_retries=100, window=60))
+
+
+def sender(*outcomes):
+    """依次返回 / 抛出 outcomes 中的结果，并记录调用次数"""
+    calls = []
+
+    def send():
+        outcome = outcomes[min(len(calls), len(outcomes) - 1)]
+        calls.append(outcome)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+    return send, calls
+
+
+def connect_error():
+    """连接建立阶段失败（请求确定没有发出），与 requests 实际抛出的异常结构一致"""
+    from urllib3.exceptions import MaxRetryError, NewConnectionError
+    reason = NewConnectionError(None, "connection refused")
+    return requests.exceptions.ConnectionError(MaxRetryError(None, "/api/chat", reason=reason))
+
+
+@allure.feature("接口容错")
+@allure.story("重试")
+class TestRetry:
+
+    def test_get_retries_5xx_until_success(self):
+        send, calls = sender(FakeResponse(503), FakeResponse(200))
+        assert make_policy().call("GET", send).status_code == 200
+        assert len(calls) == 2
+
+    def test_get_returns_last_5xx_when_attempts_exhausted(self):
+        send, calls = sender(FakeResponse(503))
+        assert make_policy(max_attempts=3).call("GET", send).status_code == 503
+        assert len(calls) == 3
+
+    def test_post_does_not_retry_5xx(self):
+        send, calls = sender(FakeResponse(503), FakeResponse(200))
+        assert make_policy().call("POST", send).status_code == 503
+        assert len(calls) == 1
+
+    def test_post_does_not_retry_read_timeout(self):
+        send, calls = sender(requests.exceptions.ReadTimeout("read timed out"), FakeResponse(200))
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            make_policy().call("POST", send)
+        assert len(calls) == 1
+
+    def test_post_retries_connect_failure(self):
+        send, calls = sender(connect_error(), FakeResponse(200))
+        assert make_policy().call("POST", send).status_code == 200
+        assert len(calls) == 2
+
+    def test_idempotent_post_retries_read_timeout(self):
+        send, calls = sender(requests.exceptions.ReadTimeout("read timed out"), FakeResponse(200))
+        assert make_policy(idempotent=True).call("POST", send).status_code == 200
+        assert len(calls) == 2
+
+    def test_non_transient_error_not_retried(self):
+        send, calls = sender(ValueError("bad payload"), FakeResponse(200))
+        with pytest.raises(ValueError):
+            make_policy().call("GET", send)
+        assert len(calls) == 1
+
+    def test_budget_exhausted_stops_retry(self):
+        budget = RetryBudget(ratio=0, min_retries=0, window=60)
+        send, calls = sender(FakeResponse(503), FakeResponse(200))
+        assert make_policy(budget=budget).call("GET", send).status_code == 503
+        assert len(calls) == 1
+
+
+@allure.feature("接口容错")
+@allure.story("熔断")
+class TestCircuitBreaker:
+
+    def open_breaker(self, breaker):
+        for _ in range(breaker.failure_threshold):
+            breaker.before_request()
+            breaker.on_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker("test", failure_threshold=3, open_seconds=60)
+        breaker.on_failure()
+        breaker.on_failure()
+        breaker.on_success()
+        assert breaker.state == CLOSED
+        self.open_breaker(breaker)
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+
+    def test_half_open_success_closes(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, open_seconds=0, half_open_max=1)
+        self.open_breaker(breaker)
+        breaker.before_request()
+        assert breaker.state == HALF_OPEN
+        # 半开状态只放行 half_open_max 个探测请求
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+        breaker.on_success()
+        assert breaker.state == CLOSED
+
+    def test_half_open_failure_reopens(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, open_seconds=0)
+        self.open_breaker(breaker)
+        breaker.before_request()
+        assert breaker.state == HALF_OPEN
+        breaker.on_failure()
+        assert breaker.state == OPEN
+
+    def test_policy_counts_only_network_failures(self):
+        policy = make_policy(max_attempts=1, breaker={"failure_threshold": 2, "open_seconds": 60, "half_open_max": 1})
+        send, calls = sender(ValueError("bad payload"))
+        for _ in range(3):
+            with pytest.raises(ValueError):
+                policy.call("GET", send)
+        assert policy.breaker.state == CLOSED
+
+        send, calls = sender(FakeResponse(503))
+        policy.call("GET", send)
+        policy.call("GET", send)
+        assert policy.breaker.state == OPEN
+        with pytest.raises(CircuitOpenError):
+            policy.call("GET", send)
+        assert len(calls) == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,26 @@
+import asyncio
+from api.chat import CHAT_PATH, serialize_chat_body
+from common import async_http
+from common import http_client
+from common import token_cache
+from common.tool import get_headers, is_unauthorized
+
+
+async def chat(txt, token, username="tb_1770348369683", inquiry_product=None, shop_id="585",
+               shop_name="儒意化妆品旗舰店", account="测试专用1", platform="tmall", full_messages=None):
+    """
+    聊天接口的异步版本，参数与 api.chat.chat 一致
+    请求通过当前事件循环共用的 aiohttp 连接池发送，token 失效时自动重新登录并重试一次
+
+    返回:
+        AsyncResponse: 已读取完毕的响应对象（支持 status_code / content / json()）
+    """
+    data = serialize_chat_body(txt, username, inquiry_product, shop_id, shop_name, account, platform, full_messages)
+    url = http_client.url(CHAT_PATH)
+    token = token_cache.resolve(token)
+    response = await async_http.request("POST", url, endpoint="chat", data=data, headers=get_headers(token))
+    if is_unauthorized(response):
+        new_token = await asyncio.to_thread(token_cache.relogin, token)
+        if new_token:
+            response = await async_http.request("POST", url, endpoint="chat", data=data, headers=get_headers(new_token))
+    return response
@@ -1,7 +1,48 @@
+import json
 import time
 import uuid
-from requests import session
-from common.tool import get_headers
+from common import http_client
+from common import tracing
+from common.tool import request_with_token
+
+CHAT_PATH = "/chat/answer"
+
+
+def build_chat_body(txt, username, inquiry_product=None, shop_id="585", shop_name="儒意化妆品旗舰店",
+                    account="测试专用1", platform="tmall", full_messages=None):
+    """构造聊天接口的请求体，同步和异步聊天接口共用"""
+    now = int(time.time())
+
+    body = {
+        "platform": platform,
+        "shop_name": shop_name,
+        "account": account,
+        "username": username,
+        "shop_id": shop_id,
+        "is_test": False,
+        "last_order_time": now,
+        "last_order_info": None,
+        "request_id": str(uuid.uuid4()),
+        "inquiry_product": inquiry_product or {},
+        "messages": full_messages if full_messages is not None else [
+            {
+                "role": "user",
+                "content": txt,
+                "created_at": now
+            }
+        ]
+    }
+    return body
+
+
+def serialize_chat_body(*args, **kwargs):
+    """构造并序列化聊天请求体（参数同 build_chat_body），记录为 serialize span，返回 UTF-8 编码的 JSON"""
+    with tracing.span("serialize") as span:
+        body = build_chat_body(*args, **kwargs)
+        data = json.dumps(body).encode("utf-8")
+        span.set_attributes({"request_id": body["request_id"], "request_bytes": len(data),
+                             "messages": len(body["messages"])})
+    return data
 
 
 def chat(txt, token, username="tb_1770348369683", inquiry_product=None, shop_id="585",
@@ -26,30 +67,8 @@ def chat(txt, token, username="tb_1770348369683", inquiry_product=None, shop_id=
         platform: 平台，默认 tmall
         full_messages: 完整对话历史列表（可选），如果传了就直接用它构造body，否则保持原单条逻辑
     """
-    url = "https://dev.zhiyan.chat/chat/answer"
-    now = int(time.time())
-    
-    body = {
-        "platform": platform,
-        "shop_name": shop_name,
-        "account": account,
-        "username": username,
-        "shop_id": shop_id,
-        "is_test": False,
-        "last_order_time": now,
-        "last_order_info": None,
-        "request_id": str(uuid.uuid4()),
-        "inquiry_product": inquiry_product or {},
-        "messages": full_messages if full_messages is not None else [
-            {
-                "role": "user",
-                "content": txt,
-                "created_at": now
-            }
-        ]
-    }
-    headers = get_headers(token)
-    return session().post(url=url, json=body, headers=headers)
+    data = serialize_chat_body(txt, username, inquiry_product, shop_id, shop_name, account, platform, full_messages)
+    return request_with_token("POST", http_client.url(CHAT_PATH), token, endpoint="chat", data=data)
 
 
 def chat_with_product(txt, token, username="tb_1770348369683", shop_id="585",
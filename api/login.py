@@ -1,11 +1,11 @@
-from requests import session
+from common import http_client
 
 
-def login(account, password):
-    """登录接口，返回响应对象"""
-    url = "https://dev.zhiyan.chat/api/auth/login"
+def login(account, password, base_url=None):
+    """登录接口，返回响应对象；base_url 为空时使用当前接口地址前缀"""
+    url = http_client.url("/api/auth/login", base_url)
     body = {
         "account": account,
         "password": password
     }
-    return session().post(url=url, json=body)
+    return http_client.post(url=url, endpoint="login", json=body)
@@ -1,5 +1,6 @@
-from requests import session
-from common.tool import get_headers
+from common import http_client
+from common import tracing
+from common.tool import request_with_token
 
 
 def get_products(token, shop_id="585", page=1, page_size=10, search=""):
@@ -16,20 +17,30 @@ def get_products(token, shop_id="585", page=1, page_size=10, search=""):
     返回:
         响应对象
     """
-    url = "https://dev.zhiyan.chat/api/products/"
+    url = http_client.url("/api/products/")
     params = {
         "page": page,
         "pageSize": page_size,
         "search": search,
         "shop_id": shop_id
     }
-    headers = get_headers(token)
-    return session().get(url=url, params=params, headers=headers)
+    return request_with_token("GET", url, token, endpoint="products", params=params)
+
+
+def _to_inquiry_product(item):
+    """将商品列表中的条目转换为 inquiry_product 格式"""
+    product_id = str(item.get('product_id', ''))
+    return {
+        "id": product_id,
+        "title": item.get('product_title', ''),
+        "url": f"https://item.taobao.com/item.htm?id={product_id}"
+    }
 
 
 def get_product_by_index(token, shop_id="585", index=0, page=1, page_size=10):
     """
     获取店铺商品列表中指定索引的商品，返回 inquiry_product 格式
+    商品从本地商品目录中查询，目录缓存有效时不发起请求
 
     参数:
         token: 登录 token
@@ -42,24 +53,21 @@ def get_product_by_index(token, shop_id="585", index=0, page=1, page_size=10):
         dict: 商品信息，格式为 {"id": "...", "title": "...", "url": "..."}
         如果获取失败或索引越界，返回 None
     """
-    response = get_products(token, shop_id, page, page_size)
-    result = response.json()
+    from common.product_catalog import get_catalog
 
-    if result.get('code') != 200:
-        print(f"获取商品列表失败: {result.get('message')}")
-        return None
+    with tracing.span("product_lookup", attributes={"shop_id": str(shop_id), "index": index}) as span:
+        catalog = get_catalog(token, shop_id)
+        if catalog is None:
+            span.record_error("获取商品目录失败")
+            return None
 
-    items = result.get('result', {}).get('data', [])
-    if index >= len(items):
-        print(f"索引 {index} 越界，商品列表共 {len(items)} 条")
-        return None
+        item = catalog.at((page - 1) * page_size + index) if index < page_size else None
+        if item is None:
+            print(f"索引 {index} 越界，商品目录共 {len(catalog.items)} 条")
+            return None
 
-    product = items[index]
-    return {
-        "id": str(product.get('product_id', '')),
-        "title": product.get('product_title', ''),
-        "url": f"https://item.taobao.com/item.htm?id={product.get('product_id', '')}"
-    }
+        span.set_attribute("product_id", str(item.get('product_id', '')))
+        return _to_inquiry_product(item)
 
 
 def list_products_brief(token, shop_id="585", page=1, page_size=10):
@@ -94,47 +102,66 @@ def list_products_brief(token, shop_id="585", page=1, page_size=10):
     return items
 
 
-def get_product_by_id(token, shop_id="585", product_id="", max_pages=3, page_size=20):
+def search_products(token, shop_id="585", keyword="", limit=10):
+    """
+    按标题关键词在本地商品目录中检索商品
+
+    参数:
+        token: 登录 token
+        shop_id: 店铺ID，默认 585
+        keyword: 标题关键词
+        limit: 最多返回多少条，默认10条
+
+    返回:
+        list: inquiry_product 格式的商品列表
+    """
+    from common.product_catalog import get_catalog
+
+    catalog = get_catalog(token, shop_id)
+    if catalog is None:
+        return []
+    return [_to_inquiry_product(item) for item in catalog.search(keyword, limit=limit)]
+
+
+def get_product_by_id(token, shop_id="585", product_id="", max_pages=None, page_size=20):
     """
     根据商品ID获取商品信息，返回 inquiry_product 格式
+    商品从本地商品目录中查询（覆盖店铺全部分页），目录缓存有效时不发起请求；
+    查不到时按 common.product_catalog.revalidate_on_miss 校验一次目录
 
     参数:
         token: 登录 token
         shop_id: 店铺ID，默认 585
         product_id: 商品ID（字符串或数字）
-        max_pages: 最多搜索多少页，默认3页
-        page_size: 每页数量，默认20条
+        max_pages: 已不再使用，保留以兼容旧调用
+        page_size: 已不再使用，保留以兼容旧调用
 
     返回:
         dict: 商品信息，格式为 {"id": "...", "title": "...", "url": "..."}
         如果未找到商品，返回 None
     """
+    from common.product_catalog import get_catalog, revalidate_on_miss
+
     if not product_id:
         print("商品ID不能为空")
         return None
 
     product_id_str = str(product_id)
 
-    for page in range(1, max_pages + 1):
-        response = get_products(token, shop_id, page=page, page_size=page_size)
-        result = response.json()
-
-        if result.get('code') != 200:
-            print(f"获取商品列表失败: {result.get('message')}")
+    with tracing.span("product_lookup", attributes={"shop_id": str(shop_id), "product_id": product_id_str}):
+        catalog = get_catalog(token, shop_id)
+        if catalog is None:
             return None
 
-        items = result.get('result', {}).get('data', [])
-        if not items:
-            break
-
-        for item in items:
-            if str(item.get('product_id', '')) == product_id_str:
-                print(f"已找到商品: [{product_id_str}] {item.get('product_title')}")
-                return {
-                    "id": product_id_str,
-                    "title": item.get('product_title', ''),
-                    "url": f"https://item.taobao.com/item.htm?id={product_id_str}"
-                }
-
-    print(f"未找到商品ID: {product_id_str}（已搜索 {max_pages} 页）")
-    return None
+        item = catalog.get(product_id_str)
+        if item is None:
+            # 目录中没有，可能是新上架的商品: 校验第 1 页，有变化才重新拉取；同一店铺一段时间内只校验一次
+            catalog = revalidate_on_miss(token, shop_id) or catalog
+            item = catalog.get(product_id_str)
+
+    if item is None:
+        print(f"未找到商品ID: {product_id_str}（店铺 {shop_id} 共 {len(catalog.items) if catalog else 0} 个商品）")
+        return None
+
+    print(f"已找到商品: [{product_id_str}] {item.get('product_title')}")
+    return _to_inquiry_product(item)
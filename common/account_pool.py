@@ -0,0 +1,263 @@
+"""
+多账号 token 池
+- 服务端按账号限流时，所有并发对话共用一个 token 会被单账号配额卡住吞吐，账号池把对话分散到多个账号上
+- 启动时并发登录全部账号（通过 common.token_cache，磁盘缓存中未过期的 token 直接复用），登录失败的账号不参与分配
+- 每个对话开始时分配一个账号:
+    round_robin:  按顺序轮流分配
+    least_loaded: 分配进行中对话数最少的账号（相同时按顺序轮流）
+- 每个账号的 token 由 common.token_cache 按各自的有效期在后台刷新，对话开始时取该账号当前最新的 token；
+  协程执行器使用 lease_async()，需要重新登录时在线程中完成，不阻塞事件循环
+- 每轮请求按账号记录到 common.metrics: account.<账号> 直方图（单轮延迟）、account.<账号>.errors、
+  account.<账号>.conversations 计数器；多进程驱动时随 worker 的统计一起合并到主进程
+
+配置见 data/accounts.yaml
+"""
+
+import os
+import json
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from common import metrics
+from common import config_cache
+from common import token_cache
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "accounts.yaml")
+
+STRATEGIES = ("round_robin", "least_loaded")
+
+
+class Account:
+    """账号池中的一个账号"""
+
+    def __init__(self, name, password):
+        self.name = name
+        self.password = password
+        self.in_flight = 0
+        self.error = None
+
+    @property
+    def token(self):
+        """当前最新的 token（内存缓存，过期时重新登录）"""
+        return token_cache.get_token(self.name, self.password)
+
+    async def token_async(self):
+        """协程版 token: 内存中有未过期的 token 时直接返回，否则在线程中登录 / 读取磁盘缓存"""
+        token = token_cache.cached_token(self.name)
+        if token is None:
+            token = await asyncio.to_thread(token_cache.get_token, self.name, self.password)
+        return token
+
+
+class Lease:
+    """
+    一个对话占用的账号，对话执行器通过 lease() 获取
+
+    属性:
+        token: 本次对话使用的 token
+        account: 账号名，未使用账号池时为 None
+    """
+
+    def __init__(self, token, account=None):
+        self.token = token
+        self.account = account
+
+    def observe(self, record):
+        """每轮请求结束时调用，按账号记录延迟和错误"""
+        if self.account is None:
+            return
+        record["account"] = self.account
+        metrics.record(f"account.{self.account}", record["received"] - record["sent"])
+        if record.get("error"):
+            metrics.incr(f"account.{self.account}.errors")
+
+
+class AccountPool:
+    """
+    多账号 token 池，线程安全，可以在线程和协程中共用
+
+    参数:
+        accounts: [{"account": ..., "password": ...}, ...]
+        strategy: round_robin / least_loaded
+    """
+
+    def __init__(self, accounts, strategy="round_robin"):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"未知的分配方式: {strategy}，可选 {', '.join(STRATEGIES)}")
+        if not accounts:
+            raise ValueError("账号池中没有账号")
+        self.strategy = strategy
+        self.accounts = [Account(a["account"], a["password"]) for a in accounts]
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def spec(self):
+        """可以跨进程传递的账号池配置，AccountPool(**spec) 重新创建"""
+        return {
+            "accounts": [{"account": a.name, "password": a.password} for a in self.accounts],
+            "strategy": self.strategy,
+        }
+
+    def login_all(self, max_workers=8):
+        """
+        并发登录全部账号，登录失败的账号从池中移除
+
+        返回:
+            dict: 登录失败的账号 -> 错误信息
+        """
+        def login(account):
+            try:
+                token_cache.get_token(account.name, account.password)
+            except Exception as e:
+                account.error = f"{type(e).__name__}: {e}"
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(self.accounts))) as executor:
+            list(executor.map(login, self.accounts))
+
+        failed = {a.name: a.error for a in self.accounts if a.error}
+        for name, error in failed.items():
+            print(f"[账号池] {name} 登录失败，不参与分配: {error}")
+        with self._lock:
+            self.accounts = [a for a in self.accounts if not a.error]
+        if not self.accounts:
+            raise RuntimeError(f"账号池中的账号全部登录失败: {failed}")
+        return failed
+
+    def checkout(self):
+        """分配一个账号（进行中对话数 +1）"""
+        with self._lock:
+            count = len(self.accounts)
+            if self.strategy == "least_loaded":
+                # 从轮转位置开始找，进行中对话数相同时依次分配
+                order = [self.accounts[(self._next + i) % count] for i in range(count)]
+                account = min(order, key=lambda a: a.in_flight)
+                self._next = (self.accounts.index(account) + 1) % count
+            else:
+                account = self.accounts[self._next % count]
+                self._next = (self._next + 1) % count
+            account.in_flight += 1
+        metrics.incr(f"account.{account.name}.conversations")
+        return account
+
+    def release(self, account):
+        with self._lock:
+            account.in_flight -= 1
+
+    @contextmanager
+    def lease(self):
+        """在 with 块内占用一个账号"""
+        account = self.checkout()
+        try:
+            yield Lease(account.token, account.name)
+        finally:
+            self.release(account)
+
+    def in_flight(self):
+        """各账号进行中的对话数"""
+        with self._lock:
+            return {a.name: a.in_flight for a in self.accounts}
+
+    def summary(self, summary_data=None):
+        """
+        各账号的对话数、请求数、错误数、错误率和单轮延迟分布（毫秒），数据来自 common.metrics
+
+        参数:
+            summary_data: metrics.summary() 的结果，默认读取全局注册表
+        """
+        summary_data = metrics.summary() if summary_data is None else summary_data
+        latency = summary_data.get("latency_ms", {})
+        counters = summary_data.get("counters", {})
+        result = {}
+        for account in self.accounts:
+            name = account.name
+            stats = latency.get(f"account.{name}", {"count": 0})
+            errors = counters.get(f"account.{name}.errors", 0)
+            result[name] = {
+                "conversations": counters.get(f"account.{name}.conversations", 0),
+                "requests": stats["count"],
+                "errors": errors,
+                "error_rate": round(errors / stats["count"], 4) if stats["count"] else 0.0,
+                "latency_ms": stats,
+            }
+        return result
+
+
+@contextmanager
+def lease(token):
+    """
+    对话执行器使用: token 为 AccountPool 时从池中分配账号，否则直接使用该 token
+
+    用法:
+        with account_pool.lease(token) as lease:
+            chat(question, lease.token, ...)
+            lease.observe(record)
+    """
+    if isinstance(token, AccountPool):
+        with token.lease() as leased:
+            yield leased
+    else:
+        yield Lease(token)
+
+
+@asynccontextmanager
+async def lease_async(token):
+    """协程版 lease()，账号的 token 需要登录时不阻塞事件循环中的其他对话"""
+    if not isinstance(token, AccountPool):
+        yield Lease(token)
+        return
+    account = token.checkout()
+    try:
+        yield Lease(await account.token_async(), account.name)
+    finally:
+        token.release(account)
+
+
+def load_config(path=CONFIG_FILE):
+    """读取账号池配置，文件不存在时返回未启用的配置"""
+    return config_cache.load(path, default={"enabled": False}) or {}
+
+
+def from_config(config=None, login=True):
+    """
+    根据配置创建账号池，未启用或没有配置账号时返回 None
+
+    参数:
+        config: 配置字典，默认读取 data/accounts.yaml
+        login: 是否立即并发登录全部账号
+    """
+    config = load_config() if config is None else config
+    if not config.get("enabled") or not config.get("accounts"):
+        return None
+    pool = AccountPool(config["accounts"], config.get("strategy", "round_robin"))
+    if login:
+        pool.login_all(config.get("login_workers", 8))
+    return pool
+
+
+def format_table(summary_data):
+    """将 AccountPool.summary() 的结果渲染为文本表格"""
+    width = max([len(name) for name in summary_data] + [8]) + 2
+    columns = ["对话数", "请求数", "错误数", "错误率", "p50", "p99", "max"]
+    lines = [f"{'账号':<{width}}" + "".join(f"{c:>10}" for c in columns)]
+    for name, row in summary_data.items():
+        latency = row["latency_ms"]
+        cells = [row["conversations"], row["requests"], row["errors"], f"{row['error_rate'] * 100:.2f}%"]
+        cells += [f"{latency[p]:.1f}" if p in latency else "-" for p in ("p50", "p99", "max")]
+        lines.append(f"{name:<{width}}" + "".join(f"{c:>10}" for c in cells))
+    lines.append("（延迟单位: 毫秒）")
+    return "\n".join(lines)
+
+
+def attach_to_allure(pool, name="账号池统计", summary_data=None):
+    """将各账号的统计以 JSON 和文本表格附加到 Allure 报告"""
+    import allure
+
+    data = pool.summary(summary_data)
+    allure.attach(
+        json.dumps({"strategy": pool.strategy, "accounts": data}, ensure_ascii=False, indent=2),
+        name=name,
+        attachment_type=allure.attachment_type.JSON
+    )
+    allure.attach(format_table(data), name=f"{name}（表格）", attachment_type=allure.attachment_type.TEXT)
@@ -0,0 +1,321 @@
+"""
+自适应并发控制（AIMD）
+- 长时间稳定性压测时，让同时进行中的对话数贴近服务端容量，又不把服务端压垮
+- 每轮请求结束后根据结果调整上限:
+    健康（无错误、延迟正常）: 加性增加，每轮 +increase / 当前上限，约每“一整轮并发”上限 +increase
+    超时 / 接口异常（code 非 200 等）/ 延迟突增: 乘性减少，上限 × decrease
+- 延迟突增: 超过 latency_target（绝对值），或超过健康延迟基线（EWMA）的 spike_factor 倍
+- 一次减少后 cooldown 秒内不再减少，避免同一波拥塞把上限连续砍到底
+- 上限变化记录为时间序列，可写入 ResultSink（与每轮延迟在同一个 requests.jsonl 中）并附加到 Allure
+"""
+
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common import metrics
+from common.conversation import chain
+
+# asyncio 版本等待空闲名额时的轮询间隔（秒）
+POLL_INTERVAL = 0.05
+
+
+class AIMDLimiter:
+    """
+    AIMD 并发上限，线程安全，可直接作为 on_turn 回调
+
+    参数:
+        initial: 初始上限
+        min_limit / max_limit: 上限的取值范围
+        increase: 加性增量
+        decrease: 乘性系数（0~1）
+        latency_target: 单轮延迟上限（秒），超过即视为拥塞；None 表示只按基线判断
+        spike_factor: 单轮延迟超过基线的倍数视为突增；None 表示不按基线判断
+        smoothing: 基线 EWMA 的平滑系数
+        cooldown: 两次减少之间的最短间隔（秒），默认取当前延迟基线
+        on_change: 上限变化时的回调，参数为 series() 中的一个点
+    """
+
+    def __init__(self, initial=5, min_limit=1, max_limit=100, increase=1.0, decrease=0.5,
+                 latency_target=None, spike_factor=2.0, smoothing=0.1, cooldown=None, on_change=None):
+        if not 0 < decrease < 1:
+            raise ValueError("decrease 必须在 0 和 1 之间")
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.spike_factor = spike_factor
+        self.smoothing = smoothing
+        self.cooldown = cooldown
+        self.on_change = on_change
+
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.baseline = None
+        self.increases = 0
+        self.decreases = 0
+        self._last_decrease = None
+        self._start = time.perf_counter()
+        self._series = []
+        self._append("start")
+
+    @property
+    def limit(self):
+        """当前生效的上限（整数）"""
+        return int(self._limit)
+
+    def _append(self, reason):
+        """记录一个时间序列点，调用方持有锁（或在构造函数中）"""
+        point = {
+            "t": round(time.perf_counter() - self._start, 3),
+            "ts": time.time(),
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "reason": reason,
+        }
+        self._series.append(point)
+        return point
+
+    def try_acquire(self):
+        """有空闲名额时占用一个并返回 True，否则立即返回 False"""
+        with self._cond:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self, timeout=None):
+        """
+        阻塞等待空闲名额
+
+        返回:
+            bool: 是否获取成功（超时返回 False）
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.in_flight < self.limit, timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    async def acquire_async(self, timeout=None):
+        """acquire() 的协程版本，按 POLL_INTERVAL 轮询"""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while not self.try_acquire():
+            if deadline is not None and time.perf_counter() >= deadline:
+                return False
+            await asyncio.sleep(POLL_INTERVAL)
+        return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def _congestion(self, record, latency):
+        """返回拥塞原因，健康返回 None"""
+        if record.get("error"):
+            return f"error: {str(record['error'])[:80]}"
+        if self.latency_target is not None and latency > self.latency_target:
+            return f"latency {latency * 1000:.0f}ms > target"
+        if self.spike_factor and self.baseline and latency > self.baseline * self.spike_factor:
+            return f"latency {latency * 1000:.0f}ms > {self.spike_factor}x baseline"
+        return None
+
+    def __call__(self, record):
+        """on_turn 回调: 按每轮结果调整上限"""
+        latency = record["received"] - record["sent"]
+        reason = self._congestion(record, latency)
+        point = None
+        with self._cond:
+            before = self.limit
+            if reason is None:
+                self.baseline = latency if self.baseline is None else \
+                    self.baseline + self.smoothing * (latency - self.baseline)
+                self._limit = min(self._limit + self.increase / max(self._limit, 1), self.max_limit)
+                if self.limit > before:
+                    self.increases += 1
+                    point = self._append("increase")
+                    self._cond.notify_all()
+            else:
+                now = time.perf_counter()
+                cooldown = self.cooldown if self.cooldown is not None else (self.baseline or 0)
+                if self._last_decrease is None or now - self._last_decrease >= cooldown:
+                    self._last_decrease = now
+                    self._limit = max(self._limit * self.decrease, self.min_limit)
+                    self.decreases += 1
+                    point = self._append(reason)
+        if point is not None:
+            metrics.incr("aimd.increase" if reason is None else "aimd.decrease")
+            if self.on_change is not None:
+                self.on_change(point)
+
+    def series(self):
+        """上限随时间变化的序列: [{"t", "ts", "limit", "in_flight", "reason"}, ...]"""
+        with self._cond:
+            return list(self._series)
+
+    def summary(self):
+        with self._cond:
+            limits = [p["limit"] for p in self._series]
+            return {
+                "limit": self.limit,
+                "min": min(limits),
+                "max": max(limits),
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "baseline_ms": round(self.baseline * 1000, 3) if self.baseline else None,
+            }
+
+
+def from_config(config, on_change=None):
+    """
+    根据 yaml 中的 adaptive_config 创建 AIMDLimiter（延迟类参数单位为毫秒）
+    """
+    config = config or {}
+    target = config.get("latency_target_ms")
+    cooldown = config.get("cooldown_ms")
+    return AIMDLimiter(
+        initial=config.get("initial", 5),
+        min_limit=config.get("min", 1),
+        max_limit=config.get("max", 100),
+        increase=config.get("increase", 1.0),
+        decrease=config.get("decrease", 0.5),
+        latency_target=target / 1000 if target else None,
+        spike_factor=config.get("spike_factor", 2.0),
+        smoothing=config.get("smoothing", 0.1),
+        cooldown=cooldown / 1000 if cooldown is not None else None,
+        on_change=on_change,
+    )
+
+
+class _Tally:
+    def __init__(self, on_result, keep_results):
+        self._lock = threading.Lock()
+        self._on_result = on_result
+        self._keep = keep_results
+        self.conversations = 0
+        self.success = 0
+        self.results = []
+
+    def __call__(self, result):
+        with self._lock:
+            self.conversations += 1
+            if result['success']:
+                self.success += 1
+            if self._keep:
+                self.results.append(result)
+        if self._on_result is not None:
+            self._on_result(result)
+
+
+def _run_threads(limiter, duration, args, on_turn, tally):
+    from common import http_client
+    from common.conversation import run_single_conversation
+
+    deadline = time.perf_counter() + duration
+    http_client.configure(pool_size=limiter.max_limit)
+
+    def run(conversation_id):
+        try:
+            tally(run_single_conversation(conversation_id, *args, on_turn=on_turn))
+        finally:
+            limiter.release()
+
+    conversation_id = 0
+    with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not limiter.acquire(timeout=remaining):
+                break
+            executor.submit(run, conversation_id)
+            conversation_id += 1
+
+
+async def _run_async(limiter, duration, args, on_turn, tally):
+    from common import async_http
+    from common.async_conversation import run_conversation
+
+    deadline = time.perf_counter() + duration
+
+    async def run(conversation_id):
+        try:
+            tally(await run_conversation(conversation_id, *args, on_turn=on_turn))
+        finally:
+            limiter.release()
+
+    tasks = set()
+    conversation_id = 0
+    try:
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not await limiter.acquire_async(timeout=remaining):
+                break
+            task = asyncio.create_task(run(conversation_id))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            conversation_id += 1
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        await async_http.close()
+
+
+def run_adaptive(limiter, duration, token, product, questions, wait_between_questions=0, shop_id="585",
+                 engine="thread", on_result=None, on_turn=None, keep_results=False):
+    """
+    在 duration 秒内按 AIMD 上限持续发起对话，到时后不再发起新对话并等待进行中的对话结束
+
+    参数:
+        limiter: AIMDLimiter
+        duration: 持续时间（秒）
+        engine: thread / asyncio
+        其余参数同 common.conversation.run_single_conversation / run_conversations
+
+    返回:
+        dict: {"conversations", "success", "failed", "duration", "limit": limiter.summary(), "results"}
+    """
+    from common import async_http
+
+    args = (token, product, questions, wait_between_questions, shop_id)
+    turn_callback = chain(limiter, on_turn)
+    tally = _Tally(on_result, keep_results)
+    start = time.perf_counter()
+    if engine == "asyncio":
+        async_http.configure(pool_size=limiter.max_limit)
+        asyncio.run(_run_async(limiter, duration, args, turn_callback, tally))
+    else:
+        _run_threads(limiter, duration, args, turn_callback, tally)
+
+    return {
+        "conversations": tally.conversations,
+        "success": tally.success,
+        "failed": tally.conversations - tally.success,
+        "duration": time.perf_counter() - start,
+        "limit": limiter.summary(),
+        "results": tally.results,
+    }
+
+
+def format_series(series):
+    """将上限时间序列渲染为文本表格"""
+    lines = [f"{'时间(s)':>10}{'上限':>8}{'进行中':>8}  原因"]
+    for p in series:
+        lines.append(f"{p['t']:>10.1f}{p['limit']:>8}{p['in_flight']:>8}  {p['reason']}")
+    return "\n".join(lines)
+
+
+def attach_to_allure(limiter, name="自适应并发上限"):
+    """将上限时间序列以 JSON 和文本表格附加到 Allure 报告"""
+    import allure
+
+    series = limiter.series()
+    allure.attach(
+        json.dumps({"summary": limiter.summary(), "series": series}, ensure_ascii=False, indent=2),
+        name=name,
+        attachment_type=allure.attachment_type.JSON
+    )
+    allure.attach(format_series(series), name=f"{name}（表格）", attachment_type=allure.attachment_type.TEXT)
@@ -0,0 +1,167 @@
+"""
+基于 asyncio 的并发对话执行器
+- 单个事件循环 + 共用的 aiohttp 连接池驱动所有对话，不再是一个对话一个线程
+- 每轮对话之间的等待使用 Pacer.wait_async（asyncio.sleep），不占用线程
+- 单个对话的返回结果与 common.conversation.run_single_conversation 完全一致
+"""
+
+import time
+import asyncio
+
+from api import async_chat
+from common import async_http
+from common import pacing
+from common import account_pool
+from common import tracing
+from common.conversation import (
+    generate_username, user_message, append_replies, payload_sizes, brief_reply, success,
+    pacing_context, parse_response, conversation_span,
+)
+
+
+async def run_conversation(conversation_id, token, product, questions, wait_between_questions=0,
+                           shop_id="585", on_turn=None, intended_start=None, limiter=None):
+    """
+    运行单个对话（协程版本）
+
+    参数:
+        conversation_id: 对话ID
+        token: 登录 token，或 common.account_pool.AccountPool（每个对话从池中分配一个账号）
+        product: 商品信息
+        questions: 问题列表
+        wait_between_questions: 每轮对话之间的等待，秒数或 common.pacing.Pacer
+        shop_id: 店铺ID，默认 585
+        on_turn: 每轮请求结束时的回调（可选），参数为该轮的记录:
+            {"conversation_id", "turn", "intended", "sent", "received", "error",
+             "request_bytes", "response_bytes", "timing"}
+            timing 为该轮请求的分阶段耗时（见 common.http_timing）；使用账号池时还有 "account"
+            时间均为 time.perf_counter() 时间点
+        intended_start: 第 1 轮计划发送的时间点（perf_counter），默认为当前时间
+        limiter: 每次请求前需要获取的 asyncio.Semaphore（可选），用于限制同时进行的请求数
+
+    返回:
+        dict: 对话结果
+    """
+    username = generate_username()
+    messages_history = []
+    results = []
+    pacer = pacing.as_pacer(wait_between_questions)
+
+    start_time = time.time()
+    intended = time.perf_counter() if intended_start is None else intended_start
+
+    async with account_pool.lease_async(token) as lease:
+        with conversation_span(conversation_id, username, shop_id) as span:
+            span.span.set_attribute("account", lease.account)
+            token = lease.token
+            try:
+                for i, question in enumerate(questions, 1):
+                    messages_history.append(user_message(question))
+
+                    with tracing.span("turn", attributes={"turn": i}) as turn_span:
+                        record = {"conversation_id": conversation_id, "turn": i, "intended": intended,
+                                  "request_bytes": 0, "response_bytes": 0}
+                        if limiter is not None:
+                            await limiter.acquire()
+                        record["sent"] = time.perf_counter()
+                        try:
+                            response = await async_chat.chat(
+                                question,
+                                token,
+                                username,
+                                inquiry_product=product,
+                                full_messages=messages_history,
+                                shop_id=shop_id
+                            )
+                            record["request_bytes"], record["response_bytes"] = payload_sizes(response)
+                            record["timing"] = getattr(response, "timing", None)
+                            result, error, full_reply = parse_response(response)
+                        except Exception as e:
+                            record["error"] = str(e)
+                            raise
+                        else:
+                            record["error"] = error
+                            if error:
+                                turn_span.record_error(error)
+                        finally:
+                            record["received"] = time.perf_counter()
+                            if limiter is not None:
+                                limiter.release()
+                            lease.observe(record)
+                            if on_turn is not None:
+                                on_turn(record)
+
+                    if error:
+                        return span.failure(conversation_id, error, start_time)
+
+                    if len(full_reply) == 0:
+                        return span.failure(conversation_id, "AI 回复内容为空", start_time)
+
+                    append_replies(messages_history, result)
+                    results.append({
+                        "question": question,
+                        "reply": brief_reply(full_reply)
+                    })
+
+                    # 等待 AI 回复落库
+                    if i < len(questions):
+                        await pacer.wait_async(pacing_context(username, token, shop_id, i, full_reply))
+                        intended = time.perf_counter()
+
+                return success(conversation_id, results, messages_history, start_time)
+
+            except Exception as e:
+                return span.failure(conversation_id, str(e), start_time)
+
+
+async def run_conversations_async(count, token, product, questions, wait_between_questions=0,
+                                  shop_id="585", on_result=None, on_turn=None, keep_results=True):
+    """
+    在当前事件循环中同时运行 count 个对话
+
+    参数:
+        count: 对话数量
+        on_result: 每个对话结束时的回调，参数为对话结果（可选）
+        on_turn: 每轮请求结束时的回调（可选），见 run_conversation
+        keep_results: 是否保留并返回全部对话结果，长时间压测配合 on_result 使用时可关闭以节省内存
+        其余参数同 run_conversation
+
+    返回:
+        list: 按完成顺序排列的对话结果（keep_results=False 时为空列表）
+    """
+    tasks = [
+        asyncio.create_task(
+            run_conversation(i, token, product, questions, wait_between_questions, shop_id, on_turn=on_turn)
+        )
+        for i in range(count)
+    ]
+
+    all_results = []
+    try:
+        for finished in asyncio.as_completed(tasks):
+            result = await finished
+            if keep_results:
+                all_results.append(result)
+            if on_result is not None:
+                on_result(result)
+    finally:
+        await async_http.close()
+    return all_results
+
+
+def run_conversations(count, token, product, questions, wait_between_questions=0, shop_id="585",
+                      on_result=None, on_turn=None, pool_size=None, keep_results=True):
+    """
+    启动事件循环并发运行 count 个对话，参数同 run_conversations_async
+
+    参数:
+        pool_size: 连接池大小，默认与对话数量一致
+
+    返回:
+        list: 按完成顺序排列的对话结果
+    """
+    async_http.configure(pool_size=pool_size if pool_size is not None else count)
+    return asyncio.run(
+        run_conversations_async(count, token, product, questions, wait_between_questions, shop_id,
+                                on_result, on_turn, keep_results)
+    )
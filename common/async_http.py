@@ -0,0 +1,149 @@
+"""
+异步 HTTP 连接池（基于 aiohttp）
+- 每个事件循环共用一个 aiohttp.ClientSession，所有协程复用同一组 keep-alive 连接
+- 连接池大小、单 host 连接数上限可配置
+- 与同步客户端一样支持录制与回放（common.cassette）、按接口限流（common.rate_limit）
+  和超时 / 重试 / 熔断（common.resilience）
+- 命名接口的请求分阶段计时（common.http_timing），aiohttp 不区分 TCP 建连和 TLS 握手；
+  每次请求记录为链路追踪中的网络请求 span（common.tracing）
+- 需要安装 aiohttp: pip install aiohttp
+"""
+
+import json
+import time
+import asyncio
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from common import metrics
+from common import cassette
+from common import rate_limit
+from common import resilience
+from common import http_timing
+from common import tracing
+
+DEFAULT_POOL_SIZE = 100
+
+_config = {
+    "pool_size": DEFAULT_POOL_SIZE,
+    "limit_per_host": 0,
+}
+_sessions = {}  # event loop -> ClientSession
+
+
+class AsyncResponse:
+    """已读取完毕的响应，接口与 requests.Response 常用属性保持一致"""
+
+    def __init__(self, status_code, content, headers=None, request_bytes=None, timing=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.request_bytes = request_bytes
+        self.timing = timing
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def configure(pool_size=None, limit_per_host=None):
+    """
+    调整异步连接池配置，对之后新建的 session 生效
+
+    参数:
+        pool_size: 连接总数上限，0 表示不限制
+        limit_per_host: 单个 host 的连接数上限，0 表示不限制
+    """
+    if pool_size is not None:
+        _config["pool_size"] = pool_size
+    if limit_per_host is not None:
+        _config["limit_per_host"] = limit_per_host
+
+
+def get_session():
+    """获取当前事件循环共用的 ClientSession，必须在协程中调用"""
+    if aiohttp is None:
+        raise RuntimeError("异步模式需要安装 aiohttp: pip install aiohttp")
+
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=_config["pool_size"],
+            limit_per_host=_config["limit_per_host"],
+        )
+        session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar(),
+                                        trace_configs=[http_timing.trace_config()])
+        _sessions[loop] = session
+    return session
+
+
+async def request(method, url, endpoint=None, **kwargs):
+    """
+    发送请求并读取完整响应体，其余参数与 aiohttp.ClientSession.request 一致
+
+    参数:
+        endpoint: 接口名称（可选），传入时将本次请求耗时记录到 common.metrics 中同名的直方图，
+            并按该接口的策略超时 / 重试 / 熔断（common.resilience）；未传入时只设置默认超时
+    """
+    body = kwargs.get("data")
+    request_bytes = len(body) if isinstance(body, (bytes, str)) else None
+    tape = cassette.active(endpoint)
+
+    if tape is not None and tape.replaying:
+        start = time.perf_counter()
+        entry, delay = tape.lookup(method, url, kwargs.get("params"), cassette.request_body(kwargs))
+        if delay > 0:
+            await asyncio.sleep(delay)
+        metrics.record(endpoint, time.perf_counter() - start)
+        return AsyncResponse(entry["status"], entry["content"].encode("utf-8"), dict(entry["headers"]),
+                             request_bytes)
+
+    kwargs.setdefault("timeout", resilience.aiohttp_timeout(endpoint))
+
+    async def send():
+        return await _send(method, url, endpoint, tape, request_bytes, kwargs)
+
+    if endpoint is None:
+        return await send()
+    return await resilience.policy(endpoint).call_async(method, send)
+
+
+async def _send(method, url, endpoint, tape, request_bytes, kwargs):
+    """发送一次请求（每次重试各调用一次），记录耗时和 span 并录制"""
+    await rate_limit.acquire_async(endpoint)
+    body = cassette.request_body(kwargs)
+    request_id = body.get("request_id") if isinstance(body, dict) else None
+    with tracing.http_span(method, url, endpoint, request_id) as span:
+        kwargs = dict(kwargs, headers=tracing.inject(kwargs.get("headers")))
+        timing = http_timing.new(request_id)
+        start = time.perf_counter()
+        try:
+            async with get_session().request(method, url, trace_request_ctx=timing, **kwargs) as response:
+                content = await response.read()
+        except Exception:
+            if endpoint is not None:
+                metrics.incr(f"{endpoint}.errors")
+            raise
+        elapsed = time.perf_counter() - start
+        if endpoint is not None:
+            metrics.record(endpoint, elapsed)
+        timing = http_timing.finish(timing, endpoint)
+        tracing.annotate_response(span, response.status, timing)
+    if tape is not None:
+        tape.record(endpoint, method, url, kwargs.get("params"), body,
+                    response.status, response.headers, content, elapsed)
+    return AsyncResponse(response.status, content, dict(response.headers), request_bytes, timing)
+
+
+async def close():
+    """关闭当前事件循环的 ClientSession"""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
@@ -0,0 +1,319 @@
+"""
+容量探测
+- 逐级提高负载，每一级先预热再在稳定窗口内统计 吞吐（请求/秒）、p50/p99 延迟、错误率
+- 负载可以是 并发对话数（closed loop，每个槽位对话结束后立即开始下一个）或 到达速率（open loop）
+- 搜索方式:
+    step:   从 start 开始每次增加 step，直到不满足 SLO、吞吐不再增长（拐点）或达到 max
+    binary: 在 [start, max] 之间二分查找满足 SLO 的最大负载
+- SLO 在 yaml 中配置（p99 延迟上限、错误率上限）
+- 结果为可持续的最大负载以及每一级的 吞吐 / 延迟 曲线，可附加到 Allure（表格、JSON、SVG 曲线图）
+"""
+
+import json
+import time
+import asyncio
+import threading
+
+from common.metrics import LatencyHistogram
+
+MODES = ("concurrency", "rate")
+SEARCHES = ("step", "binary")
+
+
+class _LevelRecorder:
+    """统计落在稳定窗口内的轮次，可直接作为 on_turn 回调"""
+
+    def __init__(self, window_start, window_end):
+        self.window_start = window_start
+        self.window_end = window_end
+        self.latency = LatencyHistogram()
+        self.turns = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        received = record.get("received")
+        if received is None or not self.window_start <= received <= self.window_end:
+            return
+        with self._lock:
+            self.turns += 1
+            if record.get("error"):
+                self.errors += 1
+        # 从计划发送时间算起，开环模式下包含排队时间
+        self.latency.record(received - record["intended"])
+
+
+async def _hold_concurrency_async(level, duration, token, product, questions, pacer, shop_id, on_turn):
+    """保持 level 个对话同时进行 duration 秒，到时取消未完成的对话"""
+    from common import async_http
+    from common.async_conversation import run_conversation
+
+    async def slot(slot_id):
+        n = 0
+        while True:
+            await run_conversation(f"{slot_id}-{n}", token, product, questions, pacer, shop_id, on_turn=on_turn)
+            n += 1
+
+    tasks = [asyncio.create_task(slot(i)) for i in range(level)]
+    try:
+        await asyncio.wait(tasks, timeout=duration)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await async_http.close()
+
+
+def _hold_concurrency_threads(level, duration, token, product, questions, pacer, shop_id, on_turn):
+    """
+    线程版本: 每个槽位一个线程，到时后置位 stop，进行中的对话不再开始新的一轮，
+    等待所有线程退出后才返回，避免上一级的请求混入下一级的统计
+    """
+    from common import http_client
+    from common.conversation import run_single_conversation
+
+    stop = threading.Event()
+
+    def slot(slot_id):
+        n = 0
+        while not stop.is_set():
+            run_single_conversation(f"{slot_id}-{n}", token, product, questions, pacer, shop_id,
+                                    on_turn=on_turn, stop=stop)
+            n += 1
+
+    http_client.configure(pool_size=level)
+    threads = [threading.Thread(target=slot, args=(i,), daemon=True) for i in range(level)]
+    for thread in threads:
+        thread.start()
+    stop.wait(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+
+def measure_level(level, token, product, questions, mode="concurrency", warmup=30, window=60,
+                  wait_between_questions=0, shop_id="585", engine="asyncio", arrival="poisson"):
+    """
+    在指定负载下运行 warmup + window 秒，只统计稳定窗口内完成的轮次
+
+    参数:
+        level: 并发对话数（concurrency）或 每秒新建对话数（rate）
+        mode: concurrency / rate
+        warmup / window: 预热时长、统计窗口时长（秒）
+        engine: concurrency 模式的执行引擎 asyncio / thread；rate 模式固定使用 asyncio
+        arrival: rate 模式的到达方式 fixed / poisson
+
+    返回:
+        dict: {"level", "turns", "errors", "throughput", "error_rate", "p50_ms", "p99_ms", "latency_ms"}
+    """
+    start = time.perf_counter()
+    recorder = _LevelRecorder(start + warmup, start + warmup + window)
+    args = (token, product, questions, wait_between_questions, shop_id, recorder)
+
+    if mode == "rate":
+        from common.open_loop import run_open_loop
+        run_open_loop(token, product, questions, rate=level, duration=warmup + window, arrival=arrival,
+                      wait_between_questions=wait_between_questions, shop_id=shop_id,
+                      on_turn=recorder, keep_results=False)
+    elif engine == "asyncio":
+        from common import async_http
+        async_http.configure(pool_size=level)
+        asyncio.run(_hold_concurrency_async(level, warmup + window, *args))
+    else:
+        _hold_concurrency_threads(level, warmup + window, *args)
+
+    summary = recorder.latency.summary()
+    return {
+        "level": level,
+        "turns": recorder.turns,
+        "errors": recorder.errors,
+        "throughput": round(recorder.turns / window, 3) if window else 0.0,
+        "error_rate": round(recorder.errors / recorder.turns, 4) if recorder.turns else 1.0,
+        "p50_ms": summary.get("p50", 0.0),
+        "p99_ms": summary.get("p99", 0.0),
+        "latency_ms": summary,
+    }
+
+
+def check_slo(point, slo):
+    """
+    判断一级负载是否满足 SLO
+
+    返回:
+        str: 不满足的原因；满足返回 None
+    """
+    if point["turns"] == 0:
+        return "稳定窗口内没有完成的请求"
+    if slo.get("p99_ms") is not None and point["p99_ms"] > slo["p99_ms"]:
+        return f"p99 {point['p99_ms']:.0f}ms 超过 {slo['p99_ms']}ms"
+    if slo.get("error_rate") is not None and point["error_rate"] > slo["error_rate"]:
+        return f"错误率 {point['error_rate']:.2%} 超过 {slo['error_rate']:.2%}"
+    return None
+
+
+def search(measure, start, max_level, step=1, strategy="step", slo=None, plateau_gain=0.05, resolution=1):
+    """
+    搜索满足 SLO 的最大负载
+
+    参数:
+        measure: 函数 measure(level) -> measure_level() 格式的结果
+        start / max_level: 搜索范围
+        step: step 搜索的步长
+        strategy: step / binary
+        slo: {"p99_ms": ..., "error_rate": ...}
+        plateau_gain: step 搜索中，吞吐增幅低于该比例视为到达拐点
+        resolution: binary 搜索的精度；start 和 max_level 都是整数时至少为 1
+
+    返回:
+        dict: {"max_sustainable", "stop_reason", "points": [...]}
+    """
+    if strategy not in SEARCHES:
+        raise ValueError(f"不支持的搜索方式: {strategy}")
+    slo = slo or {}
+    points = []
+    best = None
+    best_throughput = 0.0
+
+    def run(level):
+        point = measure(level)
+        point["failure"] = check_slo(point, slo)
+        point["passed"] = point["failure"] is None
+        points.append(point)
+        print(f"[容量] 负载 {level}: 吞吐 {point['throughput']:.2f}/s, p99 {point['p99_ms']:.0f}ms, "
+              f"错误率 {point['error_rate']:.2%} -> {'通过' if point['passed'] else point['failure']}")
+        return point
+
+    stop_reason = f"达到搜索上限 {max_level}"
+    if strategy == "step":
+        level = start
+        while level <= max_level:
+            point = run(level)
+            if not point["passed"]:
+                stop_reason = point["failure"]
+                break
+            if best is not None and point["throughput"] < best_throughput * (1 + plateau_gain):
+                point["passed"] = False
+                point["failure"] = stop_reason = f"吞吐增幅低于 {plateau_gain:.0%}，已到达拐点"
+                break
+            best, best_throughput = level, point["throughput"]
+            level += step
+    else:
+        low, high = start, max_level
+        if not run(low)["passed"]:
+            stop_reason = f"起始负载 {low} 即不满足 SLO"
+        elif run(high)["passed"]:
+            best = high
+        else:
+            best = low
+            integer = isinstance(start, int) and isinstance(max_level, int)
+            if integer:
+                resolution = max(resolution, 1)
+            while high - low > resolution:
+                mid = low + (high - low) / 2
+                if integer:
+                    mid = int(mid)
+                if mid in (low, high):
+                    break
+                if run(mid)["passed"]:
+                    low = best = mid
+                else:
+                    high = mid
+            stop_reason = f"二分查找收敛，上界 {high} 不满足 SLO"
+
+    return {"max_sustainable": best, "stop_reason": stop_reason,
+            "points": sorted(points, key=lambda p: p["level"])}
+
+
+def run_capacity_search(token, product, questions, config, wait_between_questions=0, shop_id="585"):
+    """
+    按 yaml 中的 capacity_config 执行容量探测
+
+    参数:
+        config: {"mode", "search", "start", "step", "max", "resolution", "warmup", "window",
+                 "engine", "arrival", "plateau_gain", "slo": {"p99_ms", "error_rate"}}
+
+    返回:
+        dict: search() 的结果，附带 mode 和 slo
+    """
+    mode = config.get("mode", "concurrency")
+    if mode not in MODES:
+        raise ValueError(f"不支持的容量探测模式: {mode}")
+
+    def measure(level):
+        return measure_level(
+            level, token, product, questions, mode=mode,
+            warmup=config.get("warmup", 30), window=config.get("window", 60),
+            wait_between_questions=wait_between_questions, shop_id=shop_id,
+            engine=config.get("engine", "asyncio"), arrival=config.get("arrival", "poisson"),
+        )
+
+    result = search(
+        measure, config.get("start", 1), config.get("max", 50), step=config.get("step", 1),
+        strategy=config.get("search", "step"), slo=config.get("slo"),
+        plateau_gain=config.get("plateau_gain", 0.05), resolution=config.get("resolution", 1),
+    )
+    result["mode"] = mode
+    result["slo"] = config.get("slo") or {}
+    return result
+
+
+def format_curve(result):
+    """将每一级的结果渲染为文本表格"""
+    unit = "并发数" if result.get("mode", "concurrency") == "concurrency" else "速率/s"
+    lines = [f"{unit:<8}{'吞吐/s':>10}{'p50(ms)':>11}{'p99(ms)':>11}{'错误率':>9}  结果"]
+    for p in result["points"]:
+        lines.append(f"{p['level']:<10}{p['throughput']:>10.2f}{p['p50_ms']:>11.1f}{p['p99_ms']:>11.1f}"
+                     f"{p['error_rate']:>10.2%}  {'通过' if p['passed'] else p['failure']}")
+    lines.append("")
+    lines.append(f"可持续最大负载: {result['max_sustainable']}（{result['stop_reason']}）")
+    return "\n".join(lines)
+
+
+def render_svg(result, width=640, height=360):
+    """生成 吞吐 / p99 随负载变化的 SVG 曲线图（吞吐为左轴蓝线，p99 为右轴红线）"""
+    points = result["points"]
+    margin = 50
+    plot_w, plot_h = width - 2 * margin, height - 2 * margin
+    levels = [p["level"] for p in points] or [0]
+    x_min, x_max = min(levels), max(levels)
+    x_span = (x_max - x_min) or 1
+    max_tp = max([p["throughput"] for p in points] + [1e-9])
+    max_p99 = max([p["p99_ms"] for p in points] + [1e-9])
+
+    def xy(level, value, top):
+        x = margin + (level - x_min) / x_span * plot_w
+        y = margin + plot_h - value / top * plot_h
+        return f"{x:.1f},{y:.1f}"
+
+    tp_line = " ".join(xy(p["level"], p["throughput"], max_tp) for p in points)
+    p99_line = " ".join(xy(p["level"], p["p99_ms"], max_p99) for p in points)
+    knee = result.get("max_sustainable")
+    knee_x = margin + (knee - x_min) / x_span * plot_w if knee is not None else None
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-size="12">',
+        f'<rect x="{margin}" y="{margin}" width="{plot_w}" height="{plot_h}" fill="none" stroke="#999"/>',
+        f'<polyline points="{tp_line}" fill="none" stroke="#1f77b4" stroke-width="2"/>',
+        f'<polyline points="{p99_line}" fill="none" stroke="#d62728" stroke-width="2"/>',
+        f'<text x="{margin}" y="{margin - 8}" fill="#1f77b4">吞吐 最高 {max_tp:.2f}/s</text>',
+        f'<text x="{width - margin}" y="{margin - 8}" fill="#d62728" text-anchor="end">p99 最高 {max_p99:.0f}ms</text>',
+        f'<text x="{margin}" y="{height - margin + 20}">{x_min}</text>',
+        f'<text x="{width - margin}" y="{height - margin + 20}" text-anchor="end">{x_max}</text>',
+    ]
+    if knee_x is not None:
+        parts.append(f'<line x1="{knee_x:.1f}" y1="{margin}" x2="{knee_x:.1f}" y2="{margin + plot_h}" '
+                     f'stroke="#2ca02c" stroke-dasharray="4"/>')
+        parts.append(f'<text x="{knee_x:.1f}" y="{height - margin + 35}" fill="#2ca02c" text-anchor="middle">'
+                     f'可持续最大负载 {knee}</text>')
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+def attach_to_allure(result, name="容量探测"):
+    """将容量曲线以表格、JSON、SVG 曲线图附加到 Allure 报告"""
+    import allure
+
+    allure.attach(format_curve(result), name=f"{name}（表格）", attachment_type=allure.attachment_type.TEXT)
+    allure.attach(json.dumps(result, ensure_ascii=False, indent=2), name=name,
+                  attachment_type=allure.attachment_type.JSON)
+    allure.attach(render_svg(result), name=f"{name}（曲线）", attachment_type=allure.attachment_type.SVG)
@@ -0,0 +1,259 @@
+"""
+接口录制 / 回放（cassette）
+- record: 正常请求线上接口，同时把 聊天 / 商品列表 接口的响应录制到 .cache/cassettes/<名称>.jsonl.gz
+- replay: 不发请求，按请求指纹返回录制的响应；可按原始耗时（或按比例）模拟延迟
+- off:    默认，不做任何处理
+- 请求指纹 = 方法 + 路径 + 排序后的查询参数 + 去掉易变字段（request_id、created_at、
+  last_order_time、username）后的请求体；不含域名和 token，录制结果可在任意环境回放
+- 同一指纹出现多次时按录制顺序依次返回，用完后重复返回最后一条
+- 登录不录制（避免账号密码和 token 落盘）；回放时 common.token_cache 直接返回占位 token，不访问登录接口
+
+环境变量:
+    CASSETTE_MODE=record|replay|off   模式，默认 off
+    CASSETTE_NAME=xxx                 未通过 use() 指定名称时使用的录制文件名，默认 default
+    CASSETTE_TIMING=0|1|0.5           回放时的延迟比例: 0 不等待（默认），1 按原始耗时，0.5 按一半耗时
+
+用法:
+    with cassette.use("chat"):
+        response = chat(...)       # 录制或回放
+"""
+
+import os
+import gzip
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+CASSETTE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "cassettes")
+
+# 参与录制 / 回放的接口（http_client.request 的 endpoint 参数）
+ENDPOINTS = ("chat", "products")
+# 计算指纹时忽略的字段，每次请求都会变化
+VOLATILE_FIELDS = frozenset({"request_id", "created_at", "last_order_time", "username"})
+# 录制时保留的响应头
+KEEP_HEADERS = ("Content-Type",)
+
+MODES = ("off", "record", "replay")
+
+_lock = threading.Lock()
+_active = None
+
+
+class CassetteMiss(LookupError):
+    """回放模式下找不到匹配的录制"""
+
+
+def _normalize(value):
+    """递归去掉易变字段"""
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if k not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def request_body(kwargs):
+    """从请求参数中取出请求体（json= 或 data= 中的 JSON）"""
+    if kwargs.get("json") is not None:
+        return kwargs["json"]
+    data = kwargs.get("data")
+    if isinstance(data, (bytes, str)) and data:
+        try:
+            return json.loads(data)
+        except ValueError:
+            return data if isinstance(data, str) else data.decode("utf-8", errors="replace")
+    return None
+
+
+def fingerprint(method, url, params=None, body=None):
+    """
+    计算请求指纹
+
+    参数:
+        method: 请求方法
+        url: 完整地址，只使用其中的路径
+        params: 查询参数
+        body: 请求体（已解析的 JSON）
+    """
+    canonical = json.dumps(
+        [
+            method.upper(),
+            urlsplit(url).path,
+            sorted((str(k), str(v)) for k, v in (params or {}).items()),
+            _normalize(body),
+        ],
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    一卷录制
+
+    参数:
+        name: 名称，对应 .cache/cassettes/<name>.jsonl.gz
+        mode: record / replay
+        timing: 回放延迟比例，0 表示不等待
+    """
+
+    def __init__(self, name, mode, timing=0.0):
+        if mode not in MODES:
+            raise ValueError(f"不支持的录制模式: {mode}")
+        self.name = name
+        self.mode = mode
+        self.timing = timing
+        self.path = os.path.join(CASSETTE_DIR, f"{name}.jsonl.gz")
+        self._lock = threading.Lock()
+        self._entries = {}   # 指纹 -> [录制条目, ...]
+        self._cursor = {}    # 指纹 -> 下一次回放的下标
+        self._dirty = False
+        if mode == "replay":
+            self.load()
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def __len__(self):
+        return sum(len(v) for v in self._entries.values())
+
+    def load(self):
+        """读取录制文件"""
+        if not os.path.exists(self.path):
+            raise CassetteMiss(f"录制文件不存在: {self.path}，请先用 CASSETTE_MODE=record 运行一次")
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["fingerprint"], []).append(entry)
+
+    def save(self):
+        """写入录制文件（仅录制模式且有新内容时）"""
+        with self._lock:
+            if self.mode != "record" or not self._dirty:
+                return
+            entries = sorted((e for v in self._entries.values() for e in v), key=lambda e: e["seq"])
+            self._dirty = False
+        os.makedirs(CASSETTE_DIR, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        os.replace(tmp_path, self.path)
+        print(f"[录制] 已保存 {len(entries)} 条到 {self.path}")
+
+    def record(self, endpoint, method, url, params, body, status, headers, content, elapsed):
+        """录制一次响应"""
+        fp = fingerprint(method, url, params, body)
+        entry = {
+            "fingerprint": fp,
+            "endpoint": endpoint,
+            "method": method.upper(),
+            "path": urlsplit(url).path,
+            "status": status,
+            "headers": {k: headers[k] for k in KEEP_HEADERS if k in headers},
+            "content": content.decode("utf-8", errors="replace"),
+            "elapsed": round(elapsed, 4),
+        }
+        with self._lock:
+            entry["seq"] = len(self)
+            self._entries.setdefault(fp, []).append(entry)
+            self._dirty = True
+
+    def lookup(self, method, url, params, body):
+        """
+        查找匹配的录制
+
+        返回:
+            (录制条目, 需要模拟的延迟秒数)
+        """
+        fp = fingerprint(method, url, params, body)
+        with self._lock:
+            entries = self._entries.get(fp)
+            if not entries:
+                raise CassetteMiss(f"录制 {self.name} 中没有匹配的请求: {method.upper()} {urlsplit(url).path}")
+            index = self._cursor.get(fp, 0)
+            self._cursor[fp] = index + 1
+        entry = entries[min(index, len(entries) - 1)]
+        return entry, entry["elapsed"] * self.timing
+
+
+def _env_timing():
+    try:
+        return float(os.environ.get("CASSETTE_TIMING") or 0)
+    except ValueError:
+        return 0.0
+
+
+def _env_mode():
+    return (os.environ.get("CASSETTE_MODE") or "off").lower()
+
+
+@contextmanager
+def use(name, mode=None, timing=None):
+    """
+    在 with 块内启用指定名称的录制，退出时保存录制结果并恢复之前的设置
+
+    参数:
+        name: 录制名称
+        mode: record / replay / off，默认取环境变量 CASSETTE_MODE
+        timing: 回放延迟比例，默认取环境变量 CASSETTE_TIMING
+    """
+    global _active
+    mode = mode or _env_mode()
+    tape = None if mode == "off" else Cassette(name, mode, _env_timing() if timing is None else timing)
+    with _lock:
+        previous, _active = _active, tape
+    try:
+        yield tape
+    finally:
+        with _lock:
+            _active = previous
+        if tape is not None:
+            tape.save()
+
+
+def active(endpoint):
+    """返回该接口当前生效的录制，未启用时返回 None"""
+    global _active
+    if endpoint not in ENDPOINTS:
+        return None
+    tape = _active
+    if tape is None and _env_mode() != "off":
+        # 未通过 use() 指定时，按环境变量启用一卷默认录制，进程退出时保存
+        import atexit
+
+        with _lock:
+            if _active is None:
+                _active = Cassette(os.environ.get("CASSETTE_NAME") or "default", _env_mode(), _env_timing())
+                atexit.register(_active.save)
+            tape = _active
+    return tape
+
+
+def replaying():
+    """当前是否处于回放模式"""
+    tape = _active
+    return tape.replaying if tape is not None else _env_mode() == "replay"
+
+
+def build_response(entry, method, url, kwargs):
+    """将录制条目还原为 requests.Response"""
+    import requests
+    from requests.structures import CaseInsensitiveDict
+
+    response = requests.Response()
+    response.status_code = entry["status"]
+    response._content = entry["content"].encode("utf-8")
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response.encoding = "utf-8"
+    response.url = url
+    response.request = requests.Request(
+        method, url, params=kwargs.get("params"), json=kwargs.get("json"), data=kwargs.get("data")
+    ).prepare()
+    return response
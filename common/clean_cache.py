@@ -1,69 +1,390 @@
+"""
+清理缓存和测试产物
+- 缓存: pytest-cache-files-*、__pycache__、.pytest_cache，对项目目录只扫描一遍（os.scandir），
+  不进入隐藏目录（.git、.venv 等），与原先 glob("**") 的匹配范围一致
+- 删除时顺带统计大小，每个目录只遍历一次；多个待删除目录在线程池中并行删除
+- 保留策略（配置见 data/clean_cache.yaml）:
+    reports/allure-results:         按执行批次保留最近 keep_runs 次，或 max_age_days 天内的结果，满足任一条件即保留
+    reports/allure-report/history:  每个用例的历史和趋势保留最近 keep_builds 次构建，或 max_age_days 天内的记录
+  未配置（留空）的条件不生效，两个条件都为空时不清理
+- 本地 mock 服务留下的 token（.cache/tokens.json 中的条目）和商品目录缓存文件
+- dry_run: 只统计将要删除的文件和可以释放的空间，不实际删除
+
+用法:
+    python -m common.clean_cache                 # 按配置清理
+    python -m common.clean_cache --dry-run       # 只统计
+    python -m common.clean_cache --keep-runs 3 --max-age-days 7
+"""
 
 import os
-import shutil
-import glob
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_FILE = os.path.join(ROOT_DIR, "data", "clean_cache.yaml")
+
+# 缓存目录名（任意层级）和根目录下的缓存目录前缀
+CACHE_DIR_NAMES = {"__pycache__", ".pytest_cache"}
+ROOT_CACHE_PREFIX = "pytest-cache-files-"
+# 两个用例之间的间隔超过该值（秒）时视为不同的执行批次
+RUN_GAP = 300
+
+DEFAULT_CONFIG = {
+    "workers": None,
+    "allure_results": {"path": "reports/allure-results", "keep_runs": None, "max_age_days": None},
+    "history": {"path": "reports/allure-report/history", "keep_builds": None, "max_age_days": None},
+}
+
+
+def _format_size(size):
+    if size < 1024:
+        return str(size) + " B"
+    if size < 1024 * 1024:
+        return "{:.2f} KB".format(size / 1024)
+    if size < 1024 * 1024 * 1024:
+        return "{:.2f} MB".format(size / (1024 * 1024))
+    return "{:.2f} GB".format(size / (1024 * 1024 * 1024))
+
+
+def _remove_tree(path, dry_run=False):
+    """
+    单次遍历删除目录（后序: 先删内容再删目录），同时统计大小
+
+    返回:
+        (文件数, 字节数, 错误列表)
+    """
+    files, size, errors = 0, 0, []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    n, s, e = _remove_tree(entry.path, dry_run)
+                    files, size = files + n, size + s
+                    errors.extend(e)
+                    continue
+                try:
+                    size += entry.stat(follow_symlinks=False).st_size
+                    if not dry_run:
+                        os.unlink(entry.path)
+                    files += 1
+                except OSError as e:
+                    errors.append(f"{entry.path}: {e}")
+        if not dry_run:
+            os.rmdir(path)
+    except OSError as e:
+        errors.append(f"{path}: {e}")
+    return files, size, errors
+
+
+def _remove_file(path, dry_run=False):
+    try:
+        size = os.stat(path, follow_symlinks=False).st_size
+        if not dry_run:
+            os.unlink(path)
+        return 1, size, []
+    except OSError as e:
+        return 0, 0, [f"{path}: {e}"]
+
+
+def _remove_all(paths, dry_run=False, workers=None, verbose=True):
+    """
+    在线程池中并行删除文件 / 目录
 
+    返回:
+        (删除的文件 / 目录数, 字节数)
+    """
+    if not paths:
+        return 0, 0
 
-def clean_pytest_cache(root_dir=None):
+    def remove(path):
+        is_dir = os.path.isdir(path) and not os.path.islink(path)
+        result = _remove_tree(path, dry_run) if is_dir else _remove_file(path, dry_run)
+        return path, is_dir, result
+
+    count, total = 0, 0
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as executor:
+        for path, is_dir, (files, size, errors) in executor.map(remove, paths):
+            for error in errors:
+                print("[删除失败] " + error)
+            if errors and not files:
+                continue
+            count += 1
+            total += size
+            if verbose:
+                action = "[将删除]" if dry_run else ("[删除目录]" if is_dir else "[删除文件]")
+                print(f"{action} {path}" + (f" ({files} 个文件, {_format_size(size)})" if is_dir else ""))
+    return count, total
+
+
+def find_cache_dirs(root_dir):
+    """单次遍历找出所有缓存目录，找到后不再进入其内部"""
+    found = []
+    stack = [root_dir]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if not entry.is_dir(follow_symlinks=False):
+                        continue
+                    if entry.name in CACHE_DIR_NAMES or \
+                            (directory == root_dir and entry.name.startswith(ROOT_CACHE_PREFIX)):
+                        found.append(entry.path)
+                    elif not entry.name.startswith("."):
+                        stack.append(entry.path)
+        except OSError as e:
+            print(f"[跳过] {directory}: {e}")
+    return sorted(found)
+
+
+def clean_pytest_cache(root_dir=None, dry_run=False, workers=None):
+    """
+    清理 pytest / Python 缓存目录
+
+    返回:
+        (删除的目录数, 释放的字节数)
+    """
     if root_dir is None:
-        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    
+        root_dir = ROOT_DIR
+
     print("开始清理目录: " + root_dir)
     print("=" * 60)
-    
-    patterns = [
-        os.path.join(root_dir, "pytest-cache-files-*"),
-        os.path.join(root_dir, "**", "__pycache__"),
-        os.path.join(root_dir, ".pytest_cache"),
-        os.path.join(root_dir, "**", ".pytest_cache"),
-    ]
-    
-    deleted_count = 0
-    deleted_size = 0
-    
-    for pattern in patterns:
-        for path in glob.glob(pattern, recursive=True):
-            if os.path.exists(path):
-                try:
-                    if os.path.isfile(path):
-                        size = os.path.getsize(path)
-                    else:
-                        size = 0
-                        for dirpath, dirnames, filenames in os.walk(path):
-                            for filename in filenames:
-                                filepath = os.path.join(dirpath, filename)
-                                if os.path.exists(filepath):
-                                    size += os.path.getsize(filepath)
-                    
-                    if os.path.isfile(path):
-                        os.remove(path)
-                        print("[删除文件] " + path)
-                    else:
-                        shutil.rmtree(path)
-                        print("[删除目录] " + path)
-                    
-                    deleted_count += 1
-                    deleted_size += size
-                    
-                except Exception as e:
-                    print("[删除失败] " + path + ": " + str(e))
-    
+    deleted_count, deleted_size = _remove_all(find_cache_dirs(root_dir), dry_run, workers)
     print("=" * 60)
-    print("清理完成！共删除 " + str(deleted_count) + " 个文件/目录")
-    
-    if deleted_size < 1024:
-        size_str = str(deleted_size) + " B"
-    elif deleted_size < 1024 * 1024:
-        size_str = "{:.2f} KB".format(deleted_size / 1024)
-    elif deleted_size < 1024 * 1024 * 1024:
-        size_str = "{:.2f} MB".format(deleted_size / (1024 * 1024))
-    else:
-        size_str = "{:.2f} GB".format(deleted_size / (1024 * 1024 * 1024))
-    
-    print("释放空间: " + size_str)
+    print(("预计可删除 " if dry_run else "清理完成！共删除 ") + str(deleted_count) + " 个文件/目录")
+    print(("预计释放空间: " if dry_run else "释放空间: ") + _format_size(deleted_size))
     return deleted_count, deleted_size
 
 
-if __name__ == "__main__":
-    clean_pytest_cache()
+def _result_runs(results_dir, run_gap=RUN_GAP):
+    """
+    把结果目录中的文件按执行批次分组
+    - 用例的 [start, stop] 区间相互重叠或间隔小于 run_gap 的归为同一批次
+    - 附件按用例（含各级步骤）的引用、container 按 children 归入对应用例的批次
+    - 未被引用的文件按修改时间归入所在区间的批次，落在批次之外的单独成组
+
+    返回:
+        list: [{"start", "stop", "files": [...]}]，按时间从新到旧排列
+    """
+    results, containers, others = [], [], []
+    with os.scandir(results_dir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            if entry.name.endswith("-result.json"):
+                results.append(entry)
+            elif entry.name.endswith("-container.json"):
+                containers.append(entry)
+            else:
+                others.append(entry)
+
+    def refs(node, found):
+        for attachment in node.get("attachments") or []:
+            found.append(attachment["source"])
+        for step in node.get("steps") or []:
+            refs(step, found)
+        return found
+
+    tests = []
+    for entry in results:
+        mtime_ms = entry.stat().st_mtime * 1000
+        try:
+            with open(entry.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        start = data.get("start") or mtime_ms
+        stop = data.get("stop") or start
+        tests.append((start, stop, entry.name, data.get("uuid"), refs(data, [])))
+    tests.sort()
+
+    runs, owner = [], {}
+    for start, stop, name, uuid, attachments in tests:
+        if not runs or start - runs[-1]["stop"] > run_gap * 1000:
+            runs.append({"start": start, "stop": stop, "files": []})
+        run = runs[-1]
+        run["stop"] = max(run["stop"], stop)
+        run["files"].append(name)
+        for source in attachments:
+            owner[source] = run
+        if uuid:
+            owner[uuid] = run
+
+    def locate(entry):
+        mtime_ms = entry.stat().st_mtime * 1000
+        for run in runs:
+            if run["start"] - run_gap * 1000 <= mtime_ms <= run["stop"] + run_gap * 1000:
+                return run
+        run = {"start": mtime_ms, "stop": mtime_ms, "files": []}
+        runs.append(run)
+        return run
 
+    for entry in containers:
+        run = None
+        try:
+            with open(entry.path, "r", encoding="utf-8") as f:
+                children = json.load(f).get("children") or []
+            run = next((owner[c] for c in children if c in owner), None)
+        except (OSError, ValueError):
+            pass
+        (run or locate(entry))["files"].append(entry.name)
+    for entry in others:
+        (owner.get(entry.name) or locate(entry))["files"].append(entry.name)
+
+    return sorted(runs, key=lambda r: r["stop"], reverse=True)
+
+
+def _retained(index, timestamp_ms, keep, max_age_days, now):
+    """第 index 新（从 0 开始）、时间为 timestamp_ms 的记录是否保留"""
+    if keep is None and max_age_days is None:
+        return True
+    if keep is not None and index < keep:
+        return True
+    return max_age_days is not None and timestamp_ms >= (now - max_age_days * 86400) * 1000
+
+
+def prune_results(results_dir, keep_runs=None, max_age_days=None, dry_run=False, workers=None, run_gap=RUN_GAP):
+    """
+    按保留策略删除 allure-results 中较早的执行批次
+
+    返回:
+        (删除的文件数, 释放的字节数)
+    """
+    if not os.path.isdir(results_dir) or (keep_runs is None and max_age_days is None):
+        return 0, 0
+    now = time.time()
+    runs = _result_runs(results_dir, run_gap)
+    expired = [run for i, run in enumerate(runs) if not _retained(i, run["stop"], keep_runs, max_age_days, now)]
+    paths = [os.path.join(results_dir, name) for run in expired for name in run["files"]]
+    count, size = _remove_all(paths, dry_run, workers, verbose=False)
+    print(f"[allure-results] 共 {len(runs)} 批执行结果，{'将删除' if dry_run else '删除'} {len(expired)} 批 "
+          f"({count} 个文件, {_format_size(size)})")
+    return count, size
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def prune_history(history_dir, keep_builds=None, max_age_days=None, dry_run=False):
+    """
+    按保留策略裁剪报告历史: history.json 中每个用例的历史记录，以及各趋势文件中的构建
+
+    返回:
+        (删除的记录数, 释放的字节数)
+    """
+    if not os.path.isdir(history_dir) or (keep_builds is None and max_age_days is None):
+        return 0, 0
+    now = time.time()
+    removed, reclaimed = 0, 0
+    for entry in os.scandir(history_dir):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            with open(entry.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[跳过] {entry.path}: {e}")
+            continue
+
+        if isinstance(data, dict):
+            # history.json: {historyId: {"statistic", "items": [新 -> 旧]}}
+            pruned = {}
+            for history_id, item in data.items():
+                items = [h for i, h in enumerate(item.get("items", []))
+                         if _retained(i, (h.get("time") or {}).get("stop") or 0, keep_builds, max_age_days, now)]
+                removed += len(item.get("items", [])) - len(items)
+                if items:
+                    pruned[history_id] = dict(item, items=items)
+            data_after = pruned
+        else:
+            # 趋势文件: [新 -> 旧]，没有时间信息，只按构建数保留
+            data_after = data[:keep_builds] if keep_builds is not None else data
+            removed += len(data) - len(data_after)
+
+        if data_after == data:
+            continue
+        size_after = len(json.dumps(data_after, ensure_ascii=False, indent=2).encode("utf-8"))
+        reclaimed += max(entry.stat().st_size - size_after, 0)
+        if not dry_run:
+            _write_json(entry.path, data_after)
+
+    print(f"[history] {'将删除' if dry_run else '删除'} {removed} 条历史记录 ({_format_size(reclaimed)})")
+    return removed, reclaimed
+
+
+def load_config(path=CONFIG_FILE):
+    """读取清理配置并与默认配置合并"""
+    from common import config_cache
+
+    config = {key: dict(value) if isinstance(value, dict) else value for key, value in DEFAULT_CONFIG.items()}
+    for key, value in ((config_cache.load(path) if path else None) or {}).items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+    return config
+
+
+def clean(root_dir=None, config=None, dry_run=False):
+    """
+    清理缓存，并按保留策略清理 allure-results 和报告历史
+
+    返回:
+        dict: {"cache": (数量, 字节), "allure_results": (...), "history": (...), "total_bytes"}
+    """
+    root_dir = root_dir or ROOT_DIR
+    config = load_config() if config is None else config
+    workers = config.get("workers")
+    results, history = config["allure_results"], config["history"]
+
+    report = {
+        "cache": clean_pytest_cache(root_dir, dry_run, workers),
+        "allure_results": prune_results(os.path.join(root_dir, results["path"]), results.get("keep_runs"),
+                                        results.get("max_age_days"), dry_run, workers),
+        "history": prune_history(os.path.join(root_dir, history["path"]), history.get("keep_builds"),
+                                 history.get("max_age_days"), dry_run),
+    }
+    report["total_bytes"] = sum(size for _, size in report.values())
+    # 本地 mock 服务（端口每次不同）留下的 token 和商品目录缓存，只在清理本项目时处理
+    from common import token_cache, product_catalog
+    stale = 0
+    if os.path.abspath(root_dir) == ROOT_DIR:
+        stale = token_cache.prune_disk(dry_run) + product_catalog.prune_disk(dry_run)
+    if stale:
+        print(f"[本地缓存] {'将清理' if dry_run else '清理'} {stale} 个 mock 服务 / 已过期的 token 和商品目录缓存")
+    print(("合计可释放: " if dry_run else "合计释放: ") + _format_size(report["total_bytes"]))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="清理缓存和测试产物")
+    parser.add_argument("--root", default=ROOT_DIR, help="项目目录")
+    parser.add_argument("--config", default=CONFIG_FILE, help="配置文件路径")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不删除")
+    parser.add_argument("--keep-runs", type=int, help="allure-results 保留最近几次执行")
+    parser.add_argument("--keep-builds", type=int, help="报告历史保留最近几次构建")
+    parser.add_argument("--max-age-days", type=float, help="allure-results 和报告历史保留最近几天")
+    parser.add_argument("--workers", type=int, help="删除线程数")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if args.keep_runs is not None:
+        config["allure_results"]["keep_runs"] = args.keep_runs
+    if args.keep_builds is not None:
+        config["history"]["keep_builds"] = args.keep_builds
+    if args.max_age_days is not None:
+        config["allure_results"]["max_age_days"] = args.max_age_days
+        config["history"]["max_age_days"] = args.max_age_days
+    if args.workers is not None:
+        config["workers"] = args.workers
+    clean(args.root, config, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+YAML 配置缓存
+- 解析结果按文件路径缓存，以文件的 mtime + 大小判断是否过期，文件修改后自动重新解析
+- 进程内缓存: 同一进程多次读取同一配置只 stat 一次文件，不再重复解析
+- 磁盘缓存: 解析结果以 pickle 写入 .cache/config/，新进程（pytest 收集、多进程 worker）直接加载，
+  跳过 YAML 解析；缓存损坏或版本不一致时忽略并重新解析
+- 每次返回独立的副本，调用方可以随意修改
+- 有 libyaml 时使用 CSafeLoader
+
+用法:
+    from common import config_cache
+    config = config_cache.load("data/chat_data.yaml") or {}
+"""
+
+import os
+import pickle
+import hashlib
+import threading
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(ROOT_DIR, ".cache", "config")
+# 缓存格式变化时递增，旧缓存自动失效
+CACHE_VERSION = 1
+
+_lock = threading.Lock()
+# {绝对路径: (mtime_ns, size, pickle 后的数据)}
+_memory = {}
+
+
+def _parse(path):
+    import yaml
+
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=loader)
+
+
+def _cache_file(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    digest = hashlib.sha1(path.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f"{name}-{digest}.pickle")
+
+
+def _read_disk(path, key):
+    try:
+        with open(_cache_file(path), "rb") as f:
+            version, mtime_ns, size, blob = pickle.load(f)
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+        return None
+    if (version, mtime_ns, size) != (CACHE_VERSION,) + key:
+        return None
+    return blob
+
+
+def _write_disk(path, key, blob):
+    cache_file = _cache_file(path)
+    tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp_file, "wb") as f:
+            pickle.dump((CACHE_VERSION,) + key + (blob,), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        # 缓存只是加速手段，写入失败不影响读取配置
+        print(f"[配置缓存] 写入失败: {cache_file}: {e}")
+
+
+def load(path, default=None):
+    """
+    读取 YAML 配置，优先使用缓存
+
+    参数:
+        path: 配置文件路径
+        default: 文件不存在时的返回值
+
+    返回:
+        解析后的数据（空文件为 None），每次调用返回新的副本
+    """
+    path = os.path.abspath(path)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return default
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    with _lock:
+        cached = _memory.get(path)
+    if cached is None or cached[:2] != key:
+        blob = _read_disk(path, key)
+        if blob is None:
+            blob = pickle.dumps(_parse(path), protocol=pickle.HIGHEST_PROTOCOL)
+            _write_disk(path, key, blob)
+        cached = key + (blob,)
+        with _lock:
+            _memory[path] = cached
+    return pickle.loads(cached[2])
+
+
+def clear(disk=False):
+    """清空进程内缓存；disk=True 时同时删除磁盘缓存"""
+    with _lock:
+        _memory.clear()
+    if disk and os.path.isdir(CACHE_DIR):
+        for name in os.listdir(CACHE_DIR):
+            try:
+                os.unlink(os.path.join(CACHE_DIR, name))
+            except OSError:
+                pass
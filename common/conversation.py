@@ -0,0 +1,243 @@
+"""
+多轮对话公共逻辑
+- 响应校验、AI 回复提取、对话历史维护
+- run_single_conversation: 基于线程的单个对话执行（并发测试默认使用）
+"""
+
+import time
+import random
+
+from contextlib import contextmanager
+
+from api.chat import chat
+from common import pacing
+from common import account_pool
+from common import tracing
+
+
+def generate_username():
+    """生成 tb_时间戳 格式的用户名"""
+    return f"tb_{int(time.time() * 1000)}_{random.randint(1000, 9999)}"
+
+
+def extract_reply(result):
+    """从响应中提取 AI 回复内容"""
+    replies = [
+        action['payload']['content']
+        for action in result['data']['ai_actions']
+        if action.get('actionType') == 'sendMessage'
+    ]
+    return '\n\n'.join(replies)
+
+
+def check_result(result):
+    """
+    校验聊天接口返回结果
+
+    返回:
+        str: 错误信息；校验通过返回 None
+    """
+    if result.get('code') != 200:
+        return f"接口返回异常: {result.get('message')}"
+    if result.get('message') != 'success':
+        return f"接口返回 message 异常: {result.get('message')}"
+    if len(result.get('data', {}).get('ai_actions', [])) == 0:
+        return "AI 没有返回任何回复"
+    return None
+
+
+def user_message(content):
+    """构造用户消息"""
+    return {
+        "role": "user",
+        "content": content,
+        "created_at": int(time.time())
+    }
+
+
+def append_replies(messages_history, result):
+    """将 AI 的每条回复都添加到历史中"""
+    now = int(time.time())
+    for action in result['data']['ai_actions']:
+        if action.get('actionType') == 'sendMessage':
+            messages_history.append({
+                "role": "assistant",
+                "content": action.get('payload', {}).get('content', ''),
+                "created_at": now
+            })
+
+
+def payload_sizes(response):
+    """返回 (请求体字节数, 响应体字节数)"""
+    request_bytes = getattr(response, "request_bytes", None)
+    if request_bytes is None:
+        body = response.request.body if getattr(response, "request", None) is not None else None
+        request_bytes = len(body) if body else 0
+    return request_bytes, len(response.content or b"")
+
+
+def brief_reply(full_reply):
+    """截断回复内容，用于结果展示"""
+    return full_reply[:100] + "..." if len(full_reply) > 100 else full_reply
+
+
+def failure(conversation_id, error, start_time):
+    """构造失败的对话结果"""
+    return {
+        "conversation_id": conversation_id,
+        "success": False,
+        "error": error,
+        "duration": time.time() - start_time
+    }
+
+
+def success(conversation_id, results, messages_history, start_time):
+    """构造成功的对话结果"""
+    return {
+        "conversation_id": conversation_id,
+        "success": True,
+        "results": results,
+        "duration": time.time() - start_time,
+        "total_messages": len(messages_history)
+    }
+
+
+def parse_response(response):
+    """
+    解析聊天响应并提取 AI 回复，记录为 extract_reply span
+
+    返回:
+        (响应 JSON, 错误信息或 None, AI 回复内容)
+    """
+    with tracing.span("extract_reply") as span:
+        result = response.json()
+        error = check_result(result)
+        full_reply = "" if error else extract_reply(result)
+        span.set_attribute("reply_chars", len(full_reply))
+        if error:
+            span.record_error(error)
+    return result, error, full_reply
+
+
+class _ConversationSpan:
+    """对话的根 span，构造失败结果时同时把错误记录到 span 上"""
+
+    def __init__(self, span):
+        self.span = span
+
+    def failure(self, conversation_id, error, start_time):
+        self.span.record_error(error)
+        return failure(conversation_id, error, start_time)
+
+
+@contextmanager
+def conversation_span(conversation_id, username, shop_id):
+    """一个对话对应一条 trace"""
+    with tracing.span("conversation", attributes={
+        "conversation_id": str(conversation_id), "username": username, "shop_id": str(shop_id),
+    }) as span:
+        yield _ConversationSpan(span)
+
+
+def pacing_context(username, token, shop_id, turn, reply):
+    """构造轮次间就绪检查使用的上下文"""
+    return {"username": username, "token": token, "shop_id": shop_id, "turn": turn, "reply": reply}
+
+
+def chain(*callbacks):
+    """将多个回调合并为一个，依次调用，忽略 None"""
+    callbacks = [cb for cb in callbacks if cb is not None]
+
+    def call_all(record):
+        for cb in callbacks:
+            cb(record)
+    return call_all
+
+
+def run_single_conversation(conversation_id, token, product, questions, wait_between_questions=0,
+                            shop_id="585", on_turn=None, stop=None):
+    """
+    运行单个对话
+
+    参数:
+        conversation_id: 对话ID
+        token: 登录 token，或 common.account_pool.AccountPool（每个对话从池中分配一个账号）
+        product: 商品信息
+        questions: 问题列表
+        wait_between_questions: 每轮对话之间的等待，秒数或 common.pacing.Pacer
+        shop_id: 店铺ID，默认 585
+        on_turn: 每轮请求结束时的回调（可选），参数为该轮的记录:
+            {"conversation_id", "turn", "intended", "sent", "received", "error",
+             "request_bytes", "response_bytes", "timing"}
+            timing 为该轮请求的分阶段耗时（见 common.http_timing）；使用账号池时还有 "account"
+            时间均为 time.perf_counter() 时间点
+        stop: threading.Event（可选），置位后不再开始新的一轮，对话以 "已停止" 结束
+
+    返回:
+        dict: 对话结果
+    """
+    username = generate_username()
+    messages_history = []
+    results = []
+    pacer = pacing.as_pacer(wait_between_questions)
+
+    start_time = time.time()
+
+    with account_pool.lease(token) as lease, conversation_span(conversation_id, username, shop_id) as span:
+        span.span.set_attribute("account", lease.account)
+        token = lease.token
+        try:
+            for i, question in enumerate(questions, 1):
+                if stop is not None and stop.is_set():
+                    return failure(conversation_id, "已停止", start_time)
+                messages_history.append(user_message(question))
+
+                with tracing.span("turn", attributes={"turn": i}) as turn_span:
+                    sent = time.perf_counter()
+                    record = {"conversation_id": conversation_id, "turn": i, "intended": sent, "sent": sent,
+                              "request_bytes": 0, "response_bytes": 0}
+                    try:
+                        response = chat(
+                            question,
+                            token,
+                            username,
+                            inquiry_product=product,
+                            full_messages=messages_history,
+                            shop_id=shop_id
+                        )
+                        record["request_bytes"], record["response_bytes"] = payload_sizes(response)
+                        record["timing"] = getattr(response, "timing", None)
+                        result, error, full_reply = parse_response(response)
+                    except Exception as e:
+                        record["error"] = str(e)
+                        raise
+                    else:
+                        record["error"] = error
+                        if error:
+                            turn_span.record_error(error)
+                    finally:
+                        record["received"] = time.perf_counter()
+                        lease.observe(record)
+                        if on_turn is not None:
+                            on_turn(record)
+
+                if error:
+                    return span.failure(conversation_id, error, start_time)
+
+                if len(full_reply) == 0:
+                    return span.failure(conversation_id, "AI 回复内容为空", start_time)
+
+                append_replies(messages_history, result)
+                results.append({
+                    "question": question,
+                    "reply": brief_reply(full_reply)
+                })
+
+                # 等待 AI 回复落库
+                if i < len(questions):
+                    pacer.wait(pacing_context(username, token, shop_id, i, full_reply))
+
+            return success(conversation_id, results, messages_history, start_time)
+
+        except Exception as e:
+            return span.failure(conversation_id, str(e), start_time)
@@ -0,0 +1,226 @@
+"""
+对话深度 - 延迟分析
+- 每轮对话都会通过 full_messages 重发完整历史，请求体随轮次增长
+- DepthRecorder 记录每轮的 轮次、请求体大小、响应体大小、延迟
+- analyze() 使用 NumPy 向量化计算：按轮次的延迟百分位表、延迟对轮次 / 请求体大小的拟合，
+  并在增长呈超线性时给出标记
+- 需要安装 numpy: pip install numpy
+"""
+
+import os
+import json
+import time
+import threading
+from array import array
+
+REPORTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reports")
+HISTORY_FILE = os.path.join(REPORTS_DIR, "depth-history.jsonl")
+
+# 对数-对数拟合的指数超过该值时判定为超线性增长
+SUPER_LINEAR_EXPONENT = 1.2
+# 至少有这么多个不同轮次才做拟合
+MIN_DEPTHS_FOR_FIT = 3
+
+
+class DepthRecorder:
+    """线程安全的每轮记录器，可直接作为对话执行器的 on_turn 回调"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._turns = array("I")
+        self._request_bytes = array("Q")
+        self._response_bytes = array("Q")
+        self._latency = array("d")
+
+    def __len__(self):
+        return len(self._turns)
+
+    def record(self, turn, request_bytes, response_bytes, latency):
+        """
+        记录一轮对话
+
+        参数:
+            turn: 轮次（从 1 开始）
+            request_bytes: 请求体字节数
+            response_bytes: 响应体字节数
+            latency: 延迟（秒）
+        """
+        with self._lock:
+            self._turns.append(turn)
+            self._request_bytes.append(request_bytes)
+            self._response_bytes.append(response_bytes)
+            self._latency.append(latency)
+
+    def __call__(self, record):
+        """on_turn 回调，只记录成功的轮次"""
+        if record.get("error"):
+            return
+        self.record(record["turn"], record["request_bytes"], record["response_bytes"],
+                    record["received"] - record["sent"])
+
+    def arrays(self):
+        """以 NumPy 数组返回 (turns, request_bytes, response_bytes, latency)"""
+        import numpy as np
+
+        with self._lock:
+            return (
+                np.array(self._turns, dtype=np.int64),
+                np.array(self._request_bytes, dtype=np.float64),
+                np.array(self._response_bytes, dtype=np.float64),
+                np.array(self._latency, dtype=np.float64),
+            )
+
+
+def _power_fit(x, y):
+    """对数-对数线性拟合 y = a * x^k，返回指数 k 和 R²"""
+    import numpy as np
+
+    mask = (x > 0) & (y > 0)
+    if np.unique(x[mask]).size < 2:
+        return None
+    lx, ly = np.log(x[mask]), np.log(y[mask])
+    k, b = np.polyfit(lx, ly, 1)
+    residual = ly - (k * lx + b)
+    total = ly - ly.mean()
+    r2 = 1 - float(residual @ residual) / float(total @ total) if total.any() else 1.0
+    return {"exponent": round(float(k), 4), "r2": round(r2, 4)}
+
+
+def _linear_fit(x, y):
+    """线性拟合 y = a + b * x，返回斜率和截距"""
+    import numpy as np
+
+    if np.unique(x).size < 2:
+        return None
+    slope, intercept = np.polyfit(x, y, 1)
+    return {"slope": float(slope), "intercept": float(intercept)}
+
+
+def analyze(recorder):
+    """
+    分析延迟随对话深度的变化
+
+    参数:
+        recorder: DepthRecorder
+
+    返回:
+        dict: {
+            "depths": [{"turn", "count", "p50_ms", "p95_ms", "p99_ms", "request_kb", "response_kb"}, ...],
+            "fit": {"latency_vs_turn": ..., "latency_vs_request_bytes": ..., "request_bytes_vs_turn": ...},
+            "super_linear": bool,
+        }
+    """
+    import numpy as np
+
+    turns, request_bytes, response_bytes, latency = recorder.arrays()
+    if turns.size == 0:
+        return {"depths": [], "fit": {}, "super_linear": False}
+
+    # 按 (轮次, 延迟) 排序后，每个轮次的延迟是连续且有序的一段
+    order = np.lexsort((latency, turns))
+    turns, request_bytes, response_bytes, latency = (
+        turns[order], request_bytes[order], response_bytes[order], latency[order]
+    )
+    depths, starts, counts = np.unique(turns, return_index=True, return_counts=True)
+
+    def quantile(q):
+        index = starts + np.maximum(np.ceil(q * counts).astype(np.int64) - 1, 0)
+        return latency[index]
+
+    p50, p95, p99 = quantile(0.50), quantile(0.95), quantile(0.99)
+    mean_request = np.add.reduceat(request_bytes, starts) / counts
+    mean_response = np.add.reduceat(response_bytes, starts) / counts
+
+    table = [
+        {
+            "turn": int(depths[i]),
+            "count": int(counts[i]),
+            "p50_ms": round(float(p50[i]) * 1000, 1),
+            "p95_ms": round(float(p95[i]) * 1000, 1),
+            "p99_ms": round(float(p99[i]) * 1000, 1),
+            "request_kb": round(float(mean_request[i]) / 1024, 2),
+            "response_kb": round(float(mean_response[i]) / 1024, 2),
+        }
+        for i in range(depths.size)
+    ]
+
+    fit = {}
+    super_linear = False
+    if depths.size >= MIN_DEPTHS_FOR_FIT:
+        depth_values = depths.astype(np.float64)
+        fit["latency_vs_turn"] = _power_fit(depth_values, p50)
+        fit["latency_vs_request_bytes"] = _power_fit(mean_request, p50)
+        fit["request_bytes_vs_turn"] = _power_fit(depth_values, mean_request)
+        linear = _linear_fit(request_bytes, latency)
+        if linear is not None:
+            fit["ms_per_request_kb"] = round(linear["slope"] * 1024 * 1000, 4)
+        super_linear = any(
+            f is not None and f["exponent"] > SUPER_LINEAR_EXPONENT
+            for f in (fit["latency_vs_turn"], fit["latency_vs_request_bytes"])
+        )
+
+    return {"depths": table, "fit": fit, "super_linear": super_linear}
+
+
+def format_table(analysis):
+    """将 analyze() 的结果渲染为文本表格"""
+    # 中文字符占两列宽度，表头宽度相应减小以便对齐
+    lines = [f"{'轮次':<6}{'次数':>6}{'p50(ms)':>11}{'p95(ms)':>11}{'p99(ms)':>11}{'请求KB':>8}{'响应KB':>8}"]
+    for row in analysis["depths"]:
+        lines.append(
+            f"{row['turn']:<8}{row['count']:>8}{row['p50_ms']:>11.1f}{row['p95_ms']:>11.1f}"
+            f"{row['p99_ms']:>11.1f}{row['request_kb']:>10.2f}{row['response_kb']:>10.2f}"
+        )
+    fit = analysis["fit"]
+    if fit.get("latency_vs_turn"):
+        lines.append("")
+        lines.append(f"延迟 ~ 轮次^{fit['latency_vs_turn']['exponent']} (R²={fit['latency_vs_turn']['r2']})")
+    if fit.get("latency_vs_request_bytes"):
+        lines.append(f"延迟 ~ 请求体^{fit['latency_vs_request_bytes']['exponent']} "
+                     f"(R²={fit['latency_vs_request_bytes']['r2']})")
+    if "ms_per_request_kb" in fit:
+        lines.append(f"请求体每增加 1KB，延迟增加 {fit['ms_per_request_kb']:.2f} ms")
+    if analysis["super_linear"]:
+        lines.append(f"[警告] 延迟随对话深度呈超线性增长（指数 > {SUPER_LINEAR_EXPONENT}）")
+    return "\n".join(lines)
+
+
+def append_history(analysis, name, path=HISTORY_FILE):
+    """将本次的按轮次百分位表追加到历史文件，便于跨运行对比"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    line = {
+        "time": int(time.time()),
+        "name": name,
+        "depths": analysis["depths"],
+        "fit": analysis["fit"],
+        "super_linear": analysis["super_linear"],
+    }
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+
+def attach_to_allure(analysis, name="对话深度-延迟分析"):
+    """将分析结果以 JSON 和文本表格两种形式附加到 Allure 报告"""
+    import allure
+
+    allure.attach(
+        json.dumps(analysis, ensure_ascii=False, indent=2),
+        name=name,
+        attachment_type=allure.attachment_type.JSON
+    )
+    allure.attach(format_table(analysis), name=f"{name}（表格）", attachment_type=allure.attachment_type.TEXT)
+
+
+def report(recorder, name):
+    """分析并输出结果：打印表格、附加到 Allure、追加到历史文件；未安装 numpy 时跳过"""
+    if len(recorder) == 0:
+        return None
+    try:
+        analysis = analyze(recorder)
+    except ImportError:
+        print("未安装 numpy，跳过对话深度分析")
+        return None
+    print(format_table(analysis))
+    attach_to_allure(analysis)
+    append_history(analysis, name)
+    return analysis
@@ -0,0 +1,465 @@
+"""
+分布式压测（协调者 / agent）
+- 协调者监听 TCP 端口，等待指定数量的 agent 注册，按权重把对话配额切分给各 agent
+- 通过多次 ping 估算各 agent 与协调者的时钟偏差，换算成各自的本地时间，保证同时开始
+- agent 在本机运行分到的对话（单进程或 common.process_driver 多进程），
+  将每轮记录、每个对话结果实时回传，结束时回传可合并的 metrics 直方图
+- 协调者调用 on_turn / on_result 回调并合并直方图，得到一份汇总报告
+- 超过场景预计耗时 + RUN_GRACE 仍未结束的 agent（卡住但连接未断开）标记为失败，协调者不再等待
+- 协议: 每行一个 JSON 对象（换行分隔），明文传输，只应在内网使用
+
+用法（同一台机器上也可以启动多个 agent 测试）:
+    python -m common.distributed coordinator --agents 3 --port 8950
+    python -m common.distributed agent --coordinator 127.0.0.1:8950    # 每个 agent 各执行一次
+"""
+
+import os
+import json
+import time
+import queue
+import socket
+import argparse
+import threading
+
+from common import metrics
+from common.metrics import MetricsRegistry
+
+DEFAULT_PORT = 8950
+# 等待 agent 注册的超时（秒）
+REGISTER_TIMEOUT = 60
+# 下发任务到统一开始之间预留的时间（秒），用于 agent 准备（登录、建连接）
+LEAD_TIME = 3.0
+# 估算时钟偏差时的 ping 次数，取往返时间最短的一次
+PING_COUNT = 5
+# agent 连接协调者失败时的重试时长（秒）
+CONNECT_RETRY = 30
+# 等待 agent 结束时，在场景预计耗时之外额外等待的时间（秒）
+RUN_GRACE = 60
+
+REPORTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reports")
+
+
+class _Channel:
+    """换行分隔 JSON 的收发封装，发送线程安全"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._reader = sock.makefile("r", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        data = (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self.sock.sendall(data)
+
+    def recv(self):
+        """读取一条消息，连接关闭时返回 None"""
+        line = self._reader.readline()
+        return json.loads(line) if line else None
+
+    def close(self):
+        try:
+            self._reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def split_quota(count, weights):
+    """按权重把 count 个对话切分为连续区间（最大余数法），返回 [(起始ID, 数量), ...]"""
+    total = sum(weights)
+    exact = [count * w / total for w in weights]
+    sizes = [int(x) for x in exact]
+    remainders = sorted(range(len(weights)), key=lambda i: exact[i] - sizes[i], reverse=True)
+    for i in remainders[:count - sum(sizes)]:
+        sizes[i] += 1
+    shards = []
+    start = 0
+    for n in sizes:
+        shards.append((start, n))
+        start += n
+    return shards
+
+
+def load_scenario(path=None, count=None):
+    """
+    从 concurrent_chat.yaml 读取压测场景
+
+    参数:
+        path: 配置文件路径，默认 data/concurrent_chat.yaml
+        count: 覆盖配置中的 concurrent_count
+
+    返回:
+        dict: {"count", "questions", "shop_id", "product_index", "engine", "processes",
+               "wait_between_questions", "pacing"}
+    """
+    from common import config_cache
+
+    path = path or os.path.join(os.path.dirname(REPORTS_DIR), "data", "concurrent_chat.yaml")
+    config = config_cache.load(path)
+    if config is None:
+        raise FileNotFoundError(path)
+    concurrent = config['concurrent_config']
+    return {
+        "count": count or concurrent['concurrent_count'],
+        "questions": config['conversations'][0]['questions'],
+        "shop_id": config['product_config']['shop_id'],
+        "product_index": config['product_config']['product_index'],
+        "engine": concurrent.get('engine', 'thread'),
+        "processes": concurrent.get('processes', 1),
+        "wait_between_questions": concurrent.get('wait_between_questions', 0),
+        "pacing": config.get('pacing'),
+    }
+
+
+def expected_duration(scenario):
+    """场景的最长预计耗时（秒）: 每轮按聊天接口的 连接 + 读取 超时计，加上轮次之间的等待"""
+    from common import resilience
+
+    connect_timeout, read_timeout = resilience.timeout("chat")
+    pacing = scenario.get("pacing") or {}
+    wait = max(float(scenario.get("wait_between_questions") or 0),
+               float(pacing.get("seconds") or 0), float(pacing.get("timeout") or 0))
+    turns = len(scenario["questions"])
+    return turns * (connect_timeout + read_timeout) + max(turns - 1, 0) * wait
+
+
+class Coordinator:
+    """
+    分布式压测协调者
+
+    参数:
+        host / port: 监听地址，port=0 表示随机端口
+        expected_agents: 需要等待注册的 agent 数量
+    """
+
+    def __init__(self, host="0.0.0.0", port=DEFAULT_PORT, expected_agents=1):
+        self.expected_agents = expected_agents
+        self.agents = {}   # agent_id -> {"channel", "info", "offset", "rtt"}
+        self._server = socket.create_server((host, port))
+        self._server.listen(max(expected_agents, 8))
+
+    @property
+    def port(self):
+        return self._server.getsockname()[1]
+
+    def wait_for_agents(self, timeout=REGISTER_TIMEOUT):
+        """等待 expected_agents 个 agent 注册，超时抛出 TimeoutError"""
+        deadline = time.monotonic() + timeout
+        while len(self.agents) < self.expected_agents:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"等待 agent 注册超时，已注册 {len(self.agents)}/{self.expected_agents}")
+            self._server.settimeout(remaining)
+            try:
+                sock, address = self._server.accept()
+            except socket.timeout:
+                continue
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            channel = _Channel(sock)
+            message = channel.recv()
+            if not message or message.get("type") != "register":
+                channel.close()
+                continue
+            agent_id = message.get("agent_id") or f"{address[0]}:{address[1]}"
+            self.agents[agent_id] = {"channel": channel, "info": message}
+            self._sync_clock(agent_id)
+            agent = self.agents[agent_id]
+            print(f"[协调者] agent {agent_id} 已注册 ({len(self.agents)}/{self.expected_agents})，"
+                  f"时钟偏差 {agent['offset'] * 1000:.1f}ms，往返 {agent['rtt'] * 1000:.1f}ms")
+
+    def _sync_clock(self, agent_id):
+        """多次 ping，取往返最短的一次估算 agent 时钟 - 协调者时钟 的偏差"""
+        agent = self.agents[agent_id]
+        best = None
+        for _ in range(PING_COUNT):
+            t0 = time.time()
+            agent["channel"].send({"type": "ping"})
+            reply = agent["channel"].recv()
+            t1 = time.time()
+            rtt = t1 - t0
+            if best is None or rtt < best[0]:
+                best = (rtt, reply["time"] - (t0 + t1) / 2)
+        agent["rtt"], agent["offset"] = best
+
+    def run(self, scenario, on_turn=None, on_result=None, lead_time=LEAD_TIME, timeout=None):
+        """
+        下发场景并收集结果
+
+        参数:
+            scenario: load_scenario() 的结果，可额外包含 "product"；没有时由协调者登录并获取商品
+            on_turn / on_result: 每轮记录、每个对话结果的回调，格式同 run_single_conversation
+            lead_time: 下发任务到统一开始之间的准备时间（秒）
+            timeout: 开始后等待全部 agent 结束的最长时间（秒），默认 expected_duration() + RUN_GRACE；
+                超时仍未结束的 agent 标记为失败
+
+        返回:
+            dict: {"conversations", "success", "failed", "duration", "agents", "metrics"}
+        """
+        from common import http_client
+
+        scenario = dict(scenario)
+        if scenario.get("product") is None:
+            from api.product import get_product_by_index
+            from common.tool import get_token
+
+            scenario["product"] = get_product_by_index(
+                get_token(), shop_id=scenario["shop_id"], index=scenario.get("product_index", 0)
+            )
+            if scenario["product"] is None:
+                raise RuntimeError("获取商品失败")
+        scenario.setdefault("base_url", http_client.base_url())
+
+        agent_ids = list(self.agents)
+        shards = split_quota(scenario["count"], [self.agents[a]["info"].get("weight", 1) for a in agent_ids])
+        start_at = time.time() + lead_time
+
+        events = queue.Queue()
+        for agent_id, (start, count) in zip(agent_ids, shards):
+            agent = self.agents[agent_id]
+            agent.update({"start": start, "count": count, "success": 0, "failed": 0, "error": None})
+            agent["channel"].send({
+                "type": "run",
+                "scenario": scenario,
+                "start": start,
+                "count": count,
+                "start_at": start_at + agent["offset"],
+            })
+            threading.Thread(target=self._read, args=(agent_id, events), daemon=True).start()
+
+        if timeout is None:
+            timeout = expected_duration(scenario) + RUN_GRACE
+        deadline = time.monotonic() + lead_time + timeout
+
+        registry = MetricsRegistry()
+        report = {"conversations": 0, "success": 0, "failed": 0}
+        pending = set(agent_ids)
+        while pending:
+            try:
+                agent_id, message = events.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                for agent_id in pending:
+                    self.agents[agent_id]["error"] = f"开始后 {timeout:.0f}s 仍未结束"
+                print(f"[协调者] 等待超时，未结束的 agent: {', '.join(sorted(pending))}")
+                break
+            agent = self.agents[agent_id]
+            kind = message["type"]
+            if kind == "turn":
+                if on_turn is not None:
+                    on_turn(message["record"])
+            elif kind == "result":
+                result = message["result"]
+                key = "success" if result['success'] else "failed"
+                report["conversations"] += 1
+                report[key] += 1
+                agent[key] += 1
+                if on_result is not None:
+                    on_result(result)
+            elif kind == "done":
+                pending.discard(agent_id)
+                registry.merge(message["metrics"])
+                agent["error"] = message.get("error")
+                agent["duration"] = message.get("duration")
+            elif kind == "closed":
+                pending.discard(agent_id)
+                agent["error"] = agent["error"] or "连接中断"
+
+        report["duration"] = time.time() - start_at
+        report["agents"] = {
+            agent_id: {k: agent.get(k) for k in ("start", "count", "success", "failed", "duration", "error",
+                                                  "offset", "rtt")}
+            for agent_id, agent in self.agents.items()
+        }
+        report["metrics"] = registry.summary()
+        metrics.registry.merge(registry)
+        return report
+
+    def _read(self, agent_id, events):
+        channel = self.agents[agent_id]["channel"]
+        try:
+            while True:
+                message = channel.recv()
+                if message is None:
+                    break
+                events.put((agent_id, message))
+                if message["type"] == "done":
+                    return
+        except (OSError, ValueError):
+            pass
+        events.put((agent_id, {"type": "closed"}))
+
+    def close(self):
+        """通知所有 agent 退出并关闭连接"""
+        for agent in self.agents.values():
+            try:
+                agent["channel"].send({"type": "stop"})
+            except OSError:
+                pass
+            agent["channel"].close()
+        self._server.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _connect(host, port, retry_for):
+    deadline = time.monotonic() + retry_for
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+        except OSError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.5)
+
+
+def _execute(channel, task, processes, account, password):
+    """执行协调者下发的任务，结果实时回传"""
+    from common import http_client, pacing
+    from common.tool import get_token, DEFAULT_ACCOUNT, DEFAULT_PASSWORD
+
+    scenario = task["scenario"]
+    http_client.set_base_url(scenario["base_url"])
+    metrics.reset()
+
+    credentials = (account or DEFAULT_ACCOUNT, password or DEFAULT_PASSWORD)
+    token = get_token(*credentials)
+    pacer = pacing.from_config(scenario.get("pacing"), seconds=scenario.get("wait_between_questions", 0))
+    args = (scenario["product"], scenario["questions"], pacer, scenario["shop_id"])
+
+    def on_turn(record):
+        channel.send({"type": "turn", "record": record})
+
+    def on_result(result):
+        channel.send({"type": "result", "result": result})
+
+    delay = task["start_at"] - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+    start = time.time()
+    processes = processes if processes is not None else scenario.get("processes", 1)
+    if processes == 1:
+        from common.process_driver import run_shard
+        run_shard(task["start"], task["count"], token, *args, engine=scenario["engine"],
+                  on_result=on_result, on_turn=on_turn)
+    else:
+        from common.process_driver import run_processes
+
+        def shifted(callback, key="conversation_id"):
+            def call(item):
+                item[key] += task["start"]
+                callback(item)
+            return call
+
+        run_processes(task["count"], *args, processes=processes or None, engine=scenario["engine"],
+                      account=credentials[0], password=credentials[1],
+                      on_result=shifted(on_result), on_turn=shifted(on_turn), keep_results=False)
+    return time.time() - start
+
+
+def run_agent(host, port=DEFAULT_PORT, agent_id=None, weight=1, processes=None, account=None, password=None,
+              retry_for=CONNECT_RETRY):
+    """
+    作为 agent 连接协调者，执行下发的任务直到协调者通知退出
+
+    参数:
+        host / port: 协调者地址
+        agent_id: agent 名称，默认 主机名-进程号
+        weight: 分配配额时的权重
+        processes: 本机 worker 进程数，默认使用场景中的 processes；0 表示全部 CPU 核
+        account / password: 登录账号，默认使用 common.tool 中的默认账号
+        retry_for: 连接失败时的重试时长（秒）
+    """
+    channel = _Channel(_connect(host, port, retry_for))
+    agent_id = agent_id or f"{socket.gethostname()}-{os.getpid()}"
+    channel.send({"type": "register", "agent_id": agent_id, "weight": weight, "cpus": os.cpu_count()})
+    try:
+        while True:
+            message = channel.recv()
+            if message is None or message["type"] == "stop":
+                break
+            if message["type"] == "ping":
+                channel.send({"type": "pong", "time": time.time()})
+            elif message["type"] == "run":
+                print(f"[agent {agent_id}] 分配到 {message['count']} 个对话")
+                error = None
+                duration = None
+                try:
+                    duration = _execute(channel, message, processes, account, password)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    print(f"[agent {agent_id}] 执行失败: {error}")
+                channel.send({"type": "done", "error": error, "duration": duration,
+                              "metrics": metrics.registry.to_dict()})
+    finally:
+        channel.close()
+
+
+def format_report(report):
+    """将 Coordinator.run() 的结果渲染为文本"""
+    lines = [
+        f"对话数: {report['conversations']}，成功: {report['success']}，失败: {report['failed']}，"
+        f"耗时: {report['duration']:.2f}s",
+        "",
+    ]
+    for agent_id, agent in report["agents"].items():
+        line = f"[{agent_id}] 分配 {agent['count']}，成功 {agent['success']}，失败 {agent['failed']}"
+        if agent.get("error"):
+            line += f"，错误: {agent['error']}"
+        lines.append(line)
+    lines.append("")
+    lines.append(metrics.format_table(report["metrics"]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分布式压测")
+    sub = parser.add_subparsers(dest="role", required=True)
+
+    coordinator = sub.add_parser("coordinator", help="启动协调者")
+    coordinator.add_argument("--host", default="0.0.0.0")
+    coordinator.add_argument("--port", type=int, default=DEFAULT_PORT)
+    coordinator.add_argument("--agents", type=int, required=True, help="等待注册的 agent 数量")
+    coordinator.add_argument("--config", help="场景配置文件，默认 data/concurrent_chat.yaml")
+    coordinator.add_argument("--count", type=int, help="总对话数，默认取配置中的 concurrent_count")
+    coordinator.add_argument("--timeout", type=float, default=REGISTER_TIMEOUT, help="等待 agent 注册的超时（秒）")
+
+    agent = sub.add_parser("agent", help="启动 agent")
+    agent.add_argument("--coordinator", required=True, help="协调者地址 host:port")
+    agent.add_argument("--id", help="agent 名称")
+    agent.add_argument("--weight", type=float, default=1, help="分配配额时的权重")
+    agent.add_argument("--processes", type=int, help="本机 worker 进程数")
+
+    args = parser.parse_args(argv)
+    if args.role == "agent":
+        host, _, port = args.coordinator.rpartition(":")
+        run_agent(host, int(port), agent_id=args.id, weight=args.weight, processes=args.processes)
+        return
+
+    from common.result_sink import ResultSink
+
+    scenario = load_scenario(args.config, args.count)
+    sink = ResultSink()
+    with Coordinator(args.host, args.port, args.agents) as server:
+        print(f"[协调者] 监听 {args.host}:{server.port}，等待 {args.agents} 个 agent")
+        server.wait_for_agents(args.timeout)
+        report = server.run(scenario, on_turn=sink.on_turn, on_result=sink.on_result)
+    sink.close()
+
+    print(format_report(report))
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    path = os.path.join(REPORTS_DIR, "distributed-report.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[协调者] 报告已保存到 {path}")
+
+
+if __name__ == "__main__":
+    main()
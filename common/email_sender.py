@@ -1,21 +1,41 @@
 """
 测试报告邮件发送模块
 - 读取 Allure 报告摘要
-- 将报告目录打包为 zip
+- 将报告目录打包为 zip（按内容哈希缓存压缩结果，并行压缩，已压缩的文件直接存储）
 - 构建 HTML 邮件（正文展示摘要 + 附件为 zip）
-- 通过 163 邮箱 SMTP 发送
+- 通过 163 邮箱 SMTP 发送，附件按块 base64 编码后直接写入 SMTP 连接，内存占用不随报告大小增长
 """
 
 import os
+import re
 import json
-import zipfile
+import time
+import uuid
+import zlib
+import base64
+import shutil
+import struct
 import smtplib
+import hashlib
 import tempfile
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from email.header import Header
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
-from email import encoders
+
+ZIP_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "report-zip")
+# 超过该天数未被使用的压缩缓存会被删除
+CACHE_MAX_AGE_DAYS = 7
+# 文件读写的块大小；base64 编码时每 57 字节输入对应一行 76 个字符
+CHUNK_SIZE = 57 * 1024
+# 已压缩的格式，压缩也不会变小，直接存储
+STORED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".woff", ".woff2", ".zip", ".gz", ".mp4", ".webm"}
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
 
 
 def _read_summary(report_dir):
@@ -185,18 +205,152 @@ def _build_html_body(summary):
     return html
 
 
-def _zip_report(report_dir):
-    """将 Allure 报告目录打包为 zip 文件，返回 zip 文件路径"""
-    zip_path = os.path.join(tempfile.gettempdir(), "allure-report.zip")
+def _dos_time(mtime):
+    """修改时间 -> zip 中的 (DOS 时间, DOS 日期)"""
+    t = time.localtime(max(mtime, 315532800))  # DOS 时间最早为 1980 年
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def _prepare_member(file_path, arcname, cache_dir, level):
+    """
+    计算单个文件的 CRC 和内容哈希，按需压缩（命中缓存时直接复用已压缩的数据）
+
+    返回:
+        dict: {"arcname", "method", "crc", "size", "compress_size", "mtime", "data_path", "cached"}
+    """
+    digest = hashlib.sha256()
+    crc = 0
+    size = 0
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+
+    member = {"arcname": arcname, "method": ZIP_STORED, "crc": crc, "size": size, "compress_size": size,
+              "mtime": os.path.getmtime(file_path), "data_path": file_path, "cached": False}
+    if size == 0 or os.path.splitext(file_path)[1].lower() in STORED_EXTENSIONS:
+        return member
+
+    key = f"{digest.hexdigest()}-{level}"
+    cache_path = os.path.join(cache_dir, key[:2], f"{key}.deflate")
+    if os.path.exists(cache_path):
+        os.utime(cache_path)
+        member["cached"] = True
+    else:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        # 原始 deflate 流（wbits 为负数时不带 zlib 头尾），即 zip 成员中的压缩数据
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        with open(file_path, "rb") as src, open(tmp_path, "wb") as dst:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                dst.write(compressor.compress(chunk))
+            dst.write(compressor.flush())
+        os.replace(tmp_path, cache_path)
+
+    compress_size = os.path.getsize(cache_path)
+    # 压缩后没有变小（已压缩过的内容）时直接存储
+    if compress_size < size:
+        member.update(method=ZIP_DEFLATED, compress_size=compress_size, data_path=cache_path)
+    return member
+
+
+class _ZipWriter:
+    """按顺序写入已准备好的成员（压缩数据直接拷贝，不再经过 zipfile 重新压缩）"""
+
+    _LOCAL = struct.Struct("<4sHHHHHLLLHH")
+    _CENTRAL = struct.Struct("<4sHHHHHHLLLHHHHHLL")
+    _END = struct.Struct("<4sHHHHLLH")
+
+    def __init__(self, f):
+        self._f = f
+        self._central = []
+
+    def add(self, member):
+        name = member["arcname"].replace(os.sep, "/").encode("utf-8")
+        # bit 11: 文件名为 UTF-8
+        flags = 0x800 if not name.isascii() else 0
+        dos_time, dos_date = _dos_time(member["mtime"])
+        offset = self._f.tell()
+        if max(offset, member["size"], member["compress_size"]) >= 0xFFFFFFFF:
+            raise ValueError("报告超过 4GB，无法作为邮件附件发送")
+
+        header = (20, flags, member["method"], dos_time, dos_date,
+                  member["crc"], member["compress_size"], member["size"], len(name))
+        self._f.write(self._LOCAL.pack(b"PK\x03\x04", *header, 0))
+        self._f.write(name)
+        with open(member["data_path"], "rb") as src:
+            shutil.copyfileobj(src, self._f, CHUNK_SIZE)
+        self._central.append(self._CENTRAL.pack(
+            b"PK\x01\x02", 20 | (3 << 8), *header, 0, 0, 0, 0, 0o100644 << 16, offset
+        ) + name)
+
+    def close(self):
+        offset = self._f.tell()
+        for entry in self._central:
+            self._f.write(entry)
+        size = self._f.tell() - offset
+        count = len(self._central)
+        self._f.write(self._END.pack(b"PK\x05\x06", 0, 0, count, count, size, offset, 0))
+
+
+def _prune_cache(cache_dir, max_age_days=CACHE_MAX_AGE_DAYS):
+    """删除超过 max_age_days 天未被使用的压缩缓存"""
+    deadline = time.time() - max_age_days * 86400
+    if not os.path.isdir(cache_dir):
+        return
+    for sub in os.scandir(cache_dir):
+        if not sub.is_dir():
+            continue
+        for entry in os.scandir(sub.path):
+            try:
+                if entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def _zip_report(report_dir, cache_dir=ZIP_CACHE_DIR, level=6, workers=None):
+    """
+    将 Allure 报告目录打包为 zip 文件，返回 zip 文件路径
+    - 按内容哈希缓存每个文件压缩后的数据（.cache/report-zip），未变化的文件（插件 JS、app.js 等）不重新压缩
+    - 图片、字体等已压缩的文件以及压缩后没有变小的文件直接存储
+    - 多个文件在线程池中并行哈希 / 压缩（zlib 压缩时释放 GIL）
+    - 全程按块读写，内存占用与报告大小无关
+
+    参数:
+        report_dir: 报告目录
+        cache_dir: 压缩缓存目录
+        level: deflate 压缩级别
+        workers: 并行线程数，默认 CPU 核数
+    """
+    zip_path = os.path.join(tempfile.gettempdir(), f"allure-report-{os.getpid()}.zip")
+
+    files = []
+    for root, dirs, names in os.walk(report_dir):
+        dirs.sort()
+        for name in sorted(names):
+            file_path = os.path.join(root, name)
+            files.append((file_path, os.path.join("allure-report", os.path.relpath(file_path, report_dir))))
 
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, dirs, files in os.walk(report_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.join("allure-report", os.path.relpath(file_path, report_dir))
-                zf.write(file_path, arcname)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        futures = [executor.submit(_prepare_member, path, arcname, cache_dir, level) for path, arcname in files]
+        with open(zip_path, "wb") as f:
+            writer = _ZipWriter(f)
+            # 按目录顺序写入，前面的文件写入时后面的文件仍在压缩
+            members = []
+            for future in futures:
+                member = future.result()
+                writer.add(member)
+                members.append(member)
+            writer.close()
+    _prune_cache(cache_dir)
 
-    print(f"[邮件] 报告已打包: {zip_path} ({os.path.getsize(zip_path) / 1024:.1f} KB)")
+    cached = sum(1 for m in members if m["cached"])
+    stored = sum(1 for m in members if m["method"] == ZIP_STORED)
+    print(f"[邮件] 报告已打包: {zip_path} ({os.path.getsize(zip_path) / 1024:.1f} KB), "
+          f"{len(members)} 个文件, 复用压缩缓存 {cached} 个, 直接存储 {stored} 个")
     return zip_path
 
 
@@ -214,6 +368,122 @@ def _build_subject(summary):
     return f"API自动化测试报告 - {date_str} 通过: {passed}, 失败: {failed}, 异常: {broken}, 总计: {total}"
 
 
+def _message_chunks(sender, recipients, summary, zip_path):
+    """
+    按块生成完整的邮件内容（CRLF 换行）
+    邮件头、HTML 正文由 email 库生成，附件位置先放一个占位符，发送时替换为按块编码的 base64 内容
+    """
+    msg = MIMEMultipart()
+    msg["From"] = sender
+    msg["To"] = ", ".join(recipients)
+    msg["Subject"] = Header(_build_subject(summary), "utf-8")
+    msg.attach(MIMEText(_build_html_body(summary), "html", "utf-8"))
+
+    placeholder = f"attachment-{uuid.uuid4().hex}"
+    attachment = MIMEBase("application", "zip")
+    attachment["Content-Transfer-Encoding"] = "base64"
+    attachment.add_header("Content-Disposition", "attachment", filename="allure-report.zip")
+    attachment.set_payload(placeholder)
+    msg.attach(attachment)
+
+    head, tail = msg.as_bytes(policy=msg.policy.clone(linesep="\r\n")).split(placeholder.encode("ascii"))
+    yield head
+    with open(zip_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            yield base64.encodebytes(chunk).replace(b"\n", b"\r\n")
+    yield tail
+
+
+def _send_streaming(server, sender, recipients, chunks):
+    """
+    与 SMTP.sendmail 相同的 MAIL / RCPT / DATA 流程，但邮件内容按块写入连接，不在内存中拼出整封邮件
+    """
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(sender)
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, resp, sender)
+    refused = {}
+    for recipient in recipients:
+        code, resp = server.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, resp)
+    if len(refused) == len(recipients):
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    server.putcmd("data")
+    code, resp = server.getreply()
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+    last = b"\r\n"
+    for chunk in chunks:
+        if not chunk:
+            continue
+        # 行首的 "." 需要转义为 ".."（base64 内容不会出现 "."）
+        if last.endswith(b"\n") and chunk.startswith(b"."):
+            chunk = b"." + chunk
+        chunk = re.sub(rb"(?m)(?<=\n)\.", b"..", chunk)
+        server.send(chunk)
+        last = chunk
+    server.send(b".\r\n" if last.endswith(b"\r\n") else b"\r\n.\r\n")
+    code, resp = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+    if refused:
+        print(f"[邮件] 以下收件人被拒绝: {', '.join(refused)}")
+    return refused
+
+
+def sender_credentials():
+    """发件人和授权码，从环境变量读取，未设置则使用默认值"""
+    return (os.environ.get("EMAIL_SENDER", "2085847175@qq.com"),
+            os.environ.get("EMAIL_AUTH_CODE", "exooyaokaiptcadg"))
+
+
+def connect(smtp_server, smtp_port, ssl=True, timeout=60):
+    """建立 SMTP 连接并登录，ssl=False 时使用明文 SMTP（本地 mock 服务）"""
+    sender, auth_code = sender_credentials()
+    server = smtplib.SMTP_SSL(smtp_server, smtp_port, timeout=timeout) if ssl else \
+        smtplib.SMTP(smtp_server, smtp_port, timeout=timeout)
+    try:
+        server.login(sender, auth_code)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def deliver_report(server, sender, recipients, report_dir, batch_size=None, on_sent=None):
+    """
+    在已登录的 SMTP 连接上发送一份报告（读取摘要、打包、流式发送）
+
+    参数:
+        batch_size: 单封邮件的最大收件人数，超过时分批发送（只打包一次）
+        on_sent: 每批发送成功后的回调，参数为该批中已送达（未被拒绝）的收件人
+
+    返回:
+        dict: 被拒绝的收件人，全部成功时为空；某一批全部被拒绝时抛出 SMTPRecipientsRefused，
+            其中包含之前各批被拒绝的收件人
+    """
+    summary = _read_summary(report_dir)
+    zip_path = _zip_report(report_dir)
+    batch_size = max(batch_size or len(recipients), 1)
+    refused = {}
+    try:
+        for i in range(0, len(recipients), batch_size):
+            batch = recipients[i:i + batch_size]
+            try:
+                batch_refused = _send_streaming(server, sender, batch,
+                                                _message_chunks(sender, batch, summary, zip_path))
+            except smtplib.SMTPRecipientsRefused as e:
+                raise smtplib.SMTPRecipientsRefused(dict(refused, **e.recipients)) from e
+            refused.update(batch_refused)
+            if on_sent is not None:
+                on_sent([r for r in batch if r not in batch_refused])
+    finally:
+        os.remove(zip_path)
+    return refused
+
+
 def send_test_report(
     report_dir,
     recipients,
@@ -221,7 +491,7 @@ def send_test_report(
     smtp_port=465,
 ):
     """
-    发送测试报告邮件
+    发送测试报告邮件（同步发送，发送完成前阻塞；测试结束后投递报告请使用 common.report_queue）
 
     参数:
         report_dir: Allure 报告目录路径 (reports/allure-report)
@@ -229,46 +499,16 @@ def send_test_report(
         smtp_server: SMTP 服务器地址，默认 smtp.163.com
         smtp_port: SMTP 端口，默认 465 (SSL)
     """
-    # 从环境变量读取发件人配置，未设置则使用默认值
-    sender = os.environ.get("EMAIL_SENDER", "2085847175@qq.com")
-    auth_code = os.environ.get("EMAIL_AUTH_CODE", "exooyaokaiptcadg")
+    sender = sender_credentials()[0]
 
     if not os.path.isdir(report_dir):
         print(f"[邮件] 错误: 报告目录不存在: {report_dir}")
         return False
 
     try:
-        # 1. 读取测试摘要
-        summary = _read_summary(report_dir)
-
-        # 2. 构建邮件
-        msg = MIMEMultipart()
-        msg["From"] = sender
-        msg["To"] = ", ".join(recipients)
-        msg["Subject"] = _build_subject(summary)
-
-        # 3. 添加 HTML 正文
-        html_body = _build_html_body(summary)
-        msg.attach(MIMEText(html_body, "html", "utf-8"))
-
-        # 4. 打包报告并添加为附件
-        zip_path = _zip_report(report_dir)
-        with open(zip_path, "rb") as f:
-            attachment = MIMEBase("application", "zip")
-            attachment.set_payload(f.read())
-            encoders.encode_base64(attachment)
-            attachment.add_header(
-                "Content-Disposition",
-                "attachment",
-                filename="allure-report.zip"
-            )
-            msg.attach(attachment)
-
-        # 5. 发送邮件 (SSL)
         print(f"[邮件] 正在发送测试报告到: {', '.join(recipients)} ...")
-        with smtplib.SMTP_SSL(smtp_server, smtp_port) as server:
-            server.login(sender, auth_code)
-            server.sendmail(sender, recipients, msg.as_string())
+        with connect(smtp_server, smtp_port) as server:
+            deliver_report(server, sender, recipients, report_dir)
 
         print("[邮件] 测试报告邮件发送成功!")
         return True
@@ -282,7 +522,3 @@ def send_test_report(
     except Exception as e:
         print(f"[邮件] 发送失败: {e}")
         return False
-    finally:
-        # 清理临时 zip 文件
-        if 'zip_path' in locals() and os.path.exists(zip_path):
-            os.remove(zip_path)
@@ -0,0 +1,83 @@
+"""
+跨进程文件锁
+- POSIX 使用 fcntl.flock，Windows 使用 msvcrt.locking
+- 用法: with FileLock(path): ...
+- acquire(blocking=False) 尝试加锁，已被其他进程持有时立即返回 False
+"""
+
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """基于锁文件的排他锁，同时持有进程内线程锁，避免同进程多线程重复加锁"""
+
+    _thread_locks = {}
+    _thread_locks_guard = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        with FileLock._thread_locks_guard:
+            self._thread_lock = FileLock._thread_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+    def acquire(self, blocking=True):
+        """加锁，blocking=False 时锁已被持有则立即返回 False"""
+        if not self._thread_lock.acquire(blocking):
+            return False
+        fd = None
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl is not None:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(fd)
+                    self._thread_lock.release()
+                    return False
+            else:
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            os.close(fd)
+                            self._thread_lock.release()
+                            return False
+                        time.sleep(0.05)
+            self._fd = fd
+            return True
+        except Exception:
+            if fd is not None and self._fd is None:
+                os.close(fd)
+            self._thread_lock.release()
+            raise
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        try:
+            if fd is not None:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+                os.close(fd)
+        finally:
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
@@ -0,0 +1,304 @@
+"""
+共享 HTTP 客户端
+- 进程内唯一的 requests.Session，开启 keep-alive 连接池，避免每次请求都重新握手
+- 连接池大小可配置（建议与并发 worker 数保持一致），支持按 host 单独限制连接数
+- 线程安全，多个线程共用同一个连接池
+- 统计新建连接数 / 连接复用次数
+- 聊天 / 商品列表接口支持录制与回放（common.cassette）
+- 登录 / 商品列表 / 聊天接口按配额限流（common.rate_limit），限流等待不计入接口耗时
+- 所有请求带连接 / 读取超时，命名接口按策略重试和熔断（common.resilience）
+- 命名接口的请求按 DNS / 建连 / TLS / 首字节 / 响应体 分阶段计时（common.http_timing），
+  并记录为链路追踪中的网络请求 span（common.tracing）
+- 接口地址前缀可通过环境变量 API_BASE_URL 或 set_base_url() 切换（如指向本地 mock 服务）
+"""
+
+import os
+import time
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import PoolManager
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from common import metrics
+from common import cassette
+from common import rate_limit
+from common import resilience
+from common import http_timing
+from common import tracing
+
+DEFAULT_BASE_URL = "https://dev.zhiyan.chat"
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_HOSTS = 10
+LOOPBACK_HOSTS = frozenset({"localhost", "::1", "0.0.0.0"})
+
+_base_url = os.environ.get("API_BASE_URL", DEFAULT_BASE_URL).rstrip("/")
+
+_lock = threading.Lock()
+_session = None
+_config = {
+    "pool_size": DEFAULT_POOL_SIZE,
+    "host_limits": {},
+    "block": False,
+}
+_stats = {}
+
+
+def base_url():
+    """当前接口地址前缀"""
+    return _base_url
+
+
+def set_base_url(url):
+    """
+    切换接口地址前缀
+
+    参数:
+        url: 地址前缀，如 http://127.0.0.1:8900；传 None 恢复默认（环境变量 API_BASE_URL 或线上地址）
+    """
+    global _base_url
+    _base_url = (url or os.environ.get("API_BASE_URL", DEFAULT_BASE_URL)).rstrip("/")
+
+
+def url(path, base=None):
+    """拼接完整接口地址，base 为空时使用当前地址前缀"""
+    return (base.rstrip("/") if base else _base_url) + path
+
+
+def is_loopback(url=None):
+    """地址（默认当前地址前缀）是否指向本机，本地 mock 服务端口每次不同，相关缓存不写入磁盘"""
+    host = urlsplit(url or _base_url).hostname or ""
+    return host in LOOPBACK_HOSTS or host.startswith("127.")
+
+
+def _count(host, key):
+    """累加某个 host 的统计计数"""
+    with _lock:
+        host_stats = _stats.setdefault(host, {"requests": 0, "new_connections": 0})
+        host_stats[key] += 1
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    """新建连接时计数的 HTTP 连接池，连接分阶段计时"""
+
+    ConnectionCls = http_timing.TimedHTTPConnection
+
+    def _new_conn(self):
+        _count(self.host, "new_connections")
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    """新建连接时计数的 HTTPS 连接池，连接分阶段计时"""
+
+    ConnectionCls = http_timing.TimedHTTPSConnection
+
+    def _new_conn(self):
+        _count(self.host, "new_connections")
+        return super()._new_conn()
+
+
+class _HostLimitedPoolManager(PoolManager):
+    """按 host 设置连接池上限的 PoolManager"""
+
+    def __init__(self, host_limits=None, **kwargs):
+        super().__init__(**kwargs)
+        self.host_limits = host_limits or {}
+        self.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        if host in self.host_limits:
+            request_context = dict(request_context or self.connection_pool_kw)
+            request_context["maxsize"] = self.host_limits[host]
+        return super()._new_pool(scheme, host, port, request_context)
+
+
+class _PooledAdapter(HTTPAdapter):
+    """使用 _HostLimitedPoolManager 的 requests 适配器"""
+
+    def __init__(self, host_limits=None, **kwargs):
+        self._host_limits = host_limits or {}
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = _HostLimitedPoolManager(
+            host_limits=self._host_limits,
+            num_pools=connections,
+            maxsize=maxsize,
+            block=block,
+            **pool_kwargs,
+        )
+
+
+def _build_session():
+    """按当前配置创建 Session"""
+    session = requests.Session()
+    # 与原先每次新建 session 的行为保持一致：不在请求之间携带 cookie
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = _PooledAdapter(
+        host_limits=_config["host_limits"],
+        pool_connections=max(DEFAULT_MAX_HOSTS, len(_config["host_limits"])),
+        pool_maxsize=_config["pool_size"],
+        pool_block=_config["block"],
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def configure(pool_size=None, host_limits=None, block=None):
+    """
+    调整连接池配置，已有连接会被关闭，后续请求使用新的连接池
+
+    参数:
+        pool_size: 每个 host 的连接池大小，建议与并发 worker 数一致
+        host_limits: 按 host 单独设置的连接数上限，如 {"dev.zhiyan.chat": 20}
+        block: 连接数达到上限时是否阻塞等待空闲连接（True 则严格限制连接数）
+    """
+    global _session
+    with _lock:
+        if pool_size is not None:
+            _config["pool_size"] = pool_size
+        if host_limits is not None:
+            _config["host_limits"] = dict(host_limits)
+        if block is not None:
+            _config["block"] = block
+        old_session, _session = _session, None
+    if old_session is not None:
+        old_session.close()
+
+
+def get_session():
+    """获取进程内共享的 Session"""
+    global _session
+    session = _session
+    if session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session()
+            session = _session
+    return session
+
+
+def request(method, url, endpoint=None, **kwargs):
+    """
+    通过共享连接池发送请求，其余参数与 requests.Session.request 一致
+
+    参数:
+        endpoint: 接口名称（可选），传入时将本次请求耗时记录到 common.metrics 中同名的直方图；
+            聊天 / 商品列表接口在启用录制时会被录制或回放（见 common.cassette），
+            启用限流时按该接口的配额等待（见 common.rate_limit），并按该接口的策略重试 / 熔断（见 common.resilience）；
+            未传入时只设置默认超时
+    """
+    tape = cassette.active(endpoint)
+    if tape is not None and tape.replaying:
+        return _replay(tape, method, url, endpoint, kwargs)
+
+    kwargs.setdefault("timeout", resilience.timeout(endpoint))
+    if endpoint is None:
+        _count(urlsplit(url).hostname, "requests")
+        return get_session().request(method, url, **kwargs)
+    return resilience.policy(endpoint).call(method, lambda: _send(method, url, endpoint, tape, kwargs))
+
+
+def _send(method, url, endpoint, tape, kwargs):
+    """发送一次请求（每次重试各调用一次），记录耗时和 span 并录制"""
+    rate_limit.acquire(endpoint)
+    _count(urlsplit(url).hostname, "requests")
+    body = cassette.request_body(kwargs)
+    request_id = body.get("request_id") if isinstance(body, dict) else None
+    with tracing.http_span(method, url, endpoint, request_id) as span:
+        kwargs = dict(kwargs, headers=tracing.inject(kwargs.get("headers")))
+        timing = http_timing.begin(request_id)
+        start = time.perf_counter()
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except Exception:
+            http_timing.finish(timing, None)
+            metrics.incr(f"{endpoint}.errors")
+            raise
+        elapsed = time.perf_counter() - start
+        metrics.record(endpoint, elapsed)
+        response.timing = http_timing.finish(timing, endpoint)
+        tracing.annotate_response(span, response.status_code, response.timing)
+    if tape is not None:
+        tape.record(endpoint, method, url, kwargs.get("params"), body,
+                    response.status_code, response.headers, response.content, elapsed)
+    return response
+
+
+def _replay(tape, method, url, endpoint, kwargs):
+    """从录制中返回响应，不发起请求"""
+    start = time.perf_counter()
+    entry, delay = tape.lookup(method, url, kwargs.get("params"), cassette.request_body(kwargs))
+    if delay > 0:
+        time.sleep(delay)
+    response = cassette.build_response(entry, method, url, kwargs)
+    metrics.record(endpoint, time.perf_counter() - start)
+    return response
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def get_stats():
+    """
+    获取连接复用统计
+
+    返回:
+        dict: {"requests": 总请求数, "new_connections": 新建连接数, "reused": 复用次数,
+               "reuse_rate": 复用率, "hosts": {host: {...}}}
+    """
+    with _lock:
+        hosts = {host: dict(s) for host, s in _stats.items()}
+
+    total_requests = 0
+    total_new = 0
+    for s in hosts.values():
+        s["reused"] = max(s["requests"] - s["new_connections"], 0)
+        total_requests += s["requests"]
+        total_new += s["new_connections"]
+
+    reused = max(total_requests - total_new, 0)
+    return {
+        "requests": total_requests,
+        "new_connections": total_new,
+        "reused": reused,
+        "reuse_rate": round(reused / total_requests, 4) if total_requests else 0.0,
+        "pool_size": _config["pool_size"],
+        "hosts": hosts,
+    }
+
+
+def merge_stats(hosts):
+    """合并其他进程的连接统计（get_stats()["hosts"]）"""
+    with _lock:
+        for host, s in hosts.items():
+            host_stats = _stats.setdefault(host, {"requests": 0, "new_connections": 0})
+            host_stats["requests"] += s["requests"]
+            host_stats["new_connections"] += s["new_connections"]
+
+
+def reset_stats():
+    """清空连接统计"""
+    with _lock:
+        _stats.clear()
+
+
+def close():
+    """关闭共享 Session 及其连接"""
+    configure()
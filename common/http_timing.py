@@ -0,0 +1,160 @@
+"""
+HTTP 请求分阶段耗时
+- dns:     域名解析
+- connect: TCP 建连
+- tls:     TLS 握手
+- ttfb:    请求发送完毕 -> 收到响应头（服务端处理时间）
+- body:    收到响应头 -> 响应体读取完毕
+- 复用连接的请求没有 dns / connect / tls 三个阶段
+- 同步客户端（requests / urllib3）通过自定义连接类计时，当前请求的计时记录保存在线程局部变量中；
+  异步客户端（aiohttp）通过 TraceConfig 计时，aiohttp 不区分 TCP 建连和 TLS 握手，两者都计入 connect
+- 每个阶段按 <接口>.<阶段> 记录到 common.metrics 直方图；单次请求的计时（毫秒，带请求体中的 request_id）
+  挂在响应对象的 timing 属性上，对话执行器会写入每轮记录
+"""
+
+import time
+import socket
+import threading
+
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+from urllib3.util.connection import allowed_gai_family
+
+from common import metrics
+
+PHASES = ("dns", "connect", "tls", "ttfb", "body")
+
+_local = threading.local()
+
+
+def new(request_id=None):
+    """新建一条计时记录"""
+    return {"request_id": request_id, "start": time.perf_counter()}
+
+
+def begin(request_id=None):
+    """开始计时一次请求（同步客户端，记录保存在当前线程），返回计时记录"""
+    timing = _local.timing = new(request_id)
+    return timing
+
+
+def current():
+    """当前线程正在计时的记录，没有返回 None"""
+    return getattr(_local, "timing", None)
+
+
+def finish(timing, endpoint):
+    """
+    结束计时，记录各阶段直方图
+
+    返回:
+        dict: {"request_id", "new_connection", "dns", "connect", "tls", "ttfb", "body"}，耗时单位毫秒
+    """
+    end = time.perf_counter()
+    if getattr(_local, "timing", None) is timing:
+        _local.timing = None
+    if "headers" in timing:
+        timing["ttfb"] = timing["headers"] - timing.get("sent", timing["start"])
+        timing["body"] = end - timing["headers"]
+
+    result = {"request_id": timing.get("request_id"), "new_connection": "connect" in timing}
+    for phase in PHASES:
+        if phase in timing:
+            if endpoint is not None:
+                metrics.record(f"{endpoint}.{phase}", timing[phase])
+            result[phase] = round(timing[phase] * 1000, 3)
+    return result
+
+
+class _TimedMixin:
+    """记录 DNS / TCP 建连 / 发送完毕 / 收到响应头 的时间点"""
+
+    def _new_conn(self):
+        timing = current()
+        if timing is None:
+            return super()._new_conn()
+
+        start = time.perf_counter()
+        try:
+            infos = socket.getaddrinfo(self._dns_host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror:
+            # 交给 urllib3 抛出标准的 NameResolutionError
+            return super()._new_conn()
+        resolved = time.perf_counter()
+        timing["dns"] = resolved - start
+
+        # 依次连接解析出的地址，与 urllib3 的 create_connection 行为一致；连接期间临时把 _dns_host 换成 IP，
+        # 连接完成后立即恢复，TLS 的 SNI / 证书校验仍使用原域名
+        host = self._dns_host
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        error = None
+        for address in addresses:
+            self._dns_host = address
+            try:
+                sock = super()._new_conn()
+                break
+            except (NewConnectionError, ConnectTimeoutError) as e:
+                error = e
+            finally:
+                self._dns_host = host
+        else:
+            raise error
+        timing["connect"] = time.perf_counter() - resolved
+        return sock
+
+    def request(self, *args, **kwargs):
+        result = super().request(*args, **kwargs)
+        timing = current()
+        if timing is not None:
+            timing["sent"] = time.perf_counter()
+        return result
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        timing = current()
+        if timing is not None:
+            timing["headers"] = time.perf_counter()
+        return response
+
+
+class TimedHTTPConnection(_TimedMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedMixin, HTTPSConnection):
+    def connect(self):
+        timing = current()
+        start = time.perf_counter()
+        super().connect()
+        if timing is not None and "connect" in timing:
+            timing["tls"] = max(time.perf_counter() - start - timing.get("dns", 0) - timing["connect"], 0.0)
+
+
+def trace_config():
+    """aiohttp 的 TraceConfig，计时记录通过 session.request(trace_request_ctx=new(...)) 传入"""
+    import aiohttp
+
+    def mark(key):
+        async def callback(session, context, params):
+            timing = context.trace_request_ctx
+            if isinstance(timing, dict):
+                timing[key] = time.perf_counter()
+        return callback
+
+    def elapsed(key, start_key, minus=None):
+        async def callback(session, context, params):
+            timing = context.trace_request_ctx
+            if isinstance(timing, dict) and start_key in timing:
+                timing[key] = time.perf_counter() - timing.pop(start_key) - timing.get(minus, 0)
+        return callback
+
+    config = aiohttp.TraceConfig()
+    config.on_dns_resolvehost_start.append(mark("dns_start"))
+    config.on_dns_resolvehost_end.append(elapsed("dns", "dns_start"))
+    # 建连事件包含 DNS 解析，减去 dns 后为 TCP 建连 + TLS 握手
+    config.on_connection_create_start.append(mark("connect_start"))
+    config.on_connection_create_end.append(elapsed("connect", "connect_start", minus="dns"))
+    config.on_request_headers_sent.append(mark("sent"))
+    config.on_request_chunk_sent.append(mark("sent"))
+    config.on_request_end.append(mark("headers"))
+    return config
@@ -0,0 +1,241 @@
+"""
+延迟统计
+- LatencyHistogram: 对数分桶（HDR 风格）直方图，内存固定，相对误差约 0.8%，
+  可在线程 / 进程之间合并（to_dict / from_dict / merge）
+- 进程内全局注册表：按名称记录延迟（chat / login / products ...）和计数器
+- 汇总结果可以渲染为文本表格，或附加到 Allure 报告
+"""
+
+import json
+import threading
+
+# 每个 2 的幂区间划分的子桶数 = 2 ** SUB_BUCKET_BITS，决定精度
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+# 可记录的最大值（微秒），超过的值按最大值计入，真实最大值单独保存
+MAX_VALUE_US = 3600 * 1000 * 1000
+
+PERCENTILES = (50, 90, 95, 99, 99.9)
+
+
+def _bucket_index(value):
+    """微秒值 -> 桶下标；小于 2 * SUB_BUCKET_COUNT 的值精确记录"""
+    if value < 2 * SUB_BUCKET_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return shift * SUB_BUCKET_COUNT + (value >> shift)
+
+
+def _bucket_range(index):
+    """桶下标 -> 该桶覆盖的 [最小值, 最大值]（微秒）"""
+    if index < 2 * SUB_BUCKET_COUNT:
+        return index, index
+    shift = index // SUB_BUCKET_COUNT - 1
+    top = index - shift * SUB_BUCKET_COUNT
+    return top << shift, ((top + 1) << shift) - 1
+
+
+_BUCKETS = _bucket_index(MAX_VALUE_US) + 1
+
+
+class LatencyHistogram:
+    """对数分桶延迟直方图，线程安全，单位: 秒（内部按微秒存储）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * _BUCKETS
+        self.count = 0
+        self.total_us = 0
+        self.min_us = None
+        self.max_us = 0
+
+    def record(self, seconds):
+        """记录一次耗时（秒）"""
+        value = max(int(seconds * 1000000), 0)
+        index = _bucket_index(min(value, MAX_VALUE_US))
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total_us += value
+            if self.min_us is None or value < self.min_us:
+                self.min_us = value
+            if value > self.max_us:
+                self.max_us = value
+
+    def merge(self, other):
+        """合并另一个直方图（LatencyHistogram 或 to_dict() 的结果）"""
+        if isinstance(other, dict):
+            other = LatencyHistogram.from_dict(other)
+        with other._lock:
+            counts = list(other._counts)
+            count, total_us, min_us, max_us = other.count, other.total_us, other.min_us, other.max_us
+        with self._lock:
+            for index, n in enumerate(counts):
+                if n:
+                    self._counts[index] += n
+            self.count += count
+            self.total_us += total_us
+            if min_us is not None and (self.min_us is None or min_us < self.min_us):
+                self.min_us = min_us
+            self.max_us = max(self.max_us, max_us)
+        return self
+
+    def percentile(self, p):
+        """返回第 p 百分位的值（秒），无数据返回 0"""
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            target = max(int(-(-p * self.count // 100)), 1)
+            seen = 0
+            for index, n in enumerate(self._counts):
+                seen += n
+                if seen >= target:
+                    value = _bucket_range(index)[1]
+                    return min(max(value, self.min_us), self.max_us) / 1000000
+        return self.max_us / 1000000
+
+    def summary(self):
+        """汇总: 次数、最小、平均、各百分位、最大值，单位毫秒"""
+        result = {"count": self.count}
+        if self.count == 0:
+            return result
+        result["min"] = round(self.min_us / 1000, 3)
+        result["mean"] = round(self.total_us / self.count / 1000, 3)
+        for p in PERCENTILES:
+            result[f"p{p:g}"] = round(self.percentile(p) * 1000, 3)
+        result["max"] = round(self.max_us / 1000, 3)
+        return result
+
+    def to_dict(self):
+        """序列化为可 JSON 化的字典（稀疏存储），用于跨进程传输"""
+        with self._lock:
+            return {
+                "counts": {str(i): n for i, n in enumerate(self._counts) if n},
+                "count": self.count,
+                "total_us": self.total_us,
+                "min_us": self.min_us,
+                "max_us": self.max_us,
+            }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        for index, n in data.get("counts", {}).items():
+            histogram._counts[int(index)] = n
+        histogram.count = data.get("count", 0)
+        histogram.total_us = data.get("total_us", 0)
+        histogram.min_us = data.get("min_us")
+        histogram.max_us = data.get("max_us", 0)
+        return histogram
+
+
+class MetricsRegistry:
+    """按名称管理延迟直方图和计数器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def record(self, name, seconds):
+        self.histogram(name).record(seconds)
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+
+    def to_dict(self):
+        with self._lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+        return {
+            "histograms": {name: h.to_dict() for name, h in histograms.items()},
+            "counters": counters,
+        }
+
+    def merge(self, data):
+        """合并另一个注册表（MetricsRegistry 或 to_dict() 的结果）"""
+        if isinstance(data, MetricsRegistry):
+            data = data.to_dict()
+        for name, histogram in data.get("histograms", {}).items():
+            self.histogram(name).merge(histogram)
+        for name, n in data.get("counters", {}).items():
+            self.incr(name, n)
+        return self
+
+    def summary(self):
+        with self._lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+        return {
+            "latency_ms": {name: histograms[name].summary() for name in sorted(histograms)},
+            "counters": {name: counters[name] for name in sorted(counters)},
+        }
+
+
+registry = MetricsRegistry()
+
+
+def record(name, seconds):
+    """记录一次耗时（秒）到全局注册表"""
+    registry.record(name, seconds)
+
+
+def incr(name, n=1):
+    """全局计数器加 n"""
+    registry.incr(name, n)
+
+
+def summary():
+    return registry.summary()
+
+
+def reset():
+    registry.reset()
+
+
+def format_table(summary_data):
+    """将 summary() 的结果渲染为文本表格"""
+    columns = ["count", "min", "mean"] + [f"p{p:g}" for p in PERCENTILES] + ["max"]
+    latency = summary_data.get("latency_ms", {})
+    width = max([len(name) for name in latency] + [8]) + 2
+    lines = [f"{'接口':<{width}}" + "".join(f"{c:>11}" for c in columns)]
+    for name, row in latency.items():
+        cells = []
+        for c in columns:
+            value = row.get(c, "-")
+            cells.append(f"{value:>11}" if c == "count" or value == "-" else f"{value:>11.1f}")
+        lines.append(f"{name:<{width}}" + "".join(cells))
+    lines.append("（单位: 毫秒）")
+
+    counters = summary_data.get("counters", {})
+    if counters:
+        lines.append("")
+        for name, n in counters.items():
+            lines.append(f"{name}: {n}")
+    return "\n".join(lines)
+
+
+def attach_to_allure(name="接口延迟统计", summary_data=None):
+    """将延迟统计以 JSON 和文本表格两种形式附加到 Allure 报告"""
+    import allure
+
+    summary_data = summary() if summary_data is None else summary_data
+    allure.attach(
+        json.dumps(summary_data, ensure_ascii=False, indent=2),
+        name=name,
+        attachment_type=allure.attachment_type.JSON
+    )
+    allure.attach(format_table(summary_data), name=f"{name}（表格）", attachment_type=allure.attachment_type.TEXT)
@@ -0,0 +1,311 @@
+"""
+本地 mock 服务
+- 实现 /api/auth/login、/api/products/、/chat/answer，请求 / 响应格式与线上接口一致
+- 每个接口可单独配置延迟分布、错误率；聊天接口可配置回复条数和长度
+- 随机种子固定时，每个接口的第 N 次请求得到相同的延迟和错误，结果可复现
+- 用于离线调试，以及在后端延迟为 0 时测量压测框架自身的开销
+- 配置文件: data/mock_server.yaml
+
+用法:
+    python -m common.mock_server                  # 按配置文件启动，Ctrl+C 退出
+    API_BASE_URL=http://127.0.0.1:8900 pytest ... # 测试指向 mock 服务
+
+    with MockServer(port=0) as server:
+        http_client.set_base_url(server.url)
+        ...
+"""
+
+import os
+import copy
+import json
+import time
+import uuid
+import zlib
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from common import pacing
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "mock_server.yaml")
+
+DEFAULT_CONFIG = {
+    "host": "127.0.0.1",
+    "port": 8900,
+    "seed": None,
+    "accounts": {
+        "zhaowenlong": "init@2234",
+        "测试专用1": "init@9934",
+    },
+    "expires_in": 1800,
+    "product_count": 57,
+    "endpoints": {
+        "login": {"latency": {"dist": "fixed", "value": 0}, "error_rate": 0, "error_type": "http500"},
+        "products": {"latency": {"dist": "fixed", "value": 0}, "error_rate": 0, "error_type": "http500"},
+        "chat": {
+            "latency": {"dist": "fixed", "value": 0},
+            "per_request_kb": 0,
+            "error_rate": 0,
+            "error_type": "code",
+            "reply_count": 1,
+            "reply_chars": 80,
+        },
+    },
+}
+
+ROUTES = {
+    ("POST", "/api/auth/login"): "login",
+    ("GET", "/api/products/"): "products",
+    ("POST", "/chat/answer"): "chat",
+}
+
+_FILLER = "这款商品口碑很好，建议按说明使用，如有问题随时联系客服。"
+
+
+def _merge(base, override):
+    """递归合并配置，override 中的值覆盖 base"""
+    result = copy.deepcopy(base)
+    for key, value in (override or {}).items():
+        # 延迟分布整体替换，避免不同分布的参数混在一起
+        if isinstance(value, dict) and isinstance(result.get(key), dict) and "dist" not in value:
+            result[key] = _merge(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def load_config(path=CONFIG_FILE, **overrides):
+    """读取配置文件并与默认配置合并；文件不存在时使用默认配置"""
+    from common import config_cache
+
+    config = DEFAULT_CONFIG
+    if path:
+        config = _merge(config, config_cache.load(path) or {})
+    return _merge(config, overrides)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockServer/1.0"
+    # 响应头和响应体分两次写出，不关闭 Nagle 时会与客户端的延迟确认叠加出约 40ms 的等待
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        parts = urlsplit(self.path)
+        endpoint = ROUTES.get((method, parts.path))
+        if endpoint is None:
+            self._send(404, {"code": 404, "message": "Not Found"})
+            return
+        status, body = self.server.mock.handle(endpoint, raw, parse_qs(parts.query), self.headers)
+        self._send(status, body, endpoint)
+
+    def _send(self, status, body, endpoint=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        if endpoint is not None:
+            self.server.mock.count(endpoint, "response_bytes", len(data))
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端读取超时后已断开连接
+            self.close_connection = True
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class MockServer:
+    """
+    本地 mock 服务，在后台线程中运行
+
+    参数:
+        config: 配置字典，与默认配置合并；为 None 时读取 data/mock_server.yaml
+        host / port / seed: 覆盖配置中的同名项，port=0 表示随机端口
+    """
+
+    def __init__(self, config=None, host=None, port=None, seed=None):
+        self.config = load_config() if config is None else _merge(DEFAULT_CONFIG, config)
+        for key, value in (("host", host), ("port", port), ("seed", seed)):
+            if value is not None:
+                self.config[key] = value
+
+        self._lock = threading.Lock()
+        self._tokens = {}     # token -> 过期时间
+        self._sequence = {}   # endpoint -> 已处理的请求数
+        self._stats = {}
+        self._rng = random.Random()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """在后台线程启动服务，返回地址前缀"""
+        self._server = _Server((self.config["host"], self.config["port"]), _Handler)
+        self._server.mock = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-server", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        """停止服务"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def serve_forever(self):
+        """在当前线程运行服务，直到 Ctrl+C"""
+        self._server = _Server((self.config["host"], self.config["port"]), _Handler)
+        self._server.mock = self
+        print(f"[mock] 已启动: {self.url}，Ctrl+C 退出")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def count(self, endpoint, key, value=1):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {
+                "requests": 0, "errors": 0, "unauthorized": 0, "request_bytes": 0, "response_bytes": 0,
+            })
+            stats[key] += value
+
+    def stats(self):
+        """各接口的请求数、注入错误数、401 次数和收发字节数"""
+        with self._lock:
+            return {endpoint: dict(s) for endpoint, s in self._stats.items()}
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    def _next_rng(self, endpoint):
+        """返回该接口本次请求使用的随机数生成器"""
+        with self._lock:
+            n = self._sequence.get(endpoint, 0)
+            self._sequence[endpoint] = n + 1
+            if self.config["seed"] is None:
+                return random.Random(self._rng.random())
+        # 按 (种子, 接口, 序号) 派生，与线程调度顺序无关
+        return random.Random(f"{self.config['seed']}/{endpoint}/{n}")
+
+    def _authorized(self, headers):
+        token = (headers.get("Authorization") or "").removeprefix("Bearer ").strip()
+        with self._lock:
+            expires_at = self._tokens.get(token)
+        return expires_at is not None and expires_at > time.time()
+
+    def handle(self, endpoint, raw, query, headers):
+        """处理一次请求，返回 (HTTP 状态码, 响应体)"""
+        spec = self.config["endpoints"].get(endpoint, {})
+        rng = self._next_rng(endpoint)
+        self.count(endpoint, "requests")
+        self.count(endpoint, "request_bytes", len(raw))
+
+        delay = pacing.sample(spec.get("latency"), rng) + spec.get("per_request_kb", 0) * len(raw) / 1024
+        if delay > 0:
+            time.sleep(delay)
+
+        if endpoint != "login" and not self._authorized(headers):
+            self.count(endpoint, "unauthorized")
+            return 401, {"code": 401, "message": "token 无效或已过期"}
+
+        if rng.random() < spec.get("error_rate", 0):
+            self.count(endpoint, "errors")
+            body = {"code": 500, "message": "mock 注入错误"}
+            return (500 if spec.get("error_type", "http500") == "http500" else 200), body
+
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            return 400, {"code": 400, "message": "请求体不是合法的 JSON"}
+        return 200, getattr(self, f"_{endpoint}")(body, query, spec)
+
+    def _login(self, body, query, spec):
+        account = body.get("account")
+        if not account or self.config["accounts"].get(account) != body.get("password"):
+            return {"code": 400, "message": "账号或密码错误", "data": None}
+        token = f"mock-{uuid.uuid4().hex}"
+        expires_in = self.config["expires_in"]
+        with self._lock:
+            self._tokens[token] = time.time() + expires_in
+        return {"code": 200, "message": "登录成功", "data": {"accessToken": token, "expiresIn": expires_in}}
+
+    def _products(self, body, query, spec):
+        shop_id = (query.get("shop_id") or ["585"])[0]
+        search = (query.get("search") or [""])[0]
+        page = max(int((query.get("page") or ["1"])[0]), 1)
+        page_size = max(int((query.get("pageSize") or ["10"])[0]), 1)
+
+        base_id = 600000000000 + zlib.crc32(shop_id.encode("utf-8")) % 100000 * 1000
+        items = [
+            {"product_id": base_id + i, "product_title": f"店铺{shop_id} 测试商品{i + 1} 补水保湿面霜"}
+            for i in range(self.config["product_count"])
+        ]
+        if search:
+            items = [item for item in items if search in item["product_title"]]
+        start = (page - 1) * page_size
+        return {"code": 200, "message": "success", "result": {"data": items[start:start + page_size], "total": len(items)}}
+
+    def _chat(self, body, query, spec):
+        messages = body.get("messages") or []
+        question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        reply_chars = spec.get("reply_chars", 80)
+        actions = []
+        for k in range(1, spec.get("reply_count", 1) + 1):
+            content = f"关于「{question}」的第 {k} 条回复。"
+            if len(content) < reply_chars:
+                content += (_FILLER * (reply_chars // len(_FILLER) + 1))[:reply_chars - len(content)]
+            actions.append({"actionType": "sendMessage", "payload": {"content": content}})
+        return {"code": 200, "message": "success", "data": {"ai_actions": actions}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 mock 服务")
+    parser.add_argument("--config", default=CONFIG_FILE, help="配置文件路径")
+    parser.add_argument("--host", help="监听地址")
+    parser.add_argument("--port", type=int, help="监听端口")
+    parser.add_argument("--seed", type=int, help="随机种子")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    server = MockServer(config, host=args.host, port=args.port, seed=args.seed)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"[mock] 已停止，请求统计: {json.dumps(server.stats(), ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+本地 mock SMTP 服务
+- 明文 SMTP，支持 EHLO / HELO / AUTH（PLAIN、LOGIN，任意账号密码都通过）/ MAIL / RCPT / DATA / RSET / NOOP / QUIT
+- 收到的每封邮件保存为 <目录>/<序号>.eml，便于检查附件
+- fail_first: 前 N 次 DATA 返回 451 临时错误；disconnect_first: 前 N 次 DATA 结束后直接断开连接，用于验证投递重试
+- refuse: 这些收件人在 RCPT 时返回 550，用于验证部分收件人被拒绝
+- 用于验证 common.report_queue 的投递流程，不需要真实邮箱
+
+用法:
+    python -m common.mock_smtp --port 2525 --dir reports/mock-mail   # Ctrl+C 退出
+    # data/report_delivery.yaml 中 smtp_server: 127.0.0.1, smtp_port: 2525, ssl: false
+
+    with MockSMTPServer(port=0, save_dir=...) as server:
+        ...server.port...
+"""
+
+import os
+import argparse
+import threading
+import socketserver
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reports", "mock-mail")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        server = self.server.owner
+        self.reply("220 mock-smtp ready")
+        mail_from, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+
+            if verb == "EHLO":
+                self.wfile.write(b"250-mock-smtp\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+            elif verb == "HELO":
+                self.reply("250 mock-smtp")
+            elif verb == "AUTH":
+                parts = command.split()
+                if parts[1].upper() == "LOGIN":
+                    # 命令中没有带用户名时先要用户名，再要密码（base64 的 "Username:" / "Password:"）
+                    prompts = ["UGFzc3dvcmQ6"] if len(parts) > 2 else ["VXNlcm5hbWU6", "UGFzc3dvcmQ6"]
+                    for prompt in prompts:
+                        self.reply(f"334 {prompt}")
+                        self.rfile.readline()
+                elif len(parts) == 2:
+                    self.reply("334 ")
+                    self.rfile.readline()
+                self.reply("235 authenticated")
+            elif verb == "MAIL":
+                mail_from, recipients = command[10:].strip(), []
+                self.reply("250 ok")
+            elif verb == "RCPT":
+                recipient = command[8:].strip()
+                if recipient.strip("<>") in server.refuse:
+                    self.reply("550 mailbox unavailable")
+                    continue
+                recipients.append(recipient)
+                self.reply("250 ok")
+            elif verb == "DATA":
+                self.reply("354 end with <CRLF>.<CRLF>")
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data == b".\r\n":
+                        break
+                    lines.append(data[1:] if data.startswith(b"..") else data)
+                outcome = server.accept(mail_from, recipients, b"".join(lines))
+                if outcome == "disconnect":
+                    return
+                self.reply("451 temporary failure" if outcome == "fail" else "250 queued")
+                mail_from, recipients = None, []
+            elif verb == "RSET":
+                mail_from, recipients = None, []
+                self.reply("250 ok")
+            elif verb == "NOOP":
+                self.reply("250 ok")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 command not implemented")
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MockSMTPServer:
+    """
+    mock SMTP 服务，在后台线程中运行
+
+    参数:
+        host / port: 监听地址，port=0 时随机分配
+        save_dir: 邮件保存目录
+        fail_first: 前 N 次 DATA 返回 451
+        disconnect_first: 前 N 次 DATA 后断开连接（在 fail_first 之后计数）
+        refuse: RCPT 时返回 550 的收件人
+
+    属性:
+        messages: 收到的邮件 [{"from", "to", "path", "size"}]
+        connections: 累计建立的连接数
+    """
+
+    def __init__(self, host="127.0.0.1", port=2525, save_dir=DEFAULT_DIR, fail_first=0, disconnect_first=0,
+                 refuse=()):
+        self.host = host
+        self.save_dir = save_dir
+        self.fail_first = fail_first
+        self.disconnect_first = disconnect_first
+        self.refuse = set(refuse)
+        self.messages = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._attempts = 0
+        self._server = _TCPServer((host, port), _Handler)
+        self._server.owner = self
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+        original = self._server.process_request
+
+        def counting(request, client_address):
+            with self._lock:
+                self.connections += 1
+            original(request, client_address)
+        self._server.process_request = counting
+
+    def accept(self, mail_from, recipients, data):
+        """处理一封邮件，返回 ok / fail / disconnect"""
+        with self._lock:
+            self._attempts += 1
+            attempt = self._attempts
+            if attempt <= self.fail_first:
+                return "fail"
+            if attempt <= self.fail_first + self.disconnect_first:
+                return "disconnect"
+            os.makedirs(self.save_dir, exist_ok=True)
+            path = os.path.join(self.save_dir, f"{len(self.messages) + 1:04d}.eml")
+            with open(path, "wb") as f:
+                f.write(data)
+            self.messages.append({"from": mail_from, "to": list(recipients), "path": path, "size": len(data)})
+        print(f"[mock-smtp] 收到邮件: {mail_from} -> {', '.join(recipients)} ({len(data) / 1024:.1f} KB) {path}")
+        return "ok"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-smtp", daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 mock SMTP 服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=2525, help="监听端口")
+    parser.add_argument("--dir", default=DEFAULT_DIR, help="邮件保存目录")
+    parser.add_argument("--fail-first", type=int, default=0, help="前 N 次投递返回 451")
+    args = parser.parse_args(argv)
+
+    server = MockSMTPServer(args.host, args.port, args.dir, fail_first=args.fail_first)
+    print(f"[mock-smtp] 监听 {args.host}:{server.port}，邮件保存到 {args.dir}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+开环（open-loop）压测模式
+- 按目标速率（每秒新建对话数）发起新对话，到达间隔可以是固定值或泊松分布，
+  不受服务端响应快慢影响，服务端变慢时负载不会随之下降
+- 每轮延迟同时按两种口径统计:
+    corrected:   从计划发送时间算起（第 1 轮为计划到达时间，之后为上一轮回复后等待结束的时间），
+                 包含因并发上限、事件循环拥塞等原因造成的排队时间（修正 coordinated omission）
+    uncorrected: 从实际发送时间算起
+"""
+
+import time
+import random
+import asyncio
+
+from common import async_http
+from common.async_conversation import run_conversation
+from common.conversation import chain
+from common.metrics import LatencyHistogram, PERCENTILES
+
+
+def arrival_offsets(rate, duration, arrival="poisson", seed=None):
+    """
+    生成对话到达时间（相对开始时间的秒数）
+
+    参数:
+        rate: 目标速率，每秒新建对话数
+        duration: 持续时间（秒）
+        arrival: 到达方式，fixed（固定间隔）/ poisson（指数分布间隔）
+        seed: 随机种子（可选），用于复现到达序列
+
+    返回:
+        list: 到达时间列表
+    """
+    if rate <= 0:
+        raise ValueError("rate 必须大于 0")
+    if arrival not in ("fixed", "poisson"):
+        raise ValueError(f"不支持的到达方式: {arrival}")
+
+    rng = random.Random(seed)
+    offsets = []
+    t = 0.0
+    while t < duration:
+        offsets.append(t)
+        t += 1.0 / rate if arrival == "fixed" else rng.expovariate(rate)
+    return offsets
+
+
+class _TurnRecorder:
+    """按修正 / 未修正两种口径记录每轮延迟"""
+
+    def __init__(self):
+        self.corrected = LatencyHistogram()
+        self.uncorrected = LatencyHistogram()
+        self.turns = 0
+        self.errors = 0
+        self.conversations = 0
+        self.success = 0
+
+    def __call__(self, record):
+        self.turns += 1
+        if record["error"]:
+            self.errors += 1
+        self.corrected.record(record["received"] - record["intended"])
+        self.uncorrected.record(record["received"] - record["sent"])
+
+
+async def run_open_loop_async(token, product, questions, rate, duration, arrival="poisson",
+                              wait_between_questions=0, shop_id="585", max_in_flight=0, seed=None,
+                              on_result=None, on_turn=None, keep_results=True):
+    """在当前事件循环中执行开环压测，参数同 run_open_loop"""
+    offsets = arrival_offsets(rate, duration, arrival, seed)
+    limiter = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+    recorder = _TurnRecorder()
+    turn_callback = chain(recorder, on_turn)
+
+    start = time.perf_counter()
+    tasks = []
+    try:
+        for conversation_id, offset in enumerate(offsets):
+            scheduled = start + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(run_conversation(
+                conversation_id, token, product, questions, wait_between_questions, shop_id,
+                on_turn=turn_callback, intended_start=scheduled, limiter=limiter,
+            )))
+
+        all_results = []
+        for finished in asyncio.as_completed(tasks):
+            result = await finished
+            recorder.conversations += 1
+            if result['success']:
+                recorder.success += 1
+            if keep_results:
+                all_results.append(result)
+            if on_result is not None:
+                on_result(result)
+    finally:
+        await async_http.close()
+    elapsed = time.perf_counter() - start
+
+    return _build_report(all_results, recorder, rate, arrival, duration, elapsed)
+
+
+def run_open_loop(token, product, questions, rate, duration, arrival="poisson", wait_between_questions=0,
+                  shop_id="585", max_in_flight=0, seed=None, on_result=None, on_turn=None, keep_results=True):
+    """
+    开环压测：按目标速率持续发起新对话
+
+    参数:
+        token: 登录 token
+        product: 商品信息
+        questions: 每个对话的问题列表
+        rate: 目标速率，每秒新建对话数
+        duration: 发起新对话的持续时间（秒），已发起的对话会执行完毕
+        arrival: 到达方式，fixed / poisson
+        wait_between_questions: 每轮对话之间的等待，秒数或 common.pacing.Pacer
+        shop_id: 店铺ID
+        max_in_flight: 同时进行中的请求数上限，0 表示不限制
+        seed: 随机种子（可选）
+        on_result: 每个对话结束时的回调（可选）
+        on_turn: 每轮请求结束时的回调（可选）
+        keep_results: 是否在报告中保留全部对话结果
+
+    返回:
+        dict: 压测报告，包含对话结果、修正/未修正的延迟百分位
+    """
+    # 连接池不设上限，排队只发生在 max_in_flight 处，才能被修正口径统计到
+    async_http.configure(pool_size=max_in_flight)
+    return asyncio.run(run_open_loop_async(
+        token, product, questions, rate, duration, arrival, wait_between_questions,
+        shop_id, max_in_flight, seed, on_result, on_turn, keep_results,
+    ))
+
+
+def _build_report(all_results, recorder, rate, arrival, duration, elapsed):
+    return {
+        "arrival": arrival,
+        "target_rate": rate,
+        "duration": duration,
+        "elapsed": elapsed,
+        "conversations": recorder.conversations,
+        "success": recorder.success,
+        "failed": recorder.conversations - recorder.success,
+        "turns": recorder.turns,
+        "turn_errors": recorder.errors,
+        "achieved_rate": recorder.conversations / duration if duration else 0.0,
+        "latency_ms": {
+            "corrected": recorder.corrected.summary(),
+            "uncorrected": recorder.uncorrected.summary(),
+        },
+        "histograms": {
+            "corrected": recorder.corrected.to_dict(),
+            "uncorrected": recorder.uncorrected.to_dict(),
+        },
+        "results": all_results,
+    }
+
+
+def format_report(report):
+    """将延迟百分位渲染为文本表格"""
+    corrected = report["latency_ms"]["corrected"]
+    uncorrected = report["latency_ms"]["uncorrected"]
+    keys = [f"p{p:g}" for p in PERCENTILES] + ["max", "mean"]
+    lines = [
+        f"到达方式: {report['arrival']}  目标速率: {report['target_rate']}/s  "
+        f"对话数: {report['conversations']}  请求数: {report['turns']}",
+        f"{'指标':<8}{'修正后(ms)':>14}{'未修正(ms)':>14}",
+    ]
+    for key in keys:
+        lines.append(f"{key:<8}{corrected.get(key, 0):>14.1f}{uncorrected.get(key, 0):>14.1f}")
+    return "\n".join(lines)
@@ -0,0 +1,313 @@
+"""
+对话轮次之间的节奏控制
+- fixed:      固定等待 N 秒（原先的 WAIT_AFTER_REPLY / wait_between_questions）
+- ready:      轮询就绪检查（如上一条 AI 回复已落库），指数退避 + 抖动，就绪后立即发下一轮；
+              超过 timeout 仍未就绪则不再等待
+- think_time: 按分布随机等待，模拟真实用户的思考时间
+- 同一个 Pacer 同时提供同步 wait() 和异步 wait_async()
+- 回放录制（common.cassette）时不等待
+- 实际等待时间记录到 common.metrics 的 pacing.wait 直方图，超时次数记录到 pacing.timeouts
+- 各参数的默认值见 DEFAULT_CONFIG，yaml 中只需写与默认值不同的项；
+  ready 模式没有配置 check 时退回 fixed 模式，避免在没有就绪检查的情况下缩短等待
+
+配置示例（yaml 中的 pacing 块）:
+    pacing:
+      mode: ready              # fixed / ready / think_time
+      seconds: 10              # fixed 模式的等待时间
+      check: http              # ready 模式的就绪检查: http / 模块:函数，留空时按 fixed 等待 seconds 秒
+      probe:                   # check=http 时的探测请求，params 中可使用 {username} {shop_id} {turn}
+        method: GET
+        path: /api/xxx
+        params: {username: "{username}"}
+        contains_reply: true   # 响应中包含上一轮回复才算就绪
+      min_wait: 0.5            # 第一次检查前的最短等待
+      initial: 0.2             # 退避初始间隔
+      factor: 2                # 退避倍数
+      max_interval: 2          # 单次间隔上限
+      timeout: 10              # 最长等待，留空时等于 seconds
+      think_time: {dist: lognormal, median: 3, sigma: 0.5}
+      seed:
+"""
+
+import math
+import time
+import random
+import asyncio
+import threading
+import importlib
+
+from common import metrics
+from common import cassette
+
+MODES = ("fixed", "ready", "think_time")
+
+# contains_reply 时用于匹配的回复前缀长度
+REPLY_PREFIX_CHARS = 20
+
+# pacing 配置的默认值（seconds 由调用方传入）
+DEFAULT_CONFIG = {
+    "mode": "fixed",
+    "check": None,
+    "probe": None,
+    "min_wait": 1.0,
+    "initial": 0.2,
+    "factor": 2.0,
+    "max_interval": 2.0,
+    "timeout": None,
+    "think_time": {"dist": "lognormal", "median": 3, "sigma": 0.5},
+    "seed": None,
+}
+
+
+def sample(spec, rng):
+    """
+    按分布配置采样一个时长（秒），结果不小于 0
+
+    参数:
+        spec: {"dist": "fixed" | "uniform" | "normal" | "lognormal" | "exponential", ...}
+            fixed: value; uniform: low, high; normal: mean, stddev;
+            lognormal: median, sigma; exponential: mean
+        rng: random.Random
+    """
+    if not spec:
+        return 0.0
+    dist = spec.get("dist", "fixed")
+    if dist == "fixed":
+        value = spec.get("value", 0)
+    elif dist == "uniform":
+        value = rng.uniform(spec.get("low", 0), spec.get("high", 0))
+    elif dist == "normal":
+        value = rng.gauss(spec.get("mean", 0), spec.get("stddev", 0))
+    elif dist == "lognormal":
+        median = spec.get("median", 0)
+        value = rng.lognormvariate(math.log(median), spec.get("sigma", 0)) if median > 0 else 0
+    elif dist == "exponential":
+        mean = spec.get("mean", 0)
+        value = rng.expovariate(1 / mean) if mean > 0 else 0
+    else:
+        raise ValueError(f"不支持的分布: {dist}")
+    return max(float(value), 0.0)
+
+
+class HttpProbe:
+    """
+    基于 HTTP 请求的就绪检查，可同步调用或在协程中 await check_async()
+
+    参数:
+        path: 接口路径（拼接到 http_client.base_url() 之后）
+        method: 请求方法
+        params: 查询参数，值中可使用 {username} {shop_id} {turn} 占位符
+        contains_reply: 是否要求响应中包含上一轮 AI 回复
+    """
+
+    def __init__(self, path, method="GET", params=None, contains_reply=True):
+        self.path = path
+        self.method = method
+        self.params = params or {}
+        self.contains_reply = contains_reply
+
+    def _params(self, context):
+        return {k: str(v).format(**context) for k, v in self.params.items()}
+
+    def _ready(self, status_code, text, context):
+        if status_code != 200:
+            return False
+        reply = (context.get("reply") or "")[:REPLY_PREFIX_CHARS]
+        return not self.contains_reply or not reply or reply in text
+
+    def __call__(self, context):
+        from common import http_client
+        from common.tool import get_headers
+
+        response = http_client.request(
+            self.method, http_client.url(self.path), endpoint="pacing_probe",
+            headers=get_headers(context.get("token")), params=self._params(context)
+        )
+        return self._ready(response.status_code, response.text, context)
+
+    async def check_async(self, context):
+        from common import async_http, http_client
+        from common.tool import get_headers
+
+        response = await async_http.request(
+            self.method, http_client.url(self.path), endpoint="pacing_probe",
+            headers=get_headers(context.get("token")), params=self._params(context)
+        )
+        return self._ready(response.status_code, response.text, context)
+
+
+def resolve_check(check, probe=None):
+    """
+    将配置中的 check 转换为可调用对象
+
+    参数:
+        check: None / "http" / "模块:函数" / 可调用对象；函数参数为上下文字典，返回是否就绪
+        probe: check="http" 时的探测配置
+    """
+    if check is None or callable(check):
+        return check
+    if check == "http":
+        if not probe or not probe.get("path"):
+            raise ValueError("check=http 时需要配置 probe.path")
+        return HttpProbe(**probe)
+    module_name, _, func_name = check.partition(":")
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+class Pacer:
+    """
+    轮次间等待策略
+
+    参数:
+        mode: fixed / ready / think_time
+        seconds: fixed 模式的等待时间
+        check: ready 模式的就绪检查，参数为上下文字典
+            {"username", "token", "shop_id", "turn", "reply"}，返回 True 表示就绪；为 None 时等待 min_wait 后视为就绪
+        min_wait / initial / factor / max_interval / timeout: ready 模式的退避参数（秒）
+        think_time: think_time 模式的分布配置，格式同 sample()
+        seed: 随机种子
+    """
+
+    def __init__(self, mode="fixed", seconds=0, check=None, min_wait=0.0, initial=0.2, factor=2.0,
+                 max_interval=2.0, timeout=10.0, think_time=None, seed=None):
+        if mode not in MODES:
+            raise ValueError(f"不支持的等待模式: {mode}")
+        self.mode = mode
+        self.seconds = seconds
+        self.check = check
+        self.min_wait = min_wait
+        self.initial = initial
+        self.factor = factor
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.think_time = think_time
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # 锁不能序列化，传给子进程时去掉，反序列化后重新创建
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _think_time(self):
+        with self._lock:
+            return sample(self.think_time, self._rng)
+
+    def backoff(self):
+        """ready 模式的各次检查间隔: 指数增长，每次取 [d/2, d] 之间的随机值"""
+        interval = self.initial
+        while True:
+            capped = min(interval, self.max_interval)
+            with self._lock:
+                jitter = self._rng.uniform(0, capped / 2)
+            yield capped / 2 + jitter
+            interval *= self.factor
+
+    def _finish(self, start, timed_out=False):
+        waited = time.perf_counter() - start
+        metrics.record("pacing.wait", waited)
+        if timed_out:
+            metrics.incr("pacing.timeouts")
+        return waited
+
+    def wait(self, context=None):
+        """
+        阻塞等待到可以发送下一轮
+
+        参数:
+            context: 就绪检查用的上下文字典
+
+        返回:
+            float: 实际等待的秒数
+        """
+        if cassette.replaying():
+            return 0.0
+        start = time.perf_counter()
+        if self.mode == "fixed":
+            time.sleep(self.seconds)
+        elif self.mode == "think_time":
+            time.sleep(self._think_time())
+        else:
+            deadline = start + self.timeout
+            time.sleep(min(self.min_wait, self.timeout))
+            if self.check is not None:
+                for delay in self.backoff():
+                    if self._probe(context):
+                        break
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        return self._finish(start, timed_out=True)
+                    time.sleep(min(delay, remaining))
+        return self._finish(start)
+
+    async def wait_async(self, context=None):
+        """wait() 的协程版本，就绪检查在线程池中执行（HttpProbe 使用异步请求）"""
+        if cassette.replaying():
+            return 0.0
+        start = time.perf_counter()
+        if self.mode == "fixed":
+            await asyncio.sleep(self.seconds)
+        elif self.mode == "think_time":
+            await asyncio.sleep(self._think_time())
+        else:
+            deadline = start + self.timeout
+            await asyncio.sleep(min(self.min_wait, self.timeout))
+            if self.check is not None:
+                for delay in self.backoff():
+                    if await self._probe_async(context):
+                        break
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        return self._finish(start, timed_out=True)
+                    await asyncio.sleep(min(delay, remaining))
+        return self._finish(start)
+
+    def _probe(self, context):
+        try:
+            return bool(self.check(context or {}))
+        except Exception as e:
+            print(f"[pacing] 就绪检查失败: {e}")
+            return False
+
+    async def _probe_async(self, context):
+        try:
+            if hasattr(self.check, "check_async"):
+                return bool(await self.check.check_async(context or {}))
+            return bool(await asyncio.to_thread(self.check, context or {}))
+        except Exception as e:
+            print(f"[pacing] 就绪检查失败: {e}")
+            return False
+
+
+def from_config(config=None, seconds=0):
+    """
+    根据 yaml 中的 pacing 配置创建 Pacer，未配置的项使用 DEFAULT_CONFIG
+
+    参数:
+        config: pacing 配置字典，为空时使用 fixed 模式
+        seconds: 配置中没有 seconds 时 fixed 模式的等待时间，也是 ready 模式未配置 timeout 时的最长等待
+    """
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    mode = config.pop("mode") or "fixed"
+    if config.get("seconds") is None:
+        config["seconds"] = seconds
+    if config.get("timeout") is None:
+        config["timeout"] = config["seconds"]
+    check = config.pop("check")
+    probe = config.pop("probe")
+    if mode == "ready" and check is None:
+        print(f"[pacing] ready 模式未配置 check，按 fixed 模式等待 {config['seconds']}s")
+        mode = "fixed"
+    return Pacer(mode, check=resolve_check(check, probe) if mode == "ready" else None, **config)
+
+
+def as_pacer(value):
+    """Pacer 原样返回，数字视为 fixed 模式的等待秒数"""
+    if isinstance(value, Pacer):
+        return value
+    return Pacer("fixed", seconds=value or 0)
@@ -0,0 +1,236 @@
+"""
+多进程并发对话驱动
+- 将 count 个对话按连续区间分片到多个 worker 进程，每个进程内部用线程池或事件循环驱动自己的分片，
+  避免单进程在 JSON 编解码、结果解析上受 GIL 限制
+- worker 从共享的 token 缓存（.cache/tokens.json）中获取 token，不会重复登录；
+  使用账号池（common.account_pool）时每个 worker 按同样的配置重建账号池，在自己的分片内分配账号
+- 每轮记录、每个对话结果通过队列批量回传主进程，主进程调用 on_turn / on_result，
+  ResultSink、DepthRecorder 等回调无需改动
+- worker 结束时回传自己的 metrics 注册表和连接统计，主进程合并到全局 metrics / http_client 统计中
+"""
+
+import os
+import time
+import queue
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 每批回传的事件数
+BATCH_SIZE = 50
+# 主进程等待队列消息的超时（秒），超时后检查 worker 是否异常退出
+POLL_INTERVAL = 1.0
+
+
+def shard(count, processes):
+    """将 [0, count) 尽量均匀地切分为 processes 个连续区间，返回 [(起始ID, 数量), ...]"""
+    processes = max(min(processes, count), 1)
+    size, extra = divmod(count, processes)
+    shards = []
+    start = 0
+    for i in range(processes):
+        n = size + (1 if i < extra else 0)
+        shards.append((start, n))
+        start += n
+    return shards
+
+
+class _Sender:
+    """在 worker 中批量发送事件，线程安全"""
+
+    def __init__(self, events, worker_id):
+        import threading
+
+        self._events = events
+        self._worker_id = worker_id
+        self._lock = threading.Lock()
+        self._batch = []
+
+    def put(self, kind, item):
+        with self._lock:
+            self._batch.append((kind, item))
+            if len(self._batch) < BATCH_SIZE and kind != "result":
+                return
+            batch, self._batch = self._batch, []
+        self._events.put(("batch", self._worker_id, batch))
+
+    def flush(self):
+        with self._lock:
+            batch, self._batch = self._batch, []
+        if batch:
+            self._events.put(("batch", self._worker_id, batch))
+
+
+def run_shard(start, count, token, product, questions, wait_between_questions=0, shop_id="585",
+              engine="thread", on_result=None, on_turn=None):
+    """
+    在当前进程中运行 ID 从 start 开始的 count 个对话，回调中的 conversation_id 为全局 ID
+
+    参数:
+        engine: thread（线程池）/ asyncio（事件循环）
+        其余参数同 run_processes
+    """
+    from common import http_client
+
+    def turn_callback(record):
+        record["conversation_id"] += start
+        if on_turn is not None:
+            on_turn(record)
+
+    def result_callback(result):
+        result["conversation_id"] += start
+        if on_result is not None:
+            on_result(result)
+
+    args = (product, questions, wait_between_questions, shop_id)
+    if engine == "asyncio":
+        from common.async_conversation import run_conversations
+        run_conversations(count, token, *args, on_result=result_callback, on_turn=turn_callback,
+                          keep_results=False)
+        return
+
+    from common.conversation import run_single_conversation
+    http_client.configure(pool_size=count)
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        futures = [
+            executor.submit(run_single_conversation, i, token, *args, on_turn=turn_callback)
+            for i in range(count)
+        ]
+        # 按完成顺序回传，结果不会被先提交但较慢的对话挡住
+        for future in as_completed(futures):
+            result_callback(future.result())
+
+
+def _worker(worker_id, start, count, options, events):
+    """worker 进程入口"""
+    from common import http_client, metrics
+    from common.tool import get_token
+
+    http_client.set_base_url(options["base_url"])
+    sender = _Sender(events, worker_id)
+
+    try:
+        if options["account_pool"] is not None:
+            from common.account_pool import AccountPool
+            token = AccountPool(**options["account_pool"])
+            token.login_all()
+        else:
+            token = get_token(*options["credentials"])
+        run_shard(
+            start, count, token, options["product"], options["questions"], options["wait_between_questions"],
+            options["shop_id"], options["engine"],
+            on_result=lambda result: sender.put("result", result),
+            on_turn=lambda record: sender.put("turn", record),
+        )
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    sender.flush()
+    events.put(("done", worker_id, {
+        "error": error,
+        "metrics": metrics.registry.to_dict(),
+        "connections": http_client.get_stats()["hosts"],
+    }))
+
+
+def run_processes(count, product, questions, wait_between_questions=0, shop_id="585", processes=None,
+                  engine="thread", account=None, password=None, on_result=None, on_turn=None,
+                  keep_results=True, pool=None):
+    """
+    在多个进程中并发运行 count 个对话
+
+    参数:
+        count: 对话数量
+        product: 商品信息
+        questions: 问题列表
+        wait_between_questions: 每轮对话之间的等待，秒数或 common.pacing.Pacer
+        shop_id: 店铺ID，默认 585
+        processes: worker 进程数，默认 CPU 核数
+        engine: 每个 worker 内部的执行引擎 thread / asyncio
+        account / password: 登录账号，默认使用 common.tool 中的默认账号
+        on_result: 每个对话结束时的回调（在主进程中调用）
+        on_turn: 每轮请求结束时的回调（在主进程中调用），记录格式同 run_single_conversation
+        keep_results: 是否保留并返回全部对话结果
+        pool: common.account_pool.AccountPool（可选），传入时忽略 account / password，对话分散到池中各账号
+
+    返回:
+        dict: {"conversations", "success", "failed", "processes", "duration", "worker_errors", "results"}
+    """
+    from common import http_client, metrics
+    from common.tool import get_token, DEFAULT_ACCOUNT, DEFAULT_PASSWORD
+
+    credentials = (account or DEFAULT_ACCOUNT, password or DEFAULT_PASSWORD)
+    # 主进程先登录一次，写入磁盘缓存，worker 直接读取
+    if pool is not None:
+        pool.login_all()
+    else:
+        get_token(*credentials)
+
+    options = {
+        "base_url": http_client.base_url(),
+        "credentials": credentials,
+        "account_pool": pool.spec() if pool is not None else None,
+        "product": product,
+        "questions": questions,
+        "wait_between_questions": wait_between_questions,
+        "shop_id": shop_id,
+        "engine": engine,
+    }
+    shards = shard(count, processes or os.cpu_count() or 1)
+    context = multiprocessing.get_context("spawn")
+    events = context.Queue()
+    workers = {
+        worker_id: context.Process(
+            target=_worker, args=(worker_id, start, n, options, events), name=f"conversation-worker-{worker_id}",
+            daemon=True
+        )
+        for worker_id, (start, n) in enumerate(shards)
+    }
+
+    report = {"conversations": 0, "success": 0, "failed": 0, "processes": len(workers),
+              "worker_errors": {}, "results": []}
+    start_time = time.time()
+    for process in workers.values():
+        process.start()
+
+    pending = set(workers)
+    try:
+        while pending:
+            try:
+                message = events.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                for worker_id in list(pending):
+                    if workers[worker_id].exitcode not in (None, 0):
+                        pending.discard(worker_id)
+                        report["worker_errors"][worker_id] = f"进程异常退出，exitcode={workers[worker_id].exitcode}"
+                continue
+
+            kind, worker_id, payload = message
+            if kind == "done":
+                pending.discard(worker_id)
+                metrics.registry.merge(payload["metrics"])
+                http_client.merge_stats(payload["connections"])
+                if payload["error"]:
+                    report["worker_errors"][worker_id] = payload["error"]
+                continue
+
+            for event, item in payload:
+                if event == "turn":
+                    if on_turn is not None:
+                        on_turn(item)
+                    continue
+                report["conversations"] += 1
+                report["success" if item['success'] else "failed"] += 1
+                if keep_results:
+                    report["results"].append(item)
+                if on_result is not None:
+                    on_result(item)
+    finally:
+        for process in workers.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    report["duration"] = time.time() - start_time
+    for worker_id, error in report["worker_errors"].items():
+        print(f"[worker {worker_id}] {error}")
+    return report
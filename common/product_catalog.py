@@ -0,0 +1,311 @@
+"""
+店铺商品目录
+- 拉取店铺全部商品：先取第 1 页拿到 total，其余分页并发获取
+- 内存中建立 商品ID -> 商品 的索引，以及标题检索索引
+- 目录持久化到 .cache/catalog_<host>_<shop_id>.json，带 TTL；过期后只取第 1 页做校验，
+  数据未变化时直接续期，有变化才重新拉取全部分页
+- 内存缓存按 接口地址 + 店铺 区分，切换到 mock 服务后不会拿到线上的目录；本机地址（mock 服务）的目录不写入磁盘
+- 启用录制 / 回放（common.cassette）时不读写磁盘缓存，内存缓存按录制名称区分，
+  每卷录制都包含自己的商品列表请求，回放结果不依赖本地缓存
+"""
+
+import os
+import json
+import math
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from common import cassette
+from common import tracing
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache")
+
+# 目录有效期（秒），过期后重新校验
+CATALOG_TTL = 600
+# 拉取目录时每页数量
+PAGE_SIZE = 20
+# 并发拉取分页的线程数
+MAX_WORKERS = 8
+# 按ID查不到商品时，同一店铺两次校验之间的最短间隔（秒），避免查询不存在的ID时反复拉取目录
+MISS_RECHECK_SECONDS = 60
+
+_lock = threading.Lock()
+_shop_locks = {}
+_catalogs = {}  # (接口地址, shop_id, 录制名称) -> ProductCatalog
+_miss_checked = {}  # (接口地址, shop_id, 录制名称) -> 上次因查不到商品而校验目录的时间
+
+
+class ProductCatalog:
+    """单个店铺的商品目录，提供按ID、按位置、按标题的 O(1) / 索引查询"""
+
+    def __init__(self, shop_id, items, total=None, fetched_at=None):
+        self.shop_id = str(shop_id)
+        self.items = items
+        self.total = len(items) if total is None else total
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        self.by_id = {str(item.get('product_id', '')): item for item in items}
+        self._title_index = {}
+        for position, item in enumerate(items):
+            for gram in _grams(item.get('product_title') or ''):
+                self._title_index.setdefault(gram, set()).add(position)
+
+    def is_fresh(self, ttl=None):
+        ttl = CATALOG_TTL if ttl is None else ttl
+        return time.time() - self.fetched_at < ttl
+
+    def get(self, product_id):
+        """按商品ID查询，未找到返回 None"""
+        return self.by_id.get(str(product_id))
+
+    def at(self, position):
+        """按目录中的位置查询，越界返回 None"""
+        if 0 <= position < len(self.items):
+            return self.items[position]
+        return None
+
+    def search(self, keyword, limit=None):
+        """按标题关键词检索，返回按目录顺序排列的商品列表"""
+        keyword = (keyword or '').lower()
+        if not keyword:
+            return []
+        grams = _grams(keyword, sizes=(2,) if len(keyword) > 1 else (1,))
+        positions = None
+        for gram in grams:
+            hits = self._title_index.get(gram, set())
+            positions = hits if positions is None else positions & hits
+            if not positions:
+                return []
+        matched = [
+            self.items[p] for p in sorted(positions)
+            if keyword in (self.items[p].get('product_title') or '').lower()
+        ]
+        return matched[:limit] if limit else matched
+
+    def first_page_ids(self, page_size=PAGE_SIZE):
+        return [str(item.get('product_id', '')) for item in self.items[:page_size]]
+
+    def to_dict(self):
+        return {
+            "shop_id": self.shop_id,
+            "total": self.total,
+            "fetched_at": self.fetched_at,
+            "items": self.items,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["shop_id"], data["items"], data.get("total"), data.get("fetched_at"))
+
+
+def _grams(text, sizes=(1, 2)):
+    """将标题切分为单字和双字片段，中文标题无需分词即可检索"""
+    text = text.lower()
+    grams = set()
+    for size in sizes:
+        for i in range(len(text) - size + 1):
+            gram = text[i:i + size]
+            if not gram.isspace():
+                grams.add(gram)
+    return grams
+
+
+def _cache_path(shop_id):
+    from common import http_client
+
+    # 文件名带上接口 host，mock 服务和线上环境的目录互不覆盖
+    host = urlsplit(http_client.base_url()).netloc.replace(":", "_")
+    return os.path.join(CACHE_DIR, f"catalog_{host}_{shop_id}.json")
+
+
+def _use_disk():
+    """是否读写磁盘缓存: 本机地址（mock 服务）和录制 / 回放时不使用"""
+    from common import http_client
+
+    return not http_client.is_loopback() and cassette.active("products") is None
+
+
+def _load_from_disk(shop_id):
+    if not _use_disk():
+        return None
+    try:
+        with open(_cache_path(shop_id), "r", encoding="utf-8") as f:
+            return ProductCatalog.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _save_to_disk(catalog):
+    from common.file_lock import FileLock
+
+    if not _use_disk():
+        return
+    path = _cache_path(catalog.shop_id)
+    with FileLock(path + ".lock"):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(catalog.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def prune_disk(dry_run=False):
+    """
+    删除本机地址（mock 服务）留下的目录缓存文件
+
+    返回:
+        int: 删除的文件数
+    """
+    from common import http_client
+
+    removed = 0
+    if not os.path.isdir(CACHE_DIR):
+        return removed
+    for name in os.listdir(CACHE_DIR):
+        if not name.startswith("catalog_"):
+            continue
+        host = name[len("catalog_"):].split("_", 1)[0]
+        if http_client.is_loopback(f"http://{host}"):
+            if not dry_run:
+                try:
+                    os.unlink(os.path.join(CACHE_DIR, name))
+                except OSError:
+                    continue
+            removed += 1
+    return removed
+
+
+def _fetch_page(token, shop_id, page):
+    """拉取一页商品，返回 (items, total)，失败返回 None"""
+    from api.product import get_products
+
+    result = get_products(token, shop_id, page=page, page_size=PAGE_SIZE).json()
+    if result.get('code') != 200:
+        print(f"获取商品列表失败: {result.get('message')}")
+        return None
+    data = result.get('result', {})
+    return data.get('data', []), data.get('total', 0)
+
+
+def _fetch_all(token, shop_id, first_page=None):
+    """拉取店铺全部商品，first_page 为已获取的第 1 页结果"""
+    first_page = first_page or _fetch_page(token, shop_id, 1)
+    if first_page is None:
+        return None
+
+    items, total = first_page
+    pages = max(math.ceil(total / PAGE_SIZE), 1)
+    if pages > 1:
+        workers = min(MAX_WORKERS, pages - 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            fetch = tracing.wrap(lambda p: _fetch_page(token, shop_id, p))
+            rest = list(executor.map(fetch, range(2, pages + 1)))
+        if any(page is None for page in rest):
+            return None
+        items = list(items)
+        for page_items, _ in rest:
+            items.extend(page_items)
+
+    print(f"[商品目录] 店铺 {shop_id} 已拉取 {len(items)} 个商品（{pages} 页）")
+    return ProductCatalog(shop_id, items, total)
+
+
+def _revalidate(token, catalog):
+    """目录过期后只取第 1 页校验，未变化则续期，否则重新拉取"""
+    first_page = _fetch_page(token, catalog.shop_id, 1)
+    if first_page is None:
+        return None
+
+    items, total = first_page
+    page_ids = [str(item.get('product_id', '')) for item in items]
+    if total == catalog.total and page_ids == catalog.first_page_ids(len(page_ids)):
+        catalog.fetched_at = time.time()
+        return catalog
+    return _fetch_all(token, catalog.shop_id, first_page)
+
+
+def _catalog_key(shop_id):
+    from common import http_client
+
+    tape = cassette.active("products")
+    return http_client.base_url(), str(shop_id), tape.name if tape is not None else None
+
+
+def _shop_lock(key):
+    with _lock:
+        return _shop_locks.setdefault(key, threading.Lock())
+
+
+def get_catalog(token, shop_id="585", refresh=False):
+    """
+    获取店铺商品目录，缓存有效时不发起任何请求
+
+    参数:
+        token: 登录 token
+        shop_id: 店铺ID，默认 585
+        refresh: 是否强制重新拉取全部分页
+
+    返回:
+        ProductCatalog: 商品目录，拉取失败返回 None
+    """
+    shop_id = str(shop_id)
+    key = _catalog_key(shop_id)
+    catalog = _catalogs.get(key)
+    if catalog is not None and not refresh and catalog.is_fresh():
+        return catalog
+
+    with _shop_lock(key):
+        catalog = _catalogs.get(key)
+        if catalog is None and not refresh:
+            catalog = _load_from_disk(shop_id)
+        if catalog is not None and not refresh and catalog.is_fresh():
+            _catalogs[key] = catalog
+            return catalog
+
+        if catalog is not None and not refresh:
+            new_catalog = _revalidate(token, catalog)
+        else:
+            new_catalog = _fetch_all(token, shop_id)
+        if new_catalog is None:
+            return None
+
+        _catalogs[key] = new_catalog
+        _save_to_disk(new_catalog)
+        return new_catalog
+
+
+def revalidate_on_miss(token, shop_id="585"):
+    """
+    按ID查不到商品时调用: 只取第 1 页校验目录，有变化才重新拉取全部分页
+    同一店铺 MISS_RECHECK_SECONDS 秒内只校验一次，其余调用直接返回当前目录
+
+    返回:
+        ProductCatalog: 校验后的目录，没有目录时返回 None
+    """
+    shop_id = str(shop_id)
+    key = _catalog_key(shop_id)
+    with _shop_lock(key):
+        catalog = _catalogs.get(key)
+        now = time.time()
+        if catalog is None or now - _miss_checked.get(key, 0) < MISS_RECHECK_SECONDS:
+            return catalog
+        _miss_checked[key] = now
+        new_catalog = _revalidate(token, catalog)
+        if new_catalog is None:
+            return catalog
+        if new_catalog is not catalog:
+            _catalogs[key] = new_catalog
+        _save_to_disk(new_catalog)
+        return new_catalog
+
+
+def clear(shop_id=None):
+    """清除内存中的目录缓存（shop_id 为空时清除全部，否则清除该店铺在所有接口地址下的目录）"""
+    with _lock:
+        if shop_id is None:
+            _catalogs.clear()
+            _miss_checked.clear()
+        else:
+            for key in [key for key in _catalogs if key[1] == str(shop_id)]:
+                _catalogs.pop(key, None)
+                _miss_checked.pop(key, None)
@@ -0,0 +1,215 @@
+"""
+令牌桶限流
+- 登录、商品列表、聊天接口各自一个令牌桶（rate 每秒补充的令牌数，burst 桶容量）
+- 采用“预约”方式: 取令牌时在锁内算出需要等待的时间并立即扣减，锁外再 sleep，
+  同一个桶可同时被线程（acquire）和协程（acquire_async）使用
+- shared: true 时桶状态保存在 .cache/ratelimit/ 下的文件中，通过 common.file_lock 加锁读写，
+  同一台机器上的多个进程（多进程驱动、同时运行的多个测试套件）共享同一份配额
+- 在限流器上的等待时间记录到 common.metrics 的 ratelimit.<接口> 直方图，
+  与接口本身的网络耗时（<接口> 直方图）分开统计；发生等待的次数记录到 ratelimit.<接口>.throttled
+- 回放录制（common.cassette）时不限流
+
+配置见 data/rate_limit.yaml，也可以在代码中调用 configure()
+"""
+
+import os
+import time
+import struct
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+from common import metrics
+from common import config_cache
+from common import cassette
+from common.file_lock import FileLock
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "rate_limit.yaml")
+STATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "ratelimit")
+
+# 共享桶状态: 剩余令牌数、上次补充时间（time.time()）
+_STATE = struct.Struct("<dd")
+
+_lock = threading.Lock()
+_config = None
+_buckets = {}  # (接口, 地址前缀) -> 令牌桶
+
+
+class TokenBucket:
+    """
+    进程内令牌桶，线程安全
+
+    参数:
+        rate: 每秒补充的令牌数
+        burst: 桶容量（允许的突发请求数）
+    """
+
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise ValueError("rate 必须大于 0")
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def reserve(self, n=1):
+        """
+        预约 n 个令牌（令牌数可以为负，表示已被后来者预约）
+
+        返回:
+            float: 需要等待的秒数，0 表示可以立即发送
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.burst) - n
+            self._updated = now
+            return max(-self._tokens / self.rate, 0.0)
+
+    def acquire(self, n=1):
+        """阻塞直到取得令牌，返回等待的秒数"""
+        delay = self.reserve(n)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self, n=1):
+        """acquire() 的协程版本"""
+        delay = self.reserve(n)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    跨进程共享的令牌桶，状态保存在文件中，每次预约时加文件锁读写
+
+    参数:
+        rate / burst: 同 TokenBucket
+        path: 状态文件路径，使用同一路径的进程共享配额
+    """
+
+    def __init__(self, rate, burst=1, path=None):
+        super().__init__(rate, burst)
+        self.path = path
+        self._file_lock = FileLock(f"{path}.lock")
+
+    def reserve(self, n=1):
+        with self._file_lock:
+            try:
+                with open(self.path, "rb") as f:
+                    tokens, updated = _STATE.unpack(f.read(_STATE.size))
+            except (OSError, struct.error):
+                tokens, updated = self.burst, time.time()
+            # 使用墙上时间，各进程的 monotonic 时钟起点不同
+            now = time.time()
+            tokens = min(tokens + max(now - updated, 0.0) * self.rate, self.burst) - n
+            with open(self.path, "wb") as f:
+                f.write(_STATE.pack(tokens, now))
+        return max(-tokens / self.rate, 0.0)
+
+
+def load_config(path=CONFIG_FILE):
+    """读取限流配置，文件不存在时返回未启用的配置"""
+    return config_cache.load(path, default={"enabled": False}) or {}
+
+
+def configure(enabled=None, shared=None, endpoints=None):
+    """
+    修改限流配置，已创建的令牌桶会被丢弃
+
+    参数:
+        enabled: 是否启用
+        shared: 是否跨进程共享配额
+        endpoints: 各接口的配额，如 {"login": {"rate": 1, "burst": 2}}
+    """
+    global _config
+    with _lock:
+        config = dict(_config if _config is not None else load_config())
+        if enabled is not None:
+            config["enabled"] = enabled
+        if shared is not None:
+            config["shared"] = shared
+        if endpoints is not None:
+            config["endpoints"] = endpoints
+        _config = config
+        _buckets.clear()
+
+
+def _state_path(endpoint, base_url):
+    host = (urlsplit(base_url).netloc or "default").replace(":", "_")
+    return os.path.join(STATE_DIR, f"{host}_{endpoint}.bucket")
+
+
+def bucket(endpoint):
+    """
+    返回接口对应的令牌桶，未启用限流或该接口没有配额时返回 None
+    """
+    global _config
+    from common import http_client
+
+    config = _config
+    if config is None:
+        with _lock:
+            if _config is None:
+                _config = load_config()
+            config = _config
+    if not config.get("enabled") or endpoint is None:
+        return None
+    spec = (config.get("endpoints") or {}).get(endpoint)
+    if not spec or not spec.get("rate"):
+        return None
+
+    # 按地址前缀区分，避免 mock 服务和线上环境共用配额
+    key = (endpoint, http_client.base_url())
+    limiter = _buckets.get(key)
+    if limiter is None:
+        with _lock:
+            limiter = _buckets.get(key)
+            if limiter is None:
+                if config.get("shared"):
+                    os.makedirs(STATE_DIR, exist_ok=True)
+                    limiter = SharedTokenBucket(spec["rate"], spec.get("burst", 1), _state_path(*key))
+                else:
+                    limiter = TokenBucket(spec["rate"], spec.get("burst", 1))
+                _buckets[key] = limiter
+    return limiter
+
+
+def _record(endpoint, waited):
+    metrics.record(f"ratelimit.{endpoint}", waited)
+    if waited > 0:
+        metrics.incr(f"ratelimit.{endpoint}.throttled")
+
+
+def acquire(endpoint):
+    """
+    发送请求前调用，按接口配额等待
+
+    返回:
+        float: 在限流器上等待的秒数
+    """
+    limiter = bucket(endpoint)
+    if limiter is None or cassette.replaying():
+        return 0.0
+    waited = limiter.acquire()
+    _record(endpoint, waited)
+    return waited
+
+
+async def acquire_async(endpoint):
+    """acquire() 的协程版本"""
+    limiter = bucket(endpoint)
+    if limiter is None or cassette.replaying():
+        return 0.0
+    if isinstance(limiter, SharedTokenBucket):
+        # 文件锁可能阻塞，放到线程池中预约
+        delay = await asyncio.to_thread(limiter.reserve)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        waited = delay
+    else:
+        waited = await limiter.acquire_async()
+    _record(endpoint, waited)
+    return waited
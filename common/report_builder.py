@@ -0,0 +1,398 @@
+"""
+测试报告生成（替代 allure generate）
+- 逐个读取 reports/allure-results 中的 *-result.json（不一次性载入全部结果），生成:
+    widgets/summary.json       与 Allure 格式一致，邮件正文（common.email_sender）从这里读取摘要
+    widgets/duration.json      每个用例的耗时和状态
+    widgets/status-chart.json
+    history/history.json       按 historyId 累计的历史状态，格式与 Allure 一致，可以接着 Allure 生成的历史继续累计
+    history/history-trend.json / duration-trend.json / retry-trend.json
+    index.html                 自包含的 HTML 报告（内联样式，无需 JS / 本地服务即可打开）
+    data/attachments/          附件（硬链接，不支持时复制）
+- 增量: data/builder-index.json 记录已处理的结果文件（大小、修改时间）和解析后的摘要，
+  再次生成时只解析新增 / 变化的结果文件，历史也只累计新增的结果
+- 结果目录中保留了多次执行时（见 data/clean_cache.yaml），摘要、widgets、页面和趋势只统计最近一批执行
+  （分批规则与 common.clean_cache 相同），较早的执行只体现在 history.json 中
+- 同一批执行中同一个 historyId 出现多次（重试）时只统计最后一次，其余计入 retry
+- 报告目录中 Allure 生成的其他文件（app.js、plugins 等）会被删除
+
+用法:
+    python -m common.report_builder [结果目录] [报告目录]
+"""
+
+import os
+import sys
+import json
+import html
+import time
+import shutil
+import hashlib
+from datetime import datetime
+
+from common.clean_cache import RUN_GAP
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT_DIR, "reports", "allure-results")
+REPORT_DIR = os.path.join(ROOT_DIR, "reports", "allure-report")
+
+STATUSES = ("failed", "broken", "skipped", "passed", "unknown")
+# 每个用例保留的历史条数 / 趋势保留的构建数
+HISTORY_LIMIT = 20
+# 报告目录中由本模块生成的文件，其余文件在生成时删除
+_OWNED = {
+    "": {"index.html", "widgets", "history", "data"},
+    "widgets": {"summary.json", "duration.json", "status-chart.json", "history-trend.json",
+                "duration-trend.json", "retry-trend.json"},
+    "history": {"history.json", "history-trend.json", "duration-trend.json", "retry-trend.json"},
+    "data": {"attachments", "builder-index.json"},
+}
+_INDEX = os.path.join("data", "builder-index.json")
+
+
+def _uid(value):
+    return hashlib.md5(value.encode("utf-8")).hexdigest()[:16]
+
+
+def _walk_attachments(node, sources):
+    """收集用例及其各级步骤中的附件文件名"""
+    for attachment in node.get("attachments") or []:
+        sources.append(attachment["source"])
+    for step in node.get("steps") or []:
+        _walk_attachments(step, sources)
+    return sources
+
+
+def _parse_result(path):
+    """解析单个 result.json，只保留报告需要的字段"""
+    with open(path, "r", encoding="utf-8") as f:
+        result = json.load(f)
+    labels = {}
+    for label in result.get("labels") or []:
+        labels.setdefault(label["name"], label["value"])
+    start, stop = result.get("start"), result.get("stop")
+    status = result.get("status") if result.get("status") in STATUSES else "unknown"
+    return {
+        "uid": _uid(result.get("uuid") or path),
+        "historyId": result.get("historyId") or result.get("fullName") or result.get("name"),
+        "name": result.get("name", ""),
+        "fullName": result.get("fullName", ""),
+        "status": status,
+        "statusDetails": result.get("statusDetails") or {},
+        "severity": labels.get("severity", "normal"),
+        "feature": labels.get("feature"),
+        "story": labels.get("story"),
+        "suite": labels.get("suite"),
+        "parameters": result.get("parameters") or [],
+        "steps": result.get("steps") or [],
+        "attachments": result.get("attachments") or [],
+        "sources": _walk_attachments(result, []),
+        "time": {"start": start, "stop": stop,
+                 "duration": stop - start if start is not None and stop is not None else None},
+    }
+
+
+def _read_json(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _scan(results_dir, index):
+    """
+    扫描结果目录，只解析新增或变化的结果文件
+
+    返回:
+        (全部结果, 新增的结果, 新的索引)；结果文件按 uuid 命名、写入后不再修改，
+        已处理过的文件即使修改时间变化（复制目录等）也只重新解析，不会再次计入历史
+    """
+    entries = {}
+    fresh = []
+    for entry in os.scandir(results_dir):
+        if not entry.name.endswith("-result.json"):
+            continue
+        stat = entry.stat()
+        cached = index.get(entry.name)
+        if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            entries[entry.name] = cached
+            continue
+        try:
+            record = _parse_result(entry.path)
+        except (OSError, ValueError) as e:
+            print(f"[报告] 跳过无法解析的结果文件 {entry.name}: {e}")
+            continue
+        entries[entry.name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "record": record}
+        if cached is None:
+            fresh.append(record)
+    return [e["record"] for e in entries.values()], fresh, entries
+
+
+def _latest(records):
+    """同一个 historyId 只保留最后一次执行，返回 (用例列表, 重试次数)"""
+    latest = {}
+    for record in records:
+        key = record["historyId"]
+        current = latest.get(key)
+        if current is None or (record["time"]["stop"] or 0) >= (current["time"]["stop"] or 0):
+            latest[key] = record
+    return list(latest.values()), len(records) - len(latest)
+
+
+def _current_run(records, run_gap=RUN_GAP):
+    """最近一批执行的结果: 从最新的用例往前，相邻用例间隔超过 run_gap（秒）即视为更早的执行"""
+    def start(record):
+        return record["time"]["start"] or record["time"]["stop"] or 0
+
+    current, earliest = [], None
+    for record in sorted(records, key=start, reverse=True):
+        stop = record["time"]["stop"] or start(record)
+        if earliest is not None and earliest - stop > run_gap * 1000:
+            break
+        current.append(record)
+        earliest = start(record) if earliest is None else min(earliest, start(record))
+    return current
+
+
+def _statistic(records):
+    statistic = {status: 0 for status in STATUSES}
+    for record in records:
+        statistic[record["status"]] += 1
+    statistic["total"] = len(records)
+    return statistic
+
+
+def _summary(tests):
+    starts = [t["time"]["start"] for t in tests if t["time"]["start"] is not None]
+    stops = [t["time"]["stop"] for t in tests if t["time"]["stop"] is not None]
+    durations = [t["time"]["duration"] for t in tests if t["time"]["duration"] is not None]
+    time_info = {}
+    if starts and stops:
+        time_info = {"start": min(starts), "stop": max(stops), "duration": max(stops) - min(starts)}
+    if durations:
+        time_info.update(minDuration=min(durations), maxDuration=max(durations), sumDuration=sum(durations))
+    return {"reportName": "Allure Report", "testRuns": [], "statistic": _statistic(tests), "time": time_info}
+
+
+def _update_history(report_dir, fresh, summary, report_url):
+    """把新增的结果累计到历史中，返回各用例的历史和趋势"""
+    history_dir = os.path.join(report_dir, "history")
+    history = _read_json(os.path.join(history_dir, "history.json"), {})
+    trends = {name: _read_json(os.path.join(history_dir, f"{name}.json"), [])
+              for name in ("history-trend", "duration-trend", "retry-trend")}
+    if not fresh:
+        return history, trends
+
+    new_tests, retries = _latest(fresh)
+    for test in new_tests:
+        entry = history.setdefault(test["historyId"], {"statistic": _statistic([]), "items": []})
+        entry["statistic"][test["status"]] += 1
+        entry["statistic"]["total"] += 1
+        item = {"uid": test["uid"], "status": test["status"], "time": test["time"]}
+        if test["statusDetails"].get("message"):
+            item["statusDetails"] = test["statusDetails"]["message"][:1000]
+        entry["items"] = ([item] + entry["items"])[:HISTORY_LIMIT]
+
+    build_order = max([t.get("buildOrder", 0) for t in trends["history-trend"]] + [0]) + 1
+    common = {"buildOrder": build_order, "reportName": "Allure Report", "reportUrl": report_url}
+    additions = {
+        "history-trend": summary["statistic"],
+        "duration-trend": {"duration": summary["time"].get("duration", 0)},
+        "retry-trend": {"run": summary["statistic"]["total"], "retry": retries},
+    }
+    for name, data in additions.items():
+        trends[name] = ([dict(common, data=data)] + trends[name])[:HISTORY_LIMIT]
+
+    _write_json(os.path.join(history_dir, "history.json"), history)
+    for name, data in trends.items():
+        _write_json(os.path.join(history_dir, f"{name}.json"), data)
+    return history, trends
+
+
+def _sync_attachments(results_dir, report_dir, tests):
+    """把用例引用的附件链接到 data/attachments，删除不再引用的附件"""
+    target = os.path.join(report_dir, "data", "attachments")
+    os.makedirs(target, exist_ok=True)
+    referenced = {source for test in tests for source in test["sources"]}
+    existing = set(os.listdir(target))
+    for source in referenced - existing:
+        src = os.path.join(results_dir, source)
+        if not os.path.exists(src):
+            continue
+        try:
+            os.link(src, os.path.join(target, source))
+        except OSError:
+            shutil.copy2(src, os.path.join(target, source))
+    for name in existing - referenced:
+        os.remove(os.path.join(target, name))
+
+
+def _prune(report_dir):
+    """删除报告目录中不是本模块生成的文件（Allure 生成的 app.js、plugins、data/test-cases 等）"""
+    for sub, keep in _OWNED.items():
+        directory = os.path.join(report_dir, sub)
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            if entry.name in keep:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+
+
+def _fmt_ms(ms):
+    if ms is None:
+        return "-"
+    return f"{ms / 1000:.2f}s" if ms >= 1000 else f"{ms}ms"
+
+
+def _render_steps(steps):
+    if not steps:
+        return ""
+    items = []
+    for step in steps:
+        status = step.get("status", "unknown")
+        duration = step["stop"] - step["start"] if step.get("start") is not None and step.get("stop") else None
+        items.append(
+            f'<li><span class="dot {html.escape(status)}"></span>{html.escape(step.get("name", ""))}'
+            f' <span class="muted">{_fmt_ms(duration)}</span>'
+            f'{_render_attachments(step.get("attachments"))}{_render_steps(step.get("steps"))}</li>'
+        )
+    return f'<ul class="steps">{"".join(items)}</ul>'
+
+
+def _render_attachments(attachments):
+    if not attachments:
+        return ""
+    links = "".join(
+        f'<a href="data/attachments/{html.escape(a["source"])}">{html.escape(a.get("name") or a["source"])}</a>'
+        for a in attachments
+    )
+    return f'<div class="attachments">{links}</div>'
+
+
+_STYLE = """
+body{font-family:"Microsoft YaHei",Arial,sans-serif;margin:0;background:#f5f5f5;color:#333}
+header{background:#2c3e50;color:#fff;padding:16px 24px}header h1{margin:0;font-size:20px}
+main{max-width:1100px;margin:16px auto;padding:0 16px}
+.card{background:#fff;border-radius:6px;box-shadow:0 1px 4px rgba(0,0,0,.1);padding:16px;margin-bottom:16px}
+.stats{display:flex;gap:24px;flex-wrap:wrap}.stats div{text-align:center}.stats b{display:block;font-size:24px}
+.bar{display:flex;height:10px;border-radius:5px;overflow:hidden;margin-top:12px}
+.passed{color:#27ae60}.failed{color:#e74c3c}.broken{color:#f39c12}.skipped{color:#95a5a6}.unknown{color:#8e44ad}
+.bg-passed{background:#27ae60}.bg-failed{background:#e74c3c}.bg-broken{background:#f39c12}
+.bg-skipped{background:#95a5a6}.bg-unknown{background:#8e44ad}
+.dot{display:inline-block;width:8px;height:8px;border-radius:50%;margin-right:6px;background:currentColor}
+details{border-bottom:1px solid #eee;padding:6px 0}summary{cursor:pointer}
+.muted{color:#999;font-size:12px}.steps{margin:6px 0 6px 8px;padding-left:16px}
+.attachments a{display:inline-block;margin:2px 8px 2px 0;font-size:12px}
+pre{background:#fafafa;border:1px solid #eee;padding:8px;overflow:auto;max-height:300px;font-size:12px}
+table{border-collapse:collapse;width:100%}td,th{border:1px solid #eee;padding:4px 8px;text-align:center;font-size:13px}
+"""
+
+
+def _render_html(summary, tests, trends, history):
+    statistic = summary["statistic"]
+    total = statistic["total"] or 1
+    stats = "".join(f'<div><b class="{s}">{statistic[s]}</b>{s}</div>' for s in STATUSES) + \
+        f'<div><b>{statistic["total"]}</b>total</div><div><b>{_fmt_ms(summary["time"].get("duration"))}</b>duration</div>'
+    bar = "".join(f'<span class="bg-{s}" style="width:{statistic[s] / total * 100:.2f}%"></span>'
+                  for s in STATUSES if statistic[s])
+
+    order = {status: i for i, status in enumerate(STATUSES)}
+    rows = []
+    for test in sorted(tests, key=lambda t: (order[t["status"]], t["time"]["start"] or 0)):
+        details = test["statusDetails"]
+        message = f'<pre>{html.escape(details.get("message", ""))}</pre>' if details.get("message") else ""
+        trace = f'<details><summary class="muted">trace</summary><pre>{html.escape(details["trace"])}</pre></details>' \
+            if details.get("trace") else ""
+        params = ", ".join(f'{html.escape(p["name"])}={html.escape(str(p.get("value")))}' for p in test["parameters"])
+        past = "".join(f'<span class="dot {item["status"]}" title="{item["status"]}"></span>'
+                       for item in history.get(test["historyId"], {}).get("items", [])[1:])
+        rows.append(
+            f'<details><summary><span class="dot {test["status"]}"></span>{html.escape(test["name"])} '
+            f'<span class="muted">{html.escape(test["feature"] or "")} {_fmt_ms(test["time"]["duration"])}</span></summary>'
+            f'<div class="muted">{html.escape(test["fullName"])} {params}</div>'
+            f'{f"<div class=muted>历史: {past}</div>" if past else ""}'
+            f'{message}{trace}{_render_attachments(test["attachments"])}{_render_steps(test["steps"])}</details>'
+        )
+
+    trend_rows = "".join(
+        f'<tr><td>#{t.get("buildOrder", "")}</td>'
+        + "".join(f'<td class="{s}">{t["data"].get(s, 0)}</td>' for s in STATUSES)
+        + f'<td>{t["data"].get("total", 0)}</td></tr>'
+        for t in trends.get("history-trend", [])
+    )
+    trend = f'<div class="card"><h3>趋势</h3><table><tr><th>构建</th>' \
+        f'{"".join(f"<th>{s}</th>" for s in STATUSES)}<th>total</th></tr>{trend_rows}</table></div>' \
+        if trend_rows else ""
+
+    generated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>测试报告</title><style>{_STYLE}</style></head>
+<body><header><h1>API 自动化测试报告</h1><div class="muted">{generated}</div></header>
+<main><div class="card"><div class="stats">{stats}</div><div class="bar">{bar}</div></div>
+{trend}<div class="card"><h3>用例（{statistic["total"]}）</h3>{"".join(rows)}</div></main></body></html>
+"""
+
+
+def build(results_dir=RESULTS_DIR, report_dir=REPORT_DIR, report_url=None):
+    """
+    根据结果目录生成报告（增量）
+
+    参数:
+        results_dir: allure-pytest 输出的结果目录
+        report_dir: 报告目录
+        report_url: 写入趋势数据的报告地址（可选）
+
+    返回:
+        dict: widgets/summary.json 的内容
+    """
+    start = time.perf_counter()
+    if not os.path.isdir(results_dir):
+        raise FileNotFoundError(f"结果目录不存在: {results_dir}")
+    os.makedirs(report_dir, exist_ok=True)
+    _prune(report_dir)
+
+    index_path = os.path.join(report_dir, _INDEX)
+    index = _read_json(index_path, {}).get("results", {})
+    records, fresh, entries = _scan(results_dir, index)
+    tests, _ = _latest(_current_run(records))
+    summary = _summary(tests)
+
+    history, trends = _update_history(report_dir, fresh, summary, report_url)
+    _sync_attachments(results_dir, report_dir, tests)
+
+    widgets = os.path.join(report_dir, "widgets")
+    chart = [{"uid": t["uid"], "name": t["name"], "time": t["time"], "status": t["status"],
+              "severity": t["severity"]} for t in tests]
+    _write_json(os.path.join(widgets, "summary.json"), summary)
+    _write_json(os.path.join(widgets, "duration.json"), chart)
+    _write_json(os.path.join(widgets, "status-chart.json"), chart)
+    for name, data in trends.items():
+        _write_json(os.path.join(widgets, f"{name}.json"), data)
+
+    page = os.path.join(report_dir, "index.html")
+    with open(f"{page}.tmp", "w", encoding="utf-8") as f:
+        f.write(_render_html(summary, tests, trends, history))
+    os.replace(f"{page}.tmp", page)
+    # 索引最后写入: 中途失败时下次会重新处理这些结果
+    _write_json(index_path, {"results": entries})
+
+    statistic = summary["statistic"]
+    print(f"[报告] 已生成: {report_dir}（{statistic['total']} 个用例，新增结果 {len(fresh)} 个，"
+          f"通过 {statistic['passed']}，失败 {statistic['failed']}，异常 {statistic['broken']}，"
+          f"耗时 {(time.perf_counter() - start) * 1000:.0f}ms）")
+    return summary
+
+
+if __name__ == "__main__":
+    build(*sys.argv[1:3])
@@ -0,0 +1,392 @@
+"""
+测试报告后台投递队列
+- enqueue() 把报告目录快照（硬链接，不支持时复制）和一个任务文件写入磁盘上的 spool（reports/outbox），
+  然后启动一个脱离当前进程的 worker，测试进程无需等待打包和 SMTP 上传即可退出
+- worker 同一时间只有一个（文件锁），按 SMTP 服务分组投递到期的任务，同一组任务共用一个 SMTP 连接，
+  收件人较多时按 max_recipients_per_message 分批发送
+- 投递失败按指数退避（带随机抖动）重试，超过 max_attempts 或服务端返回 5xx 永久错误时移到 failed/，
+  可以通过 retry_failed() / python -m common.report_queue retry 重新放回队列
+- 部分收件人被拒绝时，被拒绝的收件人和原因记录在任务的 refused 中，按失败处理: 临时拒绝（4xx）稍后重试，
+  全部为 5xx 时移到 failed/；重试只发送给尚未送达的收件人
+- 任务文件在投递成功后才删除，worker 异常退出、机器重启后下次 enqueue（或手动运行 worker）会继续投递
+
+目录结构:
+    reports/outbox/jobs/<id>.json       待投递的任务
+    reports/outbox/reports/<id>/        报告快照
+    reports/outbox/failed/<id>.json     放弃重试的任务（快照保留）
+    reports/outbox/worker.log           worker 输出
+
+配置见 data/report_delivery.yaml；本地验证可使用 common.mock_smtp
+
+用法:
+    python -m common.report_queue status
+    python -m common.report_queue worker           # 前台运行 worker，投递完毕后退出
+    python -m common.report_queue retry            # 重新投递 failed/ 中的任务
+    python -m common.report_queue send reports/allure-report
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import smtplib
+import argparse
+import subprocess
+
+from common.file_lock import FileLock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_FILE = os.path.join(ROOT_DIR, "data", "report_delivery.yaml")
+SPOOL_DIR = os.path.join(ROOT_DIR, "reports", "outbox")
+
+DEFAULT_CONFIG = {
+    "recipients": [],
+    "smtp_server": "smtp.qq.com",
+    "smtp_port": 465,
+    "ssl": True,
+    "timeout": 60,
+    "max_attempts": 6,
+    "backoff": {"initial": 30, "factor": 2, "max": 1800},
+    "max_recipients_per_message": 50,
+    "spool_dir": None,
+}
+
+# worker 等待下一个任务到期时，单次 sleep 的上限（秒）
+POLL_INTERVAL = 30
+
+
+def load_config(path=CONFIG_FILE):
+    """读取投递配置并与默认配置合并"""
+    from common import config_cache
+
+    config = dict(DEFAULT_CONFIG)
+    if path:
+        config.update(config_cache.load(path) or {})
+    return config
+
+
+def _spool(config):
+    return config.get("spool_dir") or SPOOL_DIR
+
+
+def _dirs(config):
+    spool = _spool(config)
+    return os.path.join(spool, "jobs"), os.path.join(spool, "reports"), os.path.join(spool, "failed")
+
+
+def _write_job(path, job):
+    """原子写入任务文件"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_jobs(directory):
+    jobs = []
+    if not os.path.isdir(directory):
+        return jobs
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            with open(entry.path, "r", encoding="utf-8") as f:
+                jobs.append(json.load(f))
+        except (OSError, ValueError):
+            # 写入中的临时文件或损坏的任务，跳过
+            continue
+    return sorted(jobs, key=lambda job: job["created"])
+
+
+def _link_or_copy(src, dst):
+    """优先硬链接: 重新生成报告时文件会被删除或替换，已链接的快照不受影响"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def enqueue(report_dir, recipients=None, config=None, start=True):
+    """
+    把报告放入投递队列，立即返回
+
+    参数:
+        report_dir: 报告目录（reports/allure-report）
+        recipients: 收件人列表，默认取配置中的 recipients
+        config: 投递配置，默认读取 data/report_delivery.yaml
+        start: 是否启动后台 worker
+
+    返回:
+        str: 任务 ID；报告目录不存在时返回 None
+    """
+    config = load_config() if config is None else config
+    if not os.path.isdir(report_dir):
+        print(f"[报告投递] 错误: 报告目录不存在: {report_dir}")
+        return None
+    recipients = list(recipients or config.get("recipients") or [])
+    if not recipients:
+        print("[报告投递] 错误: 没有配置收件人")
+        return None
+
+    jobs_dir, reports_dir, _ = _dirs(config)
+    os.makedirs(jobs_dir, exist_ok=True)
+    job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    snapshot = os.path.join(reports_dir, job_id)
+    shutil.copytree(report_dir, snapshot, copy_function=_link_or_copy)
+
+    now = time.time()
+    _write_job(os.path.join(jobs_dir, f"{job_id}.json"), {
+        "id": job_id,
+        "created": now,
+        "report_dir": snapshot,
+        "recipients": recipients,
+        "smtp_server": config["smtp_server"],
+        "smtp_port": config["smtp_port"],
+        "ssl": config.get("ssl", True),
+        # 重试策略随任务保存，worker 按任务入队时的配置投递
+        "policy": {key: config[key] for key in ("timeout", "max_attempts", "backoff", "max_recipients_per_message")},
+        "attempts": 0,
+        "next_attempt": now,
+        "last_error": None,
+    })
+    print(f"[报告投递] 已加入队列: {job_id} -> {', '.join(recipients)}")
+    if start:
+        start_worker(config)
+    return job_id
+
+
+def start_worker(config=None):
+    """启动脱离当前进程的后台 worker（已有 worker 运行时，新 worker 拿不到锁会立即退出）"""
+    config = load_config() if config is None else config
+    spool = _spool(config)
+    os.makedirs(spool, exist_ok=True)
+    command = [sys.executable, "-m", "common.report_queue"]
+    if config.get("spool_dir"):
+        command += ["--spool", config["spool_dir"]]
+    command.append("worker")
+
+    kwargs = {}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    env = dict(os.environ, PYTHONUNBUFFERED="1", PYTHONIOENCODING="utf-8")
+    with open(os.path.join(spool, "worker.log"), "ab") as log:
+        process = subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdin=subprocess.DEVNULL, stdout=log,
+                                   stderr=subprocess.STDOUT, close_fds=True, **kwargs)
+    return process.pid
+
+
+def pending(config=None):
+    """待投递的任务列表"""
+    config = load_config() if config is None else config
+    return _read_jobs(_dirs(config)[0])
+
+
+def failed(config=None):
+    """已放弃重试的任务列表"""
+    config = load_config() if config is None else config
+    return _read_jobs(_dirs(config)[2])
+
+
+def retry_failed(config=None, start=True):
+    """把 failed/ 中的任务放回队列（重置重试次数），返回任务数"""
+    config = load_config() if config is None else config
+    jobs_dir, _, failed_dir = _dirs(config)
+    jobs = _read_jobs(failed_dir)
+    for job in jobs:
+        job.update(attempts=0, next_attempt=time.time(), last_error=None)
+        _write_job(os.path.join(jobs_dir, f"{job['id']}.json"), job)
+        os.remove(os.path.join(failed_dir, f"{job['id']}.json"))
+    if jobs and start:
+        start_worker(config)
+    return len(jobs)
+
+
+def _complete(config, job):
+    jobs_dir = _dirs(config)[0]
+    os.remove(os.path.join(jobs_dir, f"{job['id']}.json"))
+    shutil.rmtree(job["report_dir"], ignore_errors=True)
+    print(f"[报告投递] {job['id']} 投递成功（第 {job['attempts'] + 1} 次）")
+
+
+def _fail(config, job, error, permanent=False):
+    """记录一次失败，按退避时间安排重试；超过次数或永久错误时移到 failed/"""
+    jobs_dir, _, failed_dir = _dirs(config)
+    policy = dict(config, **job.get("policy", {}))
+    job["attempts"] += 1
+    job["last_error"] = f"{type(error).__name__}: {error}"
+    path = os.path.join(jobs_dir, f"{job['id']}.json")
+    if permanent or job["attempts"] >= policy["max_attempts"]:
+        os.makedirs(failed_dir, exist_ok=True)
+        _write_job(os.path.join(failed_dir, f"{job['id']}.json"), job)
+        os.remove(path)
+        print(f"[报告投递] {job['id']} 放弃重试（{job['attempts']} 次）: {job['last_error']}")
+        return
+
+    backoff = policy["backoff"]
+    delay = min(backoff["initial"] * backoff["factor"] ** (job["attempts"] - 1), backoff["max"])
+    delay *= random.uniform(0.8, 1.2)
+    job["next_attempt"] = time.time() + delay
+    _write_job(path, job)
+    print(f"[报告投递] {job['id']} 第 {job['attempts']} 次失败（{job['last_error']}），{delay:.1f}s 后重试")
+
+
+def _is_permanent(error):
+    """5xx 响应（收件人 / 发件人被拒、邮件过大等）重试也不会成功"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+def _refused_reasons(refused):
+    """smtplib 的 {收件人: (状态码, 原因)} 转为可以写入任务文件的格式"""
+    return {recipient: [code, reason.decode("utf-8", "replace") if isinstance(reason, bytes) else str(reason)]
+            for recipient, (code, reason) in refused.items()}
+
+
+def _deliver_job(config, server, sender, job):
+    """
+    投递单个任务，收件人按批发送；已送达的收件人记录在 job["delivered"] 中，重试时跳过
+    有收件人被拒绝时记录到 job["refused"]（收件人 -> [状态码, 原因]）并抛出 SMTPRecipientsRefused
+    """
+    from common import email_sender
+
+    if not os.path.isdir(job["report_dir"]):
+        raise FileNotFoundError(f"报告快照不存在: {job['report_dir']}")
+    delivered = job.setdefault("delivered", [])
+    remaining = [r for r in job["recipients"] if r not in delivered]
+    job.pop("refused", None)
+    try:
+        refused = email_sender.deliver_report(server, sender, remaining, job["report_dir"],
+                                              batch_size=job.get("policy", config).get("max_recipients_per_message"),
+                                              on_sent=delivered.extend)
+    except smtplib.SMTPRecipientsRefused as e:
+        job["refused"] = _refused_reasons(e.recipients)
+        raise
+    if refused:
+        job["refused"] = _refused_reasons(refused)
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+
+def _deliver_group(config, jobs):
+    """同一个 SMTP 服务的任务共用一个连接依次投递，连接断开时下一个任务重新连接"""
+    from common import email_sender
+
+    sender = email_sender.sender_credentials()[0]
+    server = None
+    try:
+        for n, job in enumerate(jobs):
+            if server is None:
+                try:
+                    server = email_sender.connect(job["smtp_server"], job["smtp_port"], job["ssl"],
+                                                  job.get("policy", config).get("timeout", 60))
+                except Exception as e:
+                    # 连不上服务时，同组剩余的任务一起按失败处理，不再逐个重连
+                    for rest in jobs[n:]:
+                        _fail(config, rest, e)
+                    return
+            try:
+                _deliver_job(config, server, sender, job)
+            except Exception as e:
+                _fail(config, job, e, isinstance(e, FileNotFoundError) or _is_permanent(e))
+                try:
+                    if isinstance(e, (smtplib.SMTPServerDisconnected, OSError)):
+                        raise smtplib.SMTPServerDisconnected()
+                    server.rset()
+                except (smtplib.SMTPException, OSError):
+                    server.close()
+                    server = None
+            else:
+                _complete(config, job)
+    finally:
+        if server is not None:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                server.close()
+
+
+def _drain(config):
+    """投递到期任务，直到队列为空"""
+    jobs_dir = _dirs(config)[0]
+    while True:
+        jobs = _read_jobs(jobs_dir)
+        if not jobs:
+            return
+        now = time.time()
+        due = [job for job in jobs if job["next_attempt"] <= now]
+        if not due:
+            time.sleep(min(min(job["next_attempt"] for job in jobs) - now, POLL_INTERVAL))
+            continue
+
+        groups = {}
+        for job in due:
+            groups.setdefault((job["smtp_server"], job["smtp_port"], job["ssl"]), []).append(job)
+        for (smtp_server, smtp_port, _), group in groups.items():
+            print(f"[报告投递] 投递 {len(group)} 个任务到 {smtp_server}:{smtp_port}")
+            _deliver_group(config, group)
+
+
+def run_worker(config=None):
+    """
+    在当前进程中运行 worker，队列为空时退出
+
+    返回:
+        bool: 是否运行（已有其他 worker 在运行时返回 False）
+    """
+    config = load_config() if config is None else config
+    lock = FileLock(os.path.join(_spool(config), "worker.lock"))
+    ran = False
+    while lock.acquire(blocking=False):
+        ran = True
+        try:
+            _drain(config)
+        finally:
+            lock.release()
+        # 释放锁之后再检查一次: 释放前刚加入的任务，其 enqueue 启动的 worker 可能因拿不到锁已经退出
+        if not pending(config):
+            break
+    return ran
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="测试报告后台投递队列")
+    parser.add_argument("--config", default=CONFIG_FILE, help="配置文件路径")
+    parser.add_argument("--spool", help="spool 目录，默认 reports/outbox")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("worker", help="运行 worker，投递完毕后退出")
+    sub.add_parser("status", help="查看队列")
+    sub.add_parser("retry", help="重新投递 failed/ 中的任务")
+    send = sub.add_parser("send", help="把报告加入队列")
+    send.add_argument("report_dir")
+    send.add_argument("--to", nargs="+", help="收件人，默认取配置")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if args.spool:
+        config["spool_dir"] = args.spool
+
+    if args.command == "worker":
+        if not run_worker(config):
+            print("[报告投递] 已有 worker 在运行")
+    elif args.command == "status":
+        for title, jobs in (("待投递", pending(config)), ("已放弃", failed(config))):
+            print(f"{title}: {len(jobs)}")
+            for job in jobs:
+                print(f"  {job['id']}  尝试 {job['attempts']} 次  {job['last_error'] or ''}")
+                for recipient, (code, reason) in (job.get("refused") or {}).items():
+                    print(f"    被拒绝: {recipient}  {code} {reason}")
+    elif args.command == "retry":
+        print(f"[报告投递] 重新加入队列: {retry_failed(config)} 个任务")
+    else:
+        enqueue(args.report_dir, args.to, config)
+
+
+if __name__ == "__main__":
+    main()
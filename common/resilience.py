@@ -0,0 +1,428 @@
+"""
+接口调用的超时 / 重试 / 熔断策略
+- 超时: 每个请求都带连接超时和读取超时，避免一个卡住的请求永久占住线程池 worker
+- 重试: 只对瞬时故障重试（连接失败、连接被重置、读取超时、5xx 等），退避时间使用 decorrelated jitter:
+    sleep = min(cap, uniform(base, 上一次 sleep * 3))
+  响应带 Retry-After 时按其等待（不超过 cap）
+- 幂等: GET 等幂等方法可重试全部瞬时故障；非幂等请求（POST）只在请求确定没有发出（连接建立失败）时重试，
+  接口在配置中标记 idempotent: true 后按幂等处理
+- 重试预算: 滑动窗口内重试次数不超过 请求数 × ratio（至少 min_retries 次），避免故障时重试放大流量
+- 熔断: 按 接口 + 地址前缀 统计连续失败，达到阈值后打开，open_seconds 内直接抛出 CircuitOpenError；
+  之后进入半开状态放行少量探测请求，成功则关闭，失败则重新打开
+- 每次重试、预算耗尽、熔断状态变化和被熔断拒绝的请求都计入 common.metrics 的计数器:
+    retry.<接口>、retry.<接口>.budget_exhausted、breaker.<接口>.<open|half_open|closed>、breaker.<接口>.rejected
+
+配置见 data/resilience.yaml
+"""
+
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+
+from common import metrics
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "resilience.yaml")
+
+DEFAULT_CONFIG = {
+    "connect_timeout": 5,
+    "read_timeout": 60,
+    "retry": {
+        "max_attempts": 3,
+        "base": 0.2,
+        "cap": 5,
+        "retry_on_status": [500, 502, 503, 504],
+    },
+    "retry_budget": {
+        "ratio": 0.2,
+        "min_retries": 10,
+        "window": 10,
+    },
+    "breaker": {
+        "failure_threshold": 5,
+        "open_seconds": 30,
+        "half_open_max": 1,
+    },
+    "endpoints": {},
+}
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_lock = threading.Lock()
+_config = None
+_policies = {}  # (接口, 地址前缀) -> Policy
+_budget = None
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断打开期间直接拒绝的请求"""
+
+
+class RetryableStatus(Exception):
+    """需要重试的响应状态码，仅在内部流转"""
+
+    def __init__(self, response):
+        super().__init__(f"HTTP {response_status(response)}")
+        self.response = response
+
+
+def response_status(response):
+    """requests.Response 与 AsyncResponse 的状态码"""
+    return getattr(response, "status_code", None)
+
+
+def is_connect_error(exc):
+    """请求是否确定没有发出（连接建立阶段失败），这类错误对非幂等请求也可以安全重试"""
+    import requests
+    from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        reason = getattr(exc.args[0], "reason", None) if exc.args else None
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+    try:
+        import aiohttp
+    except ImportError:
+        return False
+    return isinstance(exc, aiohttp.ClientConnectorError)
+
+
+def is_transient(exc):
+    """是否为瞬时故障（超时、连接错误），其他异常（如参数错误）不重试"""
+    import requests
+
+    if isinstance(exc, (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                        asyncio.TimeoutError, ConnectionError)):
+        return True
+    try:
+        import aiohttp
+    except ImportError:
+        return False
+    return isinstance(exc, (aiohttp.ClientConnectionError, aiohttp.ServerTimeoutError))
+
+
+class RetryBudget:
+    """
+    滑动窗口重试预算，线程安全
+
+    参数:
+        ratio: 允许的重试次数占请求数的比例
+        min_retries: 窗口内至少允许的重试次数（请求量很小时不至于完全不能重试）
+        window: 窗口长度（秒）
+    """
+
+    def __init__(self, ratio=0.2, min_retries=10, window=10):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._lock = threading.Lock()
+        self._requests = deque()
+        self._retries = deque()
+
+    def _trim(self, now):
+        for q in (self._requests, self._retries):
+            while q and now - q[0] > self.window:
+                q.popleft()
+
+    def on_request(self):
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_retry(self):
+        """预算充足时记一次重试并返回 True"""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            if len(self._retries) >= max(self.min_retries, len(self._requests) * self.ratio):
+                return False
+            self._retries.append(now)
+            return True
+
+
+class CircuitBreaker:
+    """
+    熔断器，线程安全
+
+    参数:
+        name: 接口名称，用于计数器命名
+        failure_threshold: 连续失败多少次后打开
+        open_seconds: 打开状态持续的时间（秒）
+        half_open_max: 半开状态下同时放行的探测请求数
+    """
+
+    def __init__(self, name, failure_threshold=5, open_seconds=30, half_open_max=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max = half_open_max
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+
+    def _transition(self, state):
+        """切换状态，调用方持有锁"""
+        self.state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        self._trials = 0
+        metrics.incr(f"breaker.{self.name}.{state}")
+        print(f"[熔断] {self.name} -> {state}")
+
+    def before_request(self):
+        """请求前调用，熔断打开时抛出 CircuitOpenError"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+            if self.state == OPEN or (self.state == HALF_OPEN and self._trials >= self.half_open_max):
+                metrics.incr(f"breaker.{self.name}.rejected")
+                raise CircuitOpenError(f"{self.name} 接口熔断中，{self.open_seconds}s 内快速失败")
+            if self.state == HALF_OPEN:
+                self._trials += 1
+
+    def on_success(self):
+        with self._lock:
+            self._failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def on_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.failure_threshold):
+                self._transition(OPEN)
+
+
+class Policy:
+    """
+    单个接口的超时 / 重试 / 熔断策略
+
+    参数:
+        name: 接口名称
+        config: 合并了默认配置和接口配置的字典
+        budget: 共用的 RetryBudget
+    """
+
+    def __init__(self, name, config, budget):
+        self.name = name
+        self.connect_timeout = config["connect_timeout"]
+        self.read_timeout = config["read_timeout"]
+        self.idempotent = config.get("idempotent")
+        retry = config["retry"]
+        self.max_attempts = max(int(retry["max_attempts"]), 1)
+        self.base = retry["base"]
+        self.cap = retry["cap"]
+        self.retry_on_status = frozenset(retry.get("retry_on_status") or ())
+        self.budget = budget
+        self.breaker = CircuitBreaker(name, **config["breaker"]) if config["breaker"] else None
+        self._rng = random.Random()
+        self._rng_lock = threading.Lock()
+
+    def is_idempotent(self, method):
+        if self.idempotent is not None:
+            return bool(self.idempotent)
+        return method.upper() in IDEMPOTENT_METHODS
+
+    def backoff(self, previous):
+        """decorrelated jitter"""
+        with self._rng_lock:
+            return min(self.cap, self._rng.uniform(self.base, max(previous, self.base) * 3))
+
+    def _retry_delay(self, error, method, attempt, previous):
+        """
+        判断是否重试
+
+        返回:
+            float: 重试前等待的秒数；不重试返回 None
+        """
+        if attempt >= self.max_attempts:
+            return None
+        if isinstance(error, RetryableStatus):
+            if not self.is_idempotent(method):
+                return None
+        elif not is_transient(error) or (not self.is_idempotent(method) and not is_connect_error(error)):
+            return None
+        if not self.budget.try_retry():
+            metrics.incr(f"retry.{self.name}.budget_exhausted")
+            return None
+        metrics.incr(f"retry.{self.name}")
+        delay = self.backoff(previous)
+        retry_after = getattr(getattr(error, "response", None), "headers", {}).get("Retry-After")
+        if retry_after:
+            try:
+                delay = min(float(retry_after), self.cap)
+            except ValueError:
+                pass
+        print(f"[重试] {self.name} 第 {attempt} 次失败（{error}），{delay:.2f}s 后重试")
+        return delay
+
+    def _check(self, response):
+        """5xx 等可重试状态视为失败"""
+        if response_status(response) in self.retry_on_status:
+            raise RetryableStatus(response)
+        return response
+
+    def _succeeded(self):
+        if self.breaker is not None:
+            self.breaker.on_success()
+
+    def _failed(self, error):
+        if self.breaker is None:
+            return
+        if isinstance(error, RetryableStatus) or is_transient(error):
+            self.breaker.on_failure()
+        else:
+            # 非网络类异常说明后端可达，不计入熔断
+            self.breaker.on_success()
+
+    def call(self, method, send):
+        """
+        执行一次带重试的调用
+
+        参数:
+            method: 请求方法，用于判断是否幂等
+            send: 无参函数，发送一次请求并返回响应
+
+        返回:
+            最后一次的响应；重试用尽时，可重试状态码的响应原样返回，异常原样抛出
+        """
+        delay = 0.0
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.breaker is not None:
+                self.breaker.before_request()
+            self.budget.on_request()
+            try:
+                response = self._check(send())
+            except Exception as e:
+                self._failed(e)
+                delay = self._retry_delay(e, method, attempt, delay)
+                if delay is None:
+                    if isinstance(e, RetryableStatus):
+                        return e.response
+                    raise
+                time.sleep(delay)
+                continue
+            self._succeeded()
+            return response
+
+    async def call_async(self, method, send):
+        """call() 的协程版本，send 为无参协程函数"""
+        delay = 0.0
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.breaker is not None:
+                self.breaker.before_request()
+            self.budget.on_request()
+            try:
+                response = self._check(await send())
+            except Exception as e:
+                self._failed(e)
+                delay = self._retry_delay(e, method, attempt, delay)
+                if delay is None:
+                    if isinstance(e, RetryableStatus):
+                        return e.response
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self._succeeded()
+            return response
+
+
+def _merge(base, override):
+    merged = dict(base)
+    for key, value in (override or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_config(path=CONFIG_FILE):
+    """读取配置文件并与默认配置合并；文件不存在时使用默认配置"""
+    from common import config_cache
+
+    config = DEFAULT_CONFIG
+    if path:
+        config = _merge(config, config_cache.load(path) or {})
+    return config
+
+
+def configure(config=None, **overrides):
+    """
+    替换当前配置，已创建的熔断器、重试预算会被丢弃
+
+    参数:
+        config: 完整配置（与默认配置合并），为 None 时重新读取 data/resilience.yaml
+        overrides: 覆盖个别配置项，如 configure(read_timeout=5)
+    """
+    global _config, _budget
+    base = load_config() if config is None else _merge(DEFAULT_CONFIG, config)
+    with _lock:
+        _config = _merge(base, overrides)
+        _policies.clear()
+        _budget = None
+
+
+def _current():
+    global _config, _budget
+    if _config is None or _budget is None:
+        with _lock:
+            if _config is None:
+                _config = load_config()
+            if _budget is None:
+                _budget = RetryBudget(**_config["retry_budget"])
+    return _config, _budget
+
+
+def policy(endpoint):
+    """返回接口的策略；未命名的请求只设置超时，不重试、不熔断"""
+    from common import http_client
+
+    config, budget = _current()
+    key = (endpoint, http_client.base_url())
+    p = _policies.get(key)
+    if p is None:
+        with _lock:
+            p = _policies.get(key)
+            if p is None:
+                merged = _merge({k: v for k, v in config.items() if k != "endpoints"},
+                                config["endpoints"].get(endpoint) or {})
+                if endpoint is None:
+                    merged["retry"] = dict(merged["retry"], max_attempts=1)
+                    merged["breaker"] = None
+                p = _policies[key] = Policy(endpoint or "default", merged, budget)
+    return p
+
+
+def timeout(endpoint):
+    """requests 使用的 (连接超时, 读取超时)"""
+    p = policy(endpoint)
+    return p.connect_timeout, p.read_timeout
+
+
+def aiohttp_timeout(endpoint):
+    """aiohttp 使用的 ClientTimeout"""
+    import aiohttp
+
+    p = policy(endpoint)
+    return aiohttp.ClientTimeout(sock_connect=p.connect_timeout, sock_read=p.read_timeout)
+
+
+def breaker_states():
+    """各接口熔断器的当前状态，{接口: 状态}"""
+    with _lock:
+        return {p.name: p.breaker.state for p in _policies.values() if p.breaker is not None}
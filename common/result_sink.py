@@ -0,0 +1,177 @@
+"""
+流式结果输出
+- 每轮请求、每个对话结束时各写一行 JSON 到 reports/requests.jsonl
+- 自适应并发（common.aimd）的上限变化也写入同一个文件（type=limit），便于与延迟对照
+- 写文件由后台线程完成，调用方只做入队，不阻塞压测
+- 文件超过大小上限时自动轮转（requests.jsonl.1、.2 ...）
+- 定时 flush，进程退出时自动 flush 并关闭
+- 汇总信息增量计算，内存占用与运行时长无关
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+
+from common.metrics import LatencyHistogram
+
+REPORTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reports")
+DEFAULT_PATH = os.path.join(REPORTS_DIR, "requests.jsonl")
+
+# 单个文件大小上限（字节），超过后轮转
+MAX_BYTES = 50 * 1024 * 1024
+# 保留的历史文件个数
+BACKUP_COUNT = 5
+# flush 间隔（秒）
+FLUSH_INTERVAL = 1.0
+# 汇总中保留的错误信息种类上限
+MAX_ERROR_KINDS = 20
+
+_STOP = object()
+
+
+class ResultSink:
+    """
+    结果流式写入器
+
+    用法:
+        sink = ResultSink()
+        run_conversations(..., on_turn=sink.on_turn, on_result=sink.on_result)
+        sink.close()
+        sink.summary()
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT,
+                 flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self.conversations = 0
+        self.success = 0
+        self.failed = 0
+        self.turns = 0
+        self.turn_errors = 0
+        self.errors = {}
+        self.duration = LatencyHistogram()
+        self.turn_latency = LatencyHistogram()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="result-sink", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def on_turn(self, record):
+        """每轮请求结束时调用（对话执行器的 on_turn 回调）"""
+        latency = record["received"] - record["sent"]
+        with self._lock:
+            self.turns += 1
+            if record.get("error"):
+                self.turn_errors += 1
+        self.turn_latency.record(latency)
+        self._queue.put({
+            "type": "turn",
+            "ts": time.time(),
+            "conversation_id": record["conversation_id"],
+            "turn": record["turn"],
+            "latency_ms": round(latency * 1000, 3),
+            "queued_ms": round((record["sent"] - record["intended"]) * 1000, 3),
+            "request_bytes": record.get("request_bytes", 0),
+            "response_bytes": record.get("response_bytes", 0),
+            "error": record.get("error"),
+            "timing": record.get("timing"),
+        })
+
+    def on_result(self, result):
+        """每个对话结束时调用（对话执行器的 on_result 回调）"""
+        with self._lock:
+            self.conversations += 1
+            if result['success']:
+                self.success += 1
+            else:
+                self.failed += 1
+                error = result.get('error') or ''
+                if error in self.errors or len(self.errors) < MAX_ERROR_KINDS:
+                    self.errors[error] = self.errors.get(error, 0) + 1
+        self.duration.record(result.get('duration', 0))
+        self._queue.put(dict(result, type="conversation", ts=time.time()))
+
+    def on_limit(self, point):
+        """并发上限变化时调用（AIMDLimiter 的 on_change 回调）"""
+        self._queue.put(dict(point, type="limit"))
+
+    def summary(self):
+        """当前的汇总信息"""
+        with self._lock:
+            return {
+                "conversations": self.conversations,
+                "success": self.success,
+                "failed": self.failed,
+                "turns": self.turns,
+                "turn_errors": self.turn_errors,
+                "errors": dict(self.errors),
+                "conversation_duration_ms": self.duration.summary(),
+                "turn_latency_ms": self.turn_latency.summary(),
+                "path": self.path,
+            }
+
+    def close(self):
+        """写完队列中剩余的记录并关闭文件"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def _open(self):
+        return open(self.path, "ab")
+
+    def _rotate(self, f):
+        f.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        return self._open()
+
+    def _run(self):
+        f = self._open()
+        size = f.tell()
+        last_flush = time.monotonic()
+        try:
+            while True:
+                timeout = max(self.flush_interval - (time.monotonic() - last_flush), 0.01)
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is _STOP:
+                    break
+                if item is not None:
+                    line = (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8")
+                    f.write(line)
+                    size += len(line)
+                    if size >= self.max_bytes:
+                        f = self._rotate(f)
+                        size = 0
+
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    f.flush()
+                    last_flush = time.monotonic()
+        finally:
+            f.flush()
+            f.close()
@@ -0,0 +1,271 @@
+"""
+登录 token 缓存
+- 按 账号 + 接口地址 缓存 accessToken，同时保存在内存和磁盘文件（.cache/tokens.json，文件锁保护）
+- 根据登录返回的 expiresIn 计算过期时间，预留安全余量
+- 过期前在后台自动刷新，刷新时间带随机抖动，同时登录的多个账号（common.account_pool）不会在同一时刻集中刷新
+- 接口返回 401 时可通过 relogin() 重新登录一次
+- 刷新 / 重新登录时使用缓存键中的接口地址，切换地址后后台刷新不会把另一个环境的 token 存到这个键下
+- 本机地址（mock 服务，端口每次不同）的 token 只保存在内存中，写磁盘时顺带清理已过期和本机地址的旧条目
+- 回放录制（CASSETTE_MODE=replay，见 common.cassette）时不登录，直接返回占位 token；
+  token 不参与请求指纹，干净的环境（CI）也能离线回放
+"""
+
+import os
+import json
+import time
+import random
+import threading
+
+from api.login import login
+from common import cassette
+from common import http_client
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache")
+CACHE_FILE = os.path.join(CACHE_DIR, "tokens.json")
+
+# token 剩余有效期小于该值时视为已过期（秒）
+SAFETY_MARGIN = 60
+# 剩余有效期小于该值时后台刷新（秒）
+REFRESH_BEFORE = 300
+# 登录响应中没有 expiresIn 时使用的默认有效期（秒）
+DEFAULT_EXPIRES_IN = 1800
+# 刷新时间的随机提前比例，错开多个账号的刷新
+REFRESH_JITTER = 0.1
+# 回放录制时返回的占位 token 前缀
+REPLAY_TOKEN_PREFIX = "cassette-replay-"
+
+_lock = threading.RLock()
+_key_locks = {}
+_tokens = {}       # key -> {"token": ..., "expires_at": ...}
+_credentials = {}  # key -> (account, password, base_url)，仅保存在内存中，用于刷新
+_aliases = {}      # token -> key，旧 token 也保留映射，方便对话中途换新 token
+_timers = {}       # key -> threading.Timer
+
+
+def _cache_key(account, base_url=None):
+    """缓存键: 账号@接口地址，切换到 mock 服务时不会拿到线上的 token"""
+    return f"{account}@{base_url or http_client.base_url()}"
+
+
+def _base_url(key):
+    return key.rsplit("@", 1)[1]
+
+
+def _key_lock(key):
+    with _lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def _is_valid(entry, now=None):
+    now = time.time() if now is None else now
+    return entry is not None and entry["expires_at"] - SAFETY_MARGIN > now
+
+
+def _read_disk():
+    """读取磁盘缓存，文件不存在或损坏时返回空字典"""
+    try:
+        with open(CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _keep_on_disk(key, entry, now):
+    """磁盘缓存中只保留未过期、非本机地址的条目"""
+    return "@" in key and not http_client.is_loopback(_base_url(key)) and entry.get("expires_at", 0) > now
+
+
+def _dump(data):
+    tmp_path = f"{CACHE_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, CACHE_FILE)
+
+
+def _write_disk(key, entry):
+    """将单个账号的 token 写回磁盘缓存，同时清理已过期和本机地址的条目"""
+    from common.file_lock import FileLock
+
+    if http_client.is_loopback(_base_url(key)):
+        return
+    now = time.time()
+    with FileLock(CACHE_FILE + ".lock"):
+        data = {k: v for k, v in _read_disk().items() if _keep_on_disk(k, v, now)}
+        data[key] = entry
+        _dump(data)
+
+
+def prune_disk(dry_run=False):
+    """
+    清理磁盘缓存中已过期和本机地址（mock 服务）的条目
+
+    返回:
+        int: 清理的条目数
+    """
+    from common.file_lock import FileLock
+
+    if not os.path.exists(CACHE_FILE):
+        return 0
+    now = time.time()
+    with FileLock(CACHE_FILE + ".lock"):
+        data = _read_disk()
+        kept = {k: v for k, v in data.items() if _keep_on_disk(k, v, now)}
+        if not dry_run and len(kept) != len(data):
+            _dump(kept)
+    return len(data) - len(kept)
+
+
+def _load_from_disk(key):
+    from common.file_lock import FileLock
+
+    if http_client.is_loopback(_base_url(key)):
+        return None
+    with FileLock(CACHE_FILE + ".lock"):
+        entry = _read_disk().get(key)
+    if entry and "token" in entry and "expires_at" in entry:
+        return entry
+    return None
+
+
+def _store(key, entry):
+    with _lock:
+        _tokens[key] = entry
+        _aliases[entry["token"]] = key
+    _schedule_refresh(key, entry)
+
+
+def _schedule_refresh(key, entry):
+    """在 token 过期前安排一次后台刷新"""
+    lifetime = entry["expires_at"] - time.time()
+    if lifetime <= 0:
+        return
+    if lifetime > REFRESH_BEFORE:
+        delay = lifetime - REFRESH_BEFORE
+    else:
+        # 有效期很短时按 80% 有效期刷新，避免刷新过于频繁
+        delay = lifetime * 0.8
+    delay *= 1 - random.uniform(0, REFRESH_JITTER)
+
+    with _lock:
+        old_timer = _timers.pop(key, None)
+        if old_timer is not None:
+            old_timer.cancel()
+        if key not in _credentials:
+            return
+        timer = threading.Timer(delay, _background_refresh, args=(key,))
+        timer.daemon = True
+        _timers[key] = timer
+    timer.start()
+
+
+def _background_refresh(key):
+    try:
+        _login(key)
+    except Exception as e:
+        print(f"[token] 后台刷新失败 ({key}): {e}")
+
+
+def _login(key):
+    """调用登录接口并缓存结果，登录地址为缓存键中的接口地址"""
+    account, password, base_url = _credentials[key]
+    result = login(account, password, base_url=base_url).json()
+    data = result['data']
+    entry = {
+        "token": data['accessToken'],
+        "expires_at": time.time() + float(data.get('expiresIn') or DEFAULT_EXPIRES_IN),
+    }
+    _store(key, entry)
+    _write_disk(key, entry)
+    return entry["token"]
+
+
+def get_token(account, password):
+    """
+    获取账号的 accessToken，优先使用缓存
+
+    参数:
+        account: 账号
+        password: 密码
+
+    返回:
+        str: accessToken；回放录制时为占位 token
+    """
+    if cassette.replaying():
+        return REPLAY_TOKEN_PREFIX + account
+
+    base_url = http_client.base_url()
+    key = _cache_key(account, base_url)
+    with _lock:
+        _credentials[key] = (account, password, base_url)
+        entry = _tokens.get(key)
+    if _is_valid(entry):
+        return entry["token"]
+
+    with _key_lock(key):
+        # 拿到锁后再检查一次，其他线程可能已经登录过了
+        with _lock:
+            entry = _tokens.get(key)
+        if _is_valid(entry):
+            return entry["token"]
+
+        entry = _load_from_disk(key)
+        if _is_valid(entry):
+            _store(key, entry)
+            return entry["token"]
+
+        return _login(key)
+
+
+def cached_token(account):
+    """内存中该账号（当前接口地址）未过期的 token，没有时返回 None；不登录、不读磁盘，可以在事件循环中调用"""
+    if cassette.replaying():
+        return REPLAY_TOKEN_PREFIX + account
+    with _lock:
+        entry = _tokens.get(_cache_key(account))
+    return entry["token"] if _is_valid(entry) else None
+
+
+def resolve(token):
+    """返回 token 对应账号当前最新的 token；未知 token 原样返回"""
+    with _lock:
+        key = _aliases.get(token)
+        entry = _tokens.get(key) if key is not None else None
+    if entry is not None and _is_valid(entry):
+        return entry["token"]
+    return token
+
+
+def relogin(token):
+    """
+    token 失效（接口返回 401）时重新登录
+
+    参数:
+        token: 失效的 token
+
+    返回:
+        str: 新 token；无法确定所属账号时返回 None
+    """
+    with _lock:
+        key = _aliases.get(token)
+    if key is None or key not in _credentials:
+        return None
+
+    with _key_lock(key):
+        with _lock:
+            entry = _tokens.get(key)
+        # 其他线程已经换过 token 了，直接使用
+        if entry is not None and entry["token"] != token and _is_valid(entry):
+            return entry["token"]
+        print(f"[token] {key} 的 token 已失效，重新登录")
+        return _login(key)
+
+
+def invalidate(account=None):
+    """清除内存中的缓存（account 为空时清除全部），磁盘缓存保持不变"""
+    with _lock:
+        keys = [_cache_key(account)] if account is not None else list(_tokens)
+        for key in keys:
+            _tokens.pop(key, None)
+            timer = _timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
@@ -1,13 +1,13 @@
-from api.login import login
+from common import http_client
+from common import token_cache
 
 DEFAULT_ACCOUNT = "zhaowenlong"
 DEFAULT_PASSWORD = "init@2234"
 
 
 def get_token(account=DEFAULT_ACCOUNT, password=DEFAULT_PASSWORD):
-    """登录并返回 accessToken"""
-    result = login(account, password).json()
-    return result['data']['accessToken']
+    """返回 accessToken，同一账号的 token 会被缓存直到接近过期"""
+    return token_cache.get_token(account, password)
 
 
 def get_headers(token):
@@ -18,6 +18,38 @@ def get_headers(token):
     }
 
 
+def is_unauthorized(response):
+    """判断响应是否为 token 失效（HTTP 401 或业务 code 401）"""
+    if response.status_code == 401:
+        return True
+    try:
+        return response.json().get('code') == 401
+    except (ValueError, AttributeError):
+        return False
+
+
+def request_with_token(method, url, token, **kwargs):
+    """
+    携带 token 发送请求，token 失效时自动重新登录并重试一次
+
+    参数:
+        method: 请求方法
+        url: 请求地址
+        token: 登录 token
+        **kwargs: 其他传给 http_client.request 的参数
+
+    返回:
+        响应对象
+    """
+    token = token_cache.resolve(token)
+    response = http_client.request(method, url, headers=get_headers(token), **kwargs)
+    if is_unauthorized(response):
+        new_token = token_cache.relogin(token)
+        if new_token:
+            response = http_client.request(method, url, headers=get_headers(new_token), **kwargs)
+    return response
+
+
 def get_product_for_chat(token, shop_id="585", index=0):
     """
     便捷方法：获取指定店铺的商品，直接返回可传给 chat 的 inquiry_product 格式
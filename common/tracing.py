@@ -0,0 +1,391 @@
+"""
+轻量链路追踪
+- 每个对话是一条 trace，每轮对话是一个 span，其下再细分 商品查询 / 请求序列化 / 网络请求 / 回复解析 等子 span
+- 网络请求 span 带上请求体中的 request_id、HTTP 状态码和分阶段耗时，并通过 traceparent 请求头传给服务端，
+  后端可以按 request_id 或 trace_id 对照自己的日志；traceparent 的 sampled 标志与本地采样结果一致
+- 当前 span 保存在 contextvars 中，asyncio 任务自动继承；线程池中使用 wrap() 传递
+- 采样:
+    sample_rate:          trace 开始时按比例采样（head sampling）
+    keep_errors:          未采样的 trace 中出现错误时仍然保留，默认关闭
+    keep_slower_than_ms:  未采样的 trace 根 span 耗时超过该值时仍然保留
+  后两项都关闭时，未采样的 trace 不创建 span，开销接近 0；启用任一项时，未采样的 trace 也会完整创建 span
+  并缓存在内存中，根 span 结束时再决定是否导出，调低 sample_rate 只减少导出量，不减少创建 span 的开销
+- 导出: 后台线程批量写入 reports/traces.jsonl，每行是一个 OTLP/JSON 格式的 ExportTraceServiceRequest，
+  可直接被 OpenTelemetry Collector 的 otlpjsonfile receiver 读取；队列满时丢弃并计入 tracing.dropped
+
+配置见 data/tracing.yaml，环境变量 TRACE_SAMPLE_RATE 可覆盖采样比例
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from common import metrics
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "tracing.yaml")
+REPORTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reports")
+DEFAULT_PATH = os.path.join(REPORTS_DIR, "traces.jsonl")
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    "sample_rate": 1.0,
+    "keep_errors": False,
+    "keep_slower_than_ms": None,
+    "service_name": "zhiyan-autotest",
+    "path": None,
+    "batch_size": 512,
+    "flush_interval": 2.0,
+    "max_queue": 10000,
+}
+
+# OTLP SpanKind
+INTERNAL = 1
+CLIENT = 3
+# OTLP StatusCode
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current = contextvars.ContextVar("tracing_span", default=None)
+_lock = threading.Lock()
+_config = None
+_exporter = None
+_rng = random.Random()
+
+
+class _Trace:
+    """一条 trace 的共享状态"""
+
+    __slots__ = ("trace_id", "sampled", "spans", "error", "lock")
+
+    def __init__(self, trace_id, sampled):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans = []
+        self.error = False
+        self.lock = threading.Lock()
+
+
+class Span:
+    """
+    一个 span，通过 span() 上下文管理器创建
+
+    属性:
+        trace_id / span_id: 十六进制字符串
+        attributes: 属性字典
+    """
+
+    recording = True
+
+    def __init__(self, name, trace, parent_id=None, kind=INTERNAL, attributes=None):
+        self.name = name
+        self.trace = trace
+        self.trace_id = trace.trace_id
+        self.span_id = f"{_rng.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = {k: v for k, v in (attributes or {}).items() if v is not None}
+        self.status = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def record_error(self, error):
+        """标记为失败，error 为异常或错误信息"""
+        message = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+        self.status = (STATUS_ERROR, message[:500])
+        self.trace.error = True
+
+    def traceparent(self):
+        """W3C traceparent 请求头，未采样（仅为 keep_errors / keep_slower_than_ms 缓存）的 trace 标志为 00"""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.trace.sampled else '00'}"
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        with self.trace.lock:
+            self.trace.spans.append(self)
+        if self.parent_id is None:
+            _finish_trace(self)
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": self.status[0], "message": self.status[1]} if self.status else {"code": STATUS_OK},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """未采样时使用，所有操作都是空操作"""
+
+    recording = False
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def traceparent(self):
+        return None
+
+
+NOOP = _NoopSpan()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def load_config(path=CONFIG_FILE):
+    """读取配置文件并与默认配置合并；环境变量 TRACE_SAMPLE_RATE 覆盖采样比例"""
+    from common import config_cache
+
+    config = dict(DEFAULT_CONFIG)
+    if path:
+        config.update(config_cache.load(path) or {})
+    if os.environ.get("TRACE_SAMPLE_RATE"):
+        config["sample_rate"] = float(os.environ["TRACE_SAMPLE_RATE"])
+    return config
+
+
+def configure(**overrides):
+    """修改配置（enabled / sample_rate / keep_errors / keep_slower_than_ms / path ...），先导出已缓存的 span"""
+    global _config, _exporter
+    with _lock:
+        config = dict(_config if _config is not None else load_config())
+        config.update(overrides)
+        _config = config
+        exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.close()
+
+
+def _get_config():
+    global _config
+    config = _config
+    if config is None:
+        with _lock:
+            if _config is None:
+                _config = load_config()
+            config = _config
+    return config
+
+
+def _start_trace(name, kind, attributes):
+    config = _get_config()
+    if not config.get("enabled"):
+        return NOOP
+    sampled = _rng.random() < config.get("sample_rate", 1.0)
+    if not sampled and not config.get("keep_errors") and not config.get("keep_slower_than_ms"):
+        return NOOP
+    return Span(name, _Trace(f"{_rng.getrandbits(128):032x}", sampled), None, kind, attributes)
+
+
+def _finish_trace(root):
+    trace = root.trace
+    if not trace.sampled:
+        config = _get_config()
+        slow = config.get("keep_slower_than_ms")
+        keep = (config.get("keep_errors") and trace.error) or \
+            (slow is not None and (root.end_ns - root.start_ns) / 1e6 > slow)
+        if not keep:
+            return
+    with trace.lock:
+        spans, trace.spans = trace.spans, []
+    _get_exporter().submit(spans)
+
+
+@contextmanager
+def span(name, kind=INTERNAL, attributes=None):
+    """
+    创建一个 span，当前没有 span 时开始一条新的 trace；with 块内抛出的异常会记录到 span 上
+
+    用法:
+        with tracing.span("turn", attributes={"turn": 1}) as s:
+            s.set_attribute("request_id", ...)
+    """
+    parent = _current.get()
+    if parent is None:
+        current = _start_trace(name, kind, attributes)
+    elif not parent.recording:
+        current = NOOP
+    else:
+        current = Span(name, parent.trace, parent.span_id, kind, attributes)
+
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_error(e)
+        raise
+    finally:
+        _current.reset(token)
+        if current.recording:
+            current.end()
+
+
+def http_span(method, url, endpoint=None, request_id=None):
+    """网络请求 span"""
+    from urllib.parse import urlsplit
+
+    return span(f"{method} {endpoint or urlsplit(url).path}", CLIENT, {
+        "http.method": method,
+        "http.url": url,
+        "endpoint": endpoint,
+        "request_id": request_id,
+    })
+
+
+def annotate_response(current, status_code, timing=None):
+    """在网络请求 span 上记录状态码和分阶段耗时（毫秒），5xx 标记为失败"""
+    if not current.recording:
+        return
+    current.set_attribute("http.status_code", status_code)
+    for phase, value in (timing or {}).items():
+        if isinstance(value, float):
+            current.set_attribute(f"http.{phase}_ms", value)
+    if status_code >= 500:
+        current.record_error(f"HTTP {status_code}")
+
+
+def current_span():
+    """当前 span，没有时返回 None"""
+    return _current.get()
+
+
+def inject(headers):
+    """当前 span 在记录时，返回带 traceparent 的请求头副本，否则原样返回"""
+    current = _current.get()
+    traceparent = current.traceparent() if current is not None else None
+    if not traceparent:
+        return headers
+    headers = dict(headers or {})
+    headers["traceparent"] = traceparent
+    return headers
+
+
+def wrap(fn):
+    """让 fn 在当前上下文中执行，用于传给线程池，子线程中的 span 挂在当前 span 下"""
+    context = contextvars.copy_context()
+    # 同一个 Context 不能同时在多个线程中进入，每次调用使用副本
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+class _Exporter:
+    """后台批量导出，每批写一行 OTLP/JSON"""
+
+    def __init__(self, path, service_name, batch_size, flush_interval, max_queue):
+        self.path = path
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, spans):
+        for s in spans:
+            try:
+                self._queue.put_nowait(s)
+            except queue.Full:
+                metrics.incr("tracing.dropped")
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def _write(self, batch):
+        request = {"resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": self.service_name}},
+                {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+            ]},
+            "scopeSpans": [{"scope": {"name": "common.tracing"}, "spans": [s.to_otlp() for s in batch]}],
+        }]}
+        line = (json.dumps(request, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        # 单次 write 追加整行，多个进程写同一个文件时行不会交错
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                item = False
+            if item:
+                batch.append(item)
+            expired = time.monotonic() >= deadline
+            if batch and (item is None or expired or len(batch) >= self.batch_size):
+                self._write(batch)
+                batch = []
+            if expired:
+                deadline = time.monotonic() + self.flush_interval
+            if item is None:
+                return
+
+
+def _get_exporter():
+    global _exporter
+    exporter = _exporter
+    if exporter is None:
+        config = _get_config()
+        with _lock:
+            if _exporter is None:
+                _exporter = _Exporter(config.get("path") or DEFAULT_PATH, config["service_name"],
+                                      config["batch_size"], config["flush_interval"], config["max_queue"])
+            exporter = _exporter
+    return exporter
+
+
+def flush():
+    """导出已缓存的 span 并关闭导出线程（之后有新 span 时会重新创建）"""
+    global _exporter
+    with _lock:
+        exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.close()
@@ -1,5 +1,63 @@
 import sys
 import os
 
+import pytest
+
 # 将项目根目录添加到 Python 路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+# ============================================================
+# 会话级 fixture
+# 登录、读取配置、获取商品都推迟到第一个用到它的用例执行时，整个会话只做一次；
+# 收集用例（pytest --collect-only、-k 选择）时不访问网络，配置经 common.config_cache 缓存
+# ============================================================
+
+def _load_data(filename):
+    from common import config_cache
+    return config_cache.load(os.path.join(DATA_DIR, filename)) or {}
+
+
+@pytest.fixture(scope="session")
+def http():
+    """共享 HTTP 客户端（common.http_client），连接池在第一次请求时创建"""
+    from common import http_client
+    return http_client
+
+
+@pytest.fixture(scope="session")
+def token(http):
+    """默认账号的 accessToken，登录一次后由 common.token_cache 负责续期"""
+    from common.tool import get_token
+    return get_token()
+
+
+@pytest.fixture(scope="session")
+def chat_config():
+    """普通聊天测试配置（data/chat_data.yaml）"""
+    return _load_data("chat_data.yaml")
+
+
+@pytest.fixture(scope="session")
+def product_config():
+    """商品咨询测试配置（data/test_chat_product.yaml）"""
+    return _load_data("test_chat_product.yaml")
+
+
+@pytest.fixture(scope="session")
+def concurrent_config():
+    """并发对话测试配置（data/concurrent_chat.yaml）"""
+    return _load_data("concurrent_chat.yaml")
+
+
+@pytest.fixture(scope="session")
+def concurrent_product(token, concurrent_config):
+    """并发对话测试使用的商品（按 product_config 中的店铺和索引获取）"""
+    from api.product import get_product_by_index
+
+    product_config = concurrent_config['product_config']
+    product = get_product_by_index(token, shop_id=product_config['shop_id'], index=product_config['product_index'])
+    assert product is not None, "获取商品失败"
+    return product
@@ -1,13 +1,16 @@
 import os
-import yaml
+
+from common import config_cache
 
 
 def load_yaml(filename):
-    """读取 data 目录下的 YAML 文件"""
+    """读取 data 目录下的 YAML 文件（经 common.config_cache 缓存）"""
     filepath = os.path.join(os.path.dirname(__file__), filename)
-    with open(filepath, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+    return config_cache.load(filepath)
 
 
-_raw = load_yaml("chat_data.yaml")
-test_questions = _raw.get('test_questions', [])
+def __getattr__(name):
+    """test_questions 在第一次访问时才读取 chat_data.yaml，导入本模块不解析配置"""
+    if name == "test_questions":
+        return (load_yaml("chat_data.yaml") or {}).get('test_questions', [])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")